@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------
+#
+# Name: run_periods.py
+#
+# Purpose: Run period (epoch) table for MicroBooNE data.
+#
+#          This module contains the single definition of the mapping from
+#          run number to epoch, which is used by various scripts.  Two
+#          granularities are supported.
+#
+#          1.  Epochs ('0', '1a', '1b', '1c', '2a', '2b', '3a', '3b', '4a',
+#              '4b', '4c', '4d', '5', '6').  Epoch '0' means before run 1.
+#              Epochs compare correctly as strings ('1c' < '2b').
+#
+#          2.  Letter periods ('A', 'B', 'C1', ..., 'O'), which subdivide
+#              epochs into open trigger and shutdown periods.  Runs before
+#              period 'A' have letter period ''.
+#
+#          Lookups use a binary search over the sorted table of first runs.
+#          Functions get_epochs and get_letters classify a sequence of runs
+#          in one call.  If numpy is available, they are vectorized and
+#          return numpy arrays.  Otherwise they return lists.
+#
+# Created: 19-Oct-2026
+#
+# Command line usage:
+#
+# run_periods.py [options] [<run> ...]
+#
+# Options:
+#
+# -h|--help        - Print help message.
+# --letter         - Print letter period instead of epoch.
+# --runs           - Print run number in front of each epoch.
+# --range <e1>-<e2> - Don't print anything.  Exit with status 0 if all runs
+#                    are in epochs e1 through e2 (inclusive), otherwise
+#                    exit with status 1 (also if there are no runs).  A
+#                    single epoch may also be specified (--range <e>).
+#
+# Run numbers are taken from the command line, or from standard input
+# (one or more per line) if none are specified on the command line.
+# One epoch is printed per run.  Invalid run numbers are reported as a
+# usage error (exit status 1).
+#
+# Shell usage examples:
+#
+#   epoch=`run_periods.py $run`
+#   if run_periods.py --range 1a-2a $run; then ...
+#
+#----------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+import sys, bisect
+
+# Don't fail (on import) if numpy is not available.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Run period table.
+# Each entry is (first run, letter period, epoch, description).
+# Each period extends up to the first run of the next period.
+
+periods = [(0,      '',   '0',  'Before run 1.'),
+           (3420,   'A',  '1a', 'Run 1a open trigger 2 FEM.'),
+           (3985,   'B',  '1b', 'Run 1b open trigger 3 FEM.'),
+           (4952,   'C1', '1c', 'Run 1c normal software trigger.'),
+           (6999,   'C2', '1c', 'Run 1 shutdown.'),
+           (8317,   'D1', '2a', 'Run 2 open trigger.'),
+           (8406,   'D2', '2a', 'Run 2a before CRT.'),
+           (11049,  'E1', '2b', 'Run 2b after CRT.'),
+           (11952,  'E2', '2b', 'Run 2 shutdown.'),
+           (13697,  'F',  '3a', 'Run 3a before CRT clock fix.'),
+           (14117,  'G1', '3b', 'Run 3b after CRT clock fix.'),
+           (17567,  'G2', '3b', 'Run 3 shutdown.'),
+           (18961,  'H',  '4a', 'Run 4a.'),
+           (19753,  'I',  '4b', 'Run 4b.'),
+           (21286,  'J',  '4c', 'Run 4c.'),
+           (22270,  'K',  '4d', 'Run 4d.'),
+           (23260,  'L',  '4d', 'Run 4 shutdown 1.'),
+           (23543,  'M',  '4d', 'Run 4 shutdown 2.'),
+           (24320,  'N',  '5',  'Run 5.'),
+           (25770,  'O',  '6',  'Run 6.')]
+
+first_runs = [p[0] for p in periods]
+letters = [p[1] for p in periods]
+epochs = [p[2] for p in periods]
+
+
+# Find the index of the period containing the specified run.
+# Runs before the first period are assigned to the first period.
+
+def period_index(run):
+    return max(bisect.bisect_right(first_runs, run) - 1, 0)
+
+
+# Get the epoch of a run.
+
+def get_epoch(run):
+    return epochs[period_index(run)]
+
+
+# Get the letter period of a run.
+
+def get_letter(run):
+    return letters[period_index(run)]
+
+
+# Find period indices of a sequence of runs.
+
+def period_indices(runs):
+    if numpy != None:
+        index = numpy.searchsorted(first_runs, numpy.asarray(runs), side='right') - 1
+        return numpy.maximum(index, 0)
+    else:
+        return [period_index(run) for run in runs]
+
+
+# Get the epochs of a sequence of runs.
+
+def get_epochs(runs):
+    index = period_indices(runs)
+    if numpy != None:
+        return numpy.array(epochs)[index]
+    else:
+        return [epochs[i] for i in index]
+
+
+# Get the letter periods of a sequence of runs.
+
+def get_letters(runs):
+    index = period_indices(runs)
+    if numpy != None:
+        return numpy.array(letters)[index]
+    else:
+        return [letters[i] for i in index]
+
+
+# Get the range of runs (first, last) belonging to a range of epochs (inclusive).
+# The last run of the last epoch is None (unbounded).
+# Raise ValueError if either epoch is unknown.
+
+def epoch_runs(first_epoch, last_epoch=None):
+    if last_epoch == None:
+        last_epoch = first_epoch
+    if not first_epoch in epochs:
+        raise ValueError('Unknown epoch %s' % first_epoch)
+    if not last_epoch in epochs:
+        raise ValueError('Unknown epoch %s' % last_epoch)
+    first = first_runs[epochs.index(first_epoch)]
+    last = None
+    n = len(epochs) - epochs[::-1].index(last_epoch)
+    if n < len(first_runs):
+        last = first_runs[n] - 1
+    return first, last
+
+
+# Test whether a run belongs to a range of epochs (inclusive).
+
+def in_epochs(run, first_epoch, last_epoch=None):
+    first, last = epoch_runs(first_epoch, last_epoch)
+    return run >= first and (last == None or run <= last)
+
+
+# Print help.
+
+def help():
+
+    filename = sys.argv[0]
+    file = open(filename)
+
+    doprint=0
+
+    for line in file.readlines():
+        if line[2:16] == 'run_periods.py':
+            doprint = 1
+        elif line[0:6] == '#-----' and doprint:
+            doprint = 0
+        if doprint:
+            if len(line) > 2:
+                print(line[2:], end='')
+            else:
+                print()
+
+
+# Main procedure.
+
+def main(argv):
+
+    letter = False
+    print_runs = False
+    epoch_range = None
+    words = []
+    runs = []
+
+    args = argv[1:]
+    while len(args) > 0:
+        if args[0] == '-h' or args[0] == '--help':
+            help()
+            return 0
+        elif args[0] == '--letter':
+            letter = True
+            del args[0]
+        elif args[0] == '--runs':
+            print_runs = True
+            del args[0]
+        elif args[0] == '--range' and len(args) > 1:
+            epoch_range = args[1].split('-')
+            del args[0:2]
+        elif args[0].startswith('-') and not args[0][1:].isdigit():
+            print('Unknown option %s' % args[0])
+            return 1
+        else:
+            words.append(args[0])
+            del args[0]
+
+    # If no runs were specified on the command line, read runs from standard input.
+
+    if len(words) == 0:
+        for line in sys.stdin:
+            words.extend(line.split())
+
+    # Convert run numbers.
+
+    for word in words:
+        try:
+            runs.append(int(word))
+        except ValueError:
+            print('Invalid run number "%s"' % word, file=sys.stderr)
+            print('Usage: run_periods.py [-h|--help] [--letter] [--runs] [--range <e1>-<e2>] [<run> ...]',
+                  file=sys.stderr)
+            return 1
+
+    # Range test.
+    # An empty list of runs is not in any range.
+
+    if epoch_range != None:
+        if len(runs) == 0:
+            return 1
+        first, last = epoch_runs(*epoch_range[0:2])
+        for run in runs:
+            if run < first or (last != None and run > last):
+                return 1
+        return 0
+
+    # Print epochs.
+
+    if letter:
+        results = get_letters(runs)
+    else:
+        results = get_epochs(runs)
+    for run, result in zip(runs, results):
+        if print_runs:
+            print(run, result)
+        else:
+            print(result)
+    return 0
+
+
+# Invoke main program.
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -66,6 +66,20 @@ class ArtEventInfo(RootAnalyze):
         return ['EventAuxiliary']
 
 
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Allow parallel processing (option --jobs).
+        #          This module only extracts run, subrun, and event
+        #          numbers from the event auxiliary branch, and has no output.
+        #
+        # Returns: True.
+        #
+        #----------------------------------------------------------------------
+
+        return True
+
+
     def event_info(self, tree):
         #----------------------------------------------------------------------
         #
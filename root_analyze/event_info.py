@@ -54,6 +54,20 @@ class EventInfo(RootAnalyze):
         return ['run', 'subrun', 'event']
 
 
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Allow parallel processing (option --jobs).
+        #          This module only extracts run, subrun, and event
+        #          numbers, and has no output of its own.
+        #
+        # Returns: True.
+        #
+        #----------------------------------------------------------------------
+
+        return True
+
+
     def event_info(self, tree):
         #----------------------------------------------------------------------
         #
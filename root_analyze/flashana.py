@@ -68,6 +68,20 @@ class AnalyzeFlashes(RootAnalyze):
         return ['nfls_*', 'fls*']
 
 
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Allow parallel processing (option --jobs).
+        #          Flash histograms are filled entry by entry, so output from
+        #          several workers can be merged using hadd.
+        #
+        # Returns: True.
+        #
+        #----------------------------------------------------------------------
+
+        return True
+
+
     def open_output(self, output_file):
         #----------------------------------------------------------------------
         #
@@ -11,6 +11,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import sys, os
+import numpy
 from root_analyze import RootAnalyze
 
 # Prevent root from printing garbage on initialization.
@@ -56,7 +57,34 @@ class AnalyzeHits(RootAnalyze):
     def branches(self):
         #----------------------------------------------------------------------
         #
-        # Purpose: Return list of branches we want read for this tree.
+        # Purpose: Return list of branches we want loaded for each entry.
+        #          Hits are analyzed in batches, so no branches are needed.
+        #
+        # Returns: Empty list.
+        #
+        #----------------------------------------------------------------------
+
+        return []
+
+
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Allow parallel processing (option --jobs).
+        #          Histograms are filled from hit branches only, so output
+        #          from several workers can be merged using hadd.
+        #
+        # Returns: True.
+        #
+        #----------------------------------------------------------------------
+
+        return True
+
+
+    def batch_branches(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Return list of branches we want read as numpy arrays.
         #
         # Returns: List of hit-related branches.
         #
@@ -123,73 +151,78 @@ class AnalyzeHits(RootAnalyze):
         return
 
 
-    def getLeaf(self, tree, branch_name):
+    def fill(self, hist, x, y=None):
         #----------------------------------------------------------------------
         #
-        # Purpose: Utility function to return leaf information for a particular
-        #          branch.
+        # Purpose: Utility function to fill a histogram from numpy arrays.
         #
-        # Arguments: branch name.
+        # Arguments: hist - Histogram (TH1 or TH2).
+        #            x    - Array of x values.
+        #            y    - Array of y values (TH2 only).
         #
-        # Returns: Leaf (TLeaf).
+        #----------------------------------------------------------------------
+
+        if len(x) > 0:
+            if y is None:
+                hist.FillN(len(x), x, ROOT.nullptr)
+            else:
+                hist.FillN(len(x), x, y, ROOT.nullptr)
+
+
+    def flatten(self, column):
+        #----------------------------------------------------------------------
         #
-        # This function assumes one leaf/branch (true in case of analysis tree).
-        # The returned value is an instance of class TLeaf.  To get numeric 
-        # values, call TLeaf function GetValue(i), where i=array index or 0 for 
-        # scalar leaf.
+        # Purpose: Utility function to concatenate an array branch (one array
+        #          per entry) into a single array of doubles.
+        #
+        # Arguments: column - Object array of per-entry arrays (RVec).
+        #
+        # Returns: Numpy array.
         #
         #----------------------------------------------------------------------
 
-        result = None
-        br = tree.GetBranch(branch_name)
-        leaves = br.GetListOfLeaves()
-        if len(leaves) > 0:
-            result = leaves[0]
-        return result
+        if len(column) == 0:
+            return numpy.zeros(0)
+        return numpy.concatenate([numpy.asarray(v, dtype=numpy.float64) for v in column])
 
 
-    def analyze_entry(self, tree):
+    def analyze_batch(self, arrays):
         #----------------------------------------------------------------------
         #
-        # Purpose: Analyze loaded tree (fill histograms).  Called by framework.
+        # Purpose: Analyze a chunk of tree entries (fill histograms).  Called
+        #          by framework.
         #
-        # Arguments: tree - Loaded tree.
+        # Arguments: arrays - Dictionary of numpy arrays, indexed by branch name.
         #
         #----------------------------------------------------------------------
 
-        # Get leaves.
+        # Fill number of hits histogram.
+
+        self.fill(self.hno_hits, numpy.asarray(arrays['no_hits'], dtype=numpy.float64))
 
-        no_hits = self.getLeaf(tree, 'no_hits')
-        hit_plane = self.getLeaf(tree, 'hit_plane')
-        hit_wire = self.getLeaf(tree, 'hit_wire')
-        hit_channel = self.getLeaf(tree, 'hit_channel')
-        hit_peakT = self.getLeaf(tree, 'hit_peakT')
-        hit_charge = self.getLeaf(tree, 'hit_charge')
-        hit_ph = self.getLeaf(tree, 'hit_ph')
-        hit_nelec = self.getLeaf(tree, 'hit_nelec')
+        # Concatenate hits of all entries.
+
+        plane = self.flatten(arrays['hit_plane'])
+        wire = self.flatten(arrays['hit_wire'])
+        channel = self.flatten(arrays['hit_channel'])
+        peakT = self.flatten(arrays['hit_peakT'])
+        charge = self.flatten(arrays['hit_charge'])
+        ph = self.flatten(arrays['hit_ph'])
+        nelec = self.flatten(arrays['hit_nelec'])
 
         # Fill histograms.
 
-        self.hno_hits.Fill(no_hits.GetValue())
-
-        for i in range(hit_plane.GetLen()):
-
-            plane = int(hit_plane.GetValue(i))
-            wire = hit_wire.GetValue(i)
-            channel = hit_channel.GetValue(i)
-            peakT = hit_peakT.GetValue(i)
-            charge = hit_charge.GetValue(i)
-            ph = hit_ph.GetValue(i)
-            nelec = hit_nelec.GetValue(i)
-
-            self.hhit_plane.Fill(plane)
-            self.hhit_wire.Fill(wire)
-            self.hhit_channel.Fill(channel)
-            self.hhit_peakT.Fill(peakT)
-            self.hhit_charge[plane].Fill(charge)
-            self.hhit_ph[plane].Fill(ph)
-            self.hhit_nelec[plane].Fill(nelec)
-            self.hhit_charge_nelec[plane].Fill(nelec, charge)
-            self.hhit_ph_nelec[plane].Fill(nelec, ph)
-            if nelec > 0:
-                self.hphperelec[plane].Fill(ph/nelec)
+        self.fill(self.hhit_plane, plane)
+        self.fill(self.hhit_wire, wire)
+        self.fill(self.hhit_channel, channel)
+        self.fill(self.hhit_peakT, peakT)
+
+        for p in range(3):
+            sel = plane.astype(int) == p
+            self.fill(self.hhit_charge[p], charge[sel])
+            self.fill(self.hhit_ph[p], ph[sel])
+            self.fill(self.hhit_nelec[p], nelec[sel])
+            self.fill(self.hhit_charge_nelec[p], nelec[sel], charge[sel])
+            self.fill(self.hhit_ph_nelec[p], nelec[sel], ph[sel])
+            sel = sel & (nelec > 0)
+            self.fill(self.hphperelec[p], ph[sel] / nelec[sel])
@@ -103,6 +103,20 @@ class SamMetadata(RootAnalyze):
         return []
 
 
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Allow parallel processing (option --jobs).
+        #          The metadata returned by end_job is extracted from the
+        #          fcl configuration, and is the same for every worker.
+        #
+        # Returns: True.
+        #
+        #----------------------------------------------------------------------
+
+        return True
+
+
     def end_job(self):
         #----------------------------------------------------------------------
         #
@@ -19,10 +19,13 @@
 # -S|--source-list <list> - Input (file list).
 # --sam-web-uri <uri>     - SAM project uri (input project).
 # --sam-process-id <pid>  - SAM process ID (input project).
+# --sam-prefetch <n>      - Number of sam input files to prefetch (default 1).
+# --sam-prefetch-disk <MB> - Local disk budget for prefetched files (default 4000).
 # -o|--output <output>    - Specify output.
 # -T|--TFileName <output> - Specify output (synonymous with --output).
 # -n|--nevts <nev>        - Number of events to process.
 # --nskip                 - Number of events to skip.
+# -j|--jobs <n>           - Number of worker processes (file list input only).
 # --rethrow-default       - Ignored (for compatibility).
 #
 # Usage:
@@ -46,8 +49,9 @@
 # 3.  Reading the input TTree.
 # 4.  Setting input TTree branch statuses (load only selected branches).
 # 5.  Looping over and loading entries of input ntuples (event loop).
-# 6.  Calling analysis module function hooks at appropriate times.
-# 7.  Generating sam metadata for the output file.
+# 6.  Reading entries of input ntuples in chunks as numpy arrays (batch loop).
+# 7.  Calling analysis module function hooks at appropriate times.
+# 8.  Generating sam metadata for the output file.
 #
 # Reading input from sam
 #-----------------------
@@ -56,6 +60,31 @@
 # The project url and process id should be specified as command line arguments using
 # options --sam-web-uri and --sam-process-id.
 #
+# While the current input file is being analyzed, the next input file(s) are
+# fetched in a background thread (option --sam-prefetch, 0 to disable).
+# Prefetching pauses while the size of local copies (including the current
+# file) exceeds the disk budget (option --sam-prefetch-disk, 0 for no limit).
+# File statuses are updated to "transferred" when a file has been fetched,
+# and "consumed" when the framework has finished with the file, as without
+# prefetching.  Prefetched files that are never analyzed (for example, if the
+# event limit is reached) are updated to "skipped."  Prefetching is disabled
+# if input files are combined into a TChain.
+#
+# Parallel processing
+#--------------------
+#
+# If option --jobs is specified with more than one job, the input file list is
+# divided into contiguous groups of files, and each group is processed by a
+# separate worker process (an invocation of this script) with its own analyzer
+# objects.  Workers write temporary output and metadata files, which are
+# merged at the end.  Output root files are combined using hadd.  Sam metadata
+# are merged (runs, event counts and parents are combined).
+#
+# Parallel processing requires that all analyzers declare that they are
+# mergeable (see function "mergeable" in root_analyze.py).  Otherwise the job
+# runs in a single process.  Parallel processing is not supported for sam input, or
+# in combination with options --nevts or --nskip.
+#
 # Analysis modules
 #-----------------
 #
@@ -76,6 +105,23 @@
 # any base class functions.  Most analysis classes will want to overload 
 # function "analyze," which is called for each ntuple entry (event).
 #
+# Batch analysis
+#---------------
+#
+# Analysis classes that overload function "batch_branches" to return a nonempty
+# list of branches are also called through function "analyze_batch" with
+# chunks of up to batch_size entries.  The branches are read as numpy arrays
+# (using RDataFrame.AsNumpy), which is much faster than accessing leaves one
+# element at a time.  The batch loop runs after the entry loop, on the same
+# range of entries (respecting --nskip and --nevts).  If the entry loop is
+# disabled (loop_over_entries : false), only batch analysis is done.
+# Batch branches are only activated for the batch loop, so they are not read
+# by the entry loop (unless also requested by function "branches").  One
+# RDataFrame is made per tree, and each chunk is read separately, so that at
+# most batch_size entries are held in memory at a time.  If the entry loop
+# doesn't read any entries (no branches are active), event counts are updated
+# by the batch loop.
+#
 # Fcl file format
 #----------------
 #
@@ -83,11 +129,13 @@
 # input_tree : "anatree"             # Name of input TTree (name or path).
 # modules : { module1 : config1
 #             module2 : config2 }
+# batch_size : 1000                  # Entries per chunk for batch analysis.
 #
 ###############################################################################
 from __future__ import absolute_import
 from __future__ import print_function
-import sys, os, imp, fcl, json, datetime
+import sys, os, imp, fcl, json, datetime, fnmatch
+import subprocess, tempfile, shutil, threading
 
 # Prevent root from printing garbage on initialization.
 if 'TERM' in os.environ:
@@ -109,6 +157,10 @@ Ifdh = None
 
 transferred_files = set()
 
+# Sam prefetcher object.
+
+Prefetcher = None
+
 
 def help():
     #----------------------------------------------------------------------
@@ -133,15 +185,17 @@ def help():
                 print()
 
 
-def sam_iter(prjurl, pid, cleanup=True):
+def sam_iter(prjurl, pid, cleanup=True, prefetch=0, prefetch_disk=0):
     #----------------------------------------------------------------------
     #
     # Purpose: A sam generator.
     #
-    # Arguments: prjurl  - Project url.
-    #            pid     - Process id.
-    #            cleanup - If true, delete local copies each time a file 
-    #                      is marked "consumed."
+    # Arguments: prjurl        - Project url.
+    #            pid           - Process id.
+    #            cleanup       - If true, delete local copies each time a file 
+    #                            is marked "consumed."
+    #            prefetch      - Number of files to fetch in advance (0 = none).
+    #            prefetch_disk - Disk budget for local copies (MB, 0 = no limit).
     #
     # Returns: A sam iterator.
     #
@@ -157,7 +211,7 @@ def sam_iter(prjurl, pid, cleanup=True):
     #
     #----------------------------------------------------------------------
 
-    global Ifdh, transferred_files
+    global Ifdh, Prefetcher, transferred_files
 
     # Initialize ifdh object, if not already done.
 
@@ -165,6 +219,34 @@ def sam_iter(prjurl, pid, cleanup=True):
         import ifdh
         Ifdh = ifdh.ifdh()
 
+    # Prefetching file loop.
+
+    if prefetch > 0:
+        Prefetcher = SamPrefetcher(prjurl, pid, prefetch, prefetch_disk * 1024 * 1024)
+        current_file = None
+        current_size = 0
+        while True:
+
+            # Release most recent file, if any.
+            # Local copies are deleted individually, since other local copies
+            # may be prefetched files that have not been analyzed yet.
+
+            if current_file:
+                sam_clean(prjurl, pid, cleanup=False)
+                if cleanup and os.path.exists(current_file):
+                    os.remove(current_file)
+                Prefetcher.release(current_size)
+
+            # Get next file (wait for prefetcher).
+
+            next_file = Prefetcher.next_file()
+            if next_file:
+                current_file, current_size = next_file
+                transferred_files.add(os.path.basename(current_file))
+                yield current_file
+            else:
+                return
+
     # File loop.
 
     current_file = None
@@ -215,6 +297,197 @@ def sam_iter(prjurl, pid, cleanup=True):
             return
 
 
+class SamPrefetcher:
+    #----------------------------------------------------------------------
+    #
+    # Purpose: Fetch sam input files in a background thread.
+    #
+    # The background thread gets and fetches files using its own ifdh object,
+    # and updates file statuses to "transferred" or "skipped."  Fetched files
+    # are staged until the main thread takes them (function next_file).  The
+    # main thread updates file statuses to "consumed."
+    #
+    #----------------------------------------------------------------------
+
+    def __init__(self, prjurl, pid, prefetch, disk):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Constructor.  Start background thread.
+        #
+        # Arguments: prjurl   - Project url.
+        #            pid      - Process id.
+        #            prefetch - Maximum number of staged files.
+        #            disk     - Disk budget (bytes, 0 = no limit).
+        #
+        #----------------------------------------------------------------------
+
+        import ifdh
+        self.ifdh = ifdh.ifdh()
+        self.prjurl = prjurl
+        self.pid = pid
+        self.prefetch = prefetch
+        self.disk = disk
+        self.staged = []             # Staged files (path, size).
+        self.bytes = 0               # Size of staged and current files.
+        self.finished = False        # No more files from sam.
+        self.stopped = False         # Stop requested.
+        self.error = None            # Exception raised in background thread.
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.fetch_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def fetch_loop(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Background thread main loop.
+        #
+        #----------------------------------------------------------------------
+
+        # Any exception is saved and reraised in the main thread (function
+        # next_file).  The finished flag is always set, so that the main
+        # thread doesn't wait forever.
+
+        try:
+            while True:
+
+                # Wait until there is room for another file.
+
+                self.cond.acquire()
+                while not self.stopped and (len(self.staged) >= self.prefetch or \
+                                            (self.disk > 0 and self.bytes >= self.disk)):
+                    self.cond.wait()
+                stopped = self.stopped
+                self.cond.release()
+                if stopped:
+                    break
+
+                # Get next file.
+
+                url = self.ifdh.getNextFile(self.prjurl, self.pid)
+                if not url:
+                    break
+                print('Delivered file = %s' % url)
+
+                # Fetch the input file.
+
+                ok = False
+                try:
+                    local_file = self.ifdh.fetchInput(url)
+                    ok = True
+                except:
+                    ok = False
+
+                # If transfer failed.  Update file status to "skipped."
+
+                if not ok:
+                    print('Skipped file = %s' % url)
+                    self.ifdh.updateFileStatus(self.prjurl, self.pid, os.path.basename(url), 'skipped')
+                    continue
+
+                # Transfer succeeded.  Update file status to "transferred."
+
+                print('Transferred file = %s' % local_file)
+                self.ifdh.updateFileStatus(self.prjurl, self.pid, os.path.basename(local_file), 'transferred')
+                size = os.path.getsize(local_file)
+                self.cond.acquire()
+                self.staged.append((local_file, size))
+                self.bytes += size
+                self.cond.notify_all()
+                self.cond.release()
+
+        except Exception as e:
+            self.error = e
+
+        finally:
+
+            # No more files.
+
+            self.cond.acquire()
+            self.finished = True
+            self.cond.notify_all()
+            self.cond.release()
+
+
+    def next_file(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Take the next staged file.  Wait until a file is available.
+        #
+        # Returns: 2-tuple (local file, size), or None if there are no more files.
+        #
+        # If the background thread failed, its exception is raised here, after
+        # all files staged before the failure have been taken.
+        #
+        #----------------------------------------------------------------------
+
+        result = None
+        self.cond.acquire()
+        while len(self.staged) == 0 and not self.finished:
+            self.cond.wait()
+        if len(self.staged) > 0:
+            result = self.staged.pop(0)
+            self.cond.notify_all()
+        error = self.error
+        self.cond.release()
+        if result == None and error != None:
+            raise error
+        return result
+
+
+    def release(self, size):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Release disk budget of a consumed file.
+        #
+        # Arguments: size - File size (bytes).
+        #
+        #----------------------------------------------------------------------
+
+        self.cond.acquire()
+        self.bytes -= size
+        self.cond.notify_all()
+        self.cond.release()
+
+
+    def close(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Stop background thread.  Update status of staged files
+        #          that were never taken to "skipped" and delete them.
+        #
+        #----------------------------------------------------------------------
+
+        self.cond.acquire()
+        self.stopped = True
+        self.cond.notify_all()
+        self.cond.release()
+        self.thread.join()
+
+        for local_file, size in self.staged:
+            print('Skipped file = %s' % local_file)
+            self.ifdh.updateFileStatus(self.prjurl, self.pid, os.path.basename(local_file), 'skipped')
+            if os.path.exists(local_file):
+                os.remove(local_file)
+        self.staged = []
+        self.ifdh.cleanup()
+
+
+def sam_close():
+    #----------------------------------------------------------------------
+    #
+    # Purpose: Stop sam prefetching, if any.
+    #
+    #----------------------------------------------------------------------
+
+    global Prefetcher
+
+    if Prefetcher != None:
+        Prefetcher.close()
+        Prefetcher = None
+
+
 def sam_clean(prjurl, pid, cleanup=True):
     #----------------------------------------------------------------------
     #
@@ -248,6 +521,163 @@ def sam_clean(prjurl, pid, cleanup=True):
     return  
 
 
+def make_analyzers(pset):
+    #----------------------------------------------------------------------
+    #
+    # Purpose: Import analysis modules and make analyzer objects.
+    #
+    # Arguments: pset - Pythonized fcl configuration (dictionary).
+    #
+    # Returns: List of analyzer objects.
+    #
+    #----------------------------------------------------------------------
+
+    analyzers = []
+    for module_name in pset['modules']:
+        print('Importing module %s' % module_name)
+        sys.path.append('.')          # Make sure local directory is on import path.
+        fp, pathname, description = imp.find_module(module_name)
+        module = imp.load_module(module_name, fp, pathname, description)
+        print('Making analyzer object.')
+        analyzer = module.make(pset)
+        analyzers.append(analyzer)
+    return analyzers
+
+
+def merge_metadata(json_names):
+    #----------------------------------------------------------------------
+    #
+    # Purpose: Merge sam metadata json files of worker processes.
+    #
+    # Arguments: json_names - List of metadata json files (in input order).
+    #
+    # Returns: Merged metadata (python dictionary).
+    #
+    # Runs and parents are combined (without duplicates), event counts are
+    # summed, and the first/last event and start/end time are taken from the
+    # first/last worker.  Other metadata are taken from the first worker.
+    #
+    #----------------------------------------------------------------------
+
+    metadata = {}
+    runs = []
+    parents = []
+    for json_name in json_names:
+        mf = open(json_name)
+        md = json.load(mf)
+        mf.close()
+        for key in md:
+            if key == 'start_time':
+                if key not in metadata or md[key] < metadata[key]:
+                    metadata[key] = md[key]
+            elif key == 'end_time':
+                if key not in metadata or md[key] > metadata[key]:
+                    metadata[key] = md[key]
+            elif key == 'first_event':
+                if metadata.get(key) == None:
+                    metadata[key] = md[key]
+            elif key == 'last_event':
+                if md[key] != None or key not in metadata:
+                    metadata[key] = md[key]
+            elif key == 'event_count':
+                metadata[key] = metadata.get(key, 0) + md[key]
+            elif key == 'runs':
+                for run in md[key]:
+                    if not run in runs:
+                        runs.append(run)
+                metadata[key] = runs
+            elif key == 'parents':
+                for parent in md[key]:
+                    if not parent in parents:
+                        parents.append(parent)
+                metadata[key] = parents
+            elif key not in metadata:
+                metadata[key] = md[key]
+    return metadata
+
+
+def run_jobs(config, input_file_names, output_file_name, jobs):
+    #----------------------------------------------------------------------
+    #
+    # Purpose: Run the framework in parallel worker processes and merge the
+    #          output (file-parallel mode).
+    #
+    # Arguments: config           - Fcl configuration file.
+    #            input_file_names - List of input files.
+    #            output_file_name - Output file.
+    #            jobs             - Number of worker processes.
+    #
+    # Returns: Exit status (0 = success).
+    #
+    # Each worker processes a contiguous group of input files by invoking this
+    # script with its own file list and a temporary output file.  Temporary
+    # files are kept in a directory next to the output file, which is deleted
+    # after a successful merge.
+    #
+    #----------------------------------------------------------------------
+
+    jobs = min(jobs, len(input_file_names))
+    tmpdir = tempfile.mkdtemp(prefix='lar_jobs_',
+                              dir=os.path.dirname(os.path.abspath(output_file_name)))
+
+    # Start workers.
+
+    procs = []
+    outputs = []
+    for job in range(jobs):
+        files = input_file_names[job * len(input_file_names) // jobs :
+                                 (job + 1) * len(input_file_names) // jobs]
+        list_name = os.path.join(tmpdir, 'input_%d.list' % job)
+        lf = open(list_name, 'w')
+        for file in files:
+            lf.write('%s\n' % file)
+        lf.close()
+        output = os.path.join(tmpdir, 'output_%d.root' % job)
+        outputs.append(output)
+        cmd = [sys.executable, os.path.abspath(sys.argv[0]),
+               '-c', config, '-S', list_name, '-o', output]
+        print('Starting job %d with %d input files.' % (job, len(files)))
+        procs.append(subprocess.Popen(cmd))
+
+    # Wait for workers to finish.
+
+    rc = 0
+    for job in range(jobs):
+        status = procs[job].wait()
+        if status != 0:
+            print('Job %d failed with status %d.' % (job, status))
+            rc = 1
+
+    # Merge output files.
+
+    if rc == 0:
+        print('Merging output files.')
+        rc = subprocess.call(['hadd', '-f', output_file_name] + outputs)
+        if rc != 0:
+            print('Merging output files failed.')
+
+    # Merge sam metadata.
+
+    if rc == 0:
+        print('Merging metadata.')
+        metadata = merge_metadata([output + '.json' for output in outputs])
+        mf = open(output_file_name + '.json', 'w')
+        json.dump(metadata, mf, indent=2, sort_keys=True)
+        mf.write('\n')
+        mf.close()
+
+    # Clean up.
+
+    if rc == 0:
+        shutil.rmtree(tmpdir)
+    else:
+        print('Temporary files kept in %s' % tmpdir)
+
+    # Done.
+
+    return rc
+
+
 # Framework class
 
 class Framework:
@@ -297,11 +727,13 @@ class Framework:
         self.module_names = pset['modules']                  # Analysis modules.
         self.chain = pset['chain']                           # Combine TTrees into one TChain?
         self.dump_every = pset['dump_every']                 # Generate output every N entries.
+        self.batch_size = pset['batch_size']                 # Entries per batch analysis chunk.
 
         # Other class data members.
 
         self.output_file = None               # Output TFile object.
         self.analyzers = []                   # Analyzer objects.
+        self.batch_analyzers = []             # Analyzer objects that use batch analysis.
         self.branch_names = []                # Branch names to load.
         self.input_file = None                # Currently open input TFile object.
         self.trees = []                       # Current input TTrees.
@@ -330,14 +762,7 @@ class Framework:
 
         # Import analysis modules and make analyzer objects.
 
-        for module_name in self.module_names:
-            print('Importing module %s' % module_name)
-            sys.path.append('.')          # Make sure local directory is on import path.
-            fp, pathname, description = imp.find_module(module_name)
-            module = imp.load_module(module_name, fp, pathname, description)
-            print('Making analyzer object.')
-            analyzer = module.make(self.pset)
-            self.analyzers.append(analyzer)
+        self.analyzers = make_analyzers(self.pset)
 
         # Call the open output function of each analyzer.
         # Save list of branches to load.
@@ -347,6 +772,11 @@ class Framework:
             for branch_name in analyzer.branches():
                 print('Read branch %s' % branch_name)
                 self.branch_names.append(branch_name)
+            batch_branch_names = analyzer.batch_branches()
+            for branch_name in batch_branch_names:
+                print('Read batch branch %s' % branch_name)
+            if len(batch_branch_names) > 0:
+                self.batch_analyzers.append(analyzer)
 
 
         # Update metadata.
@@ -480,8 +910,11 @@ class Framework:
         #
         # Arguments: tree - TTree object.
         #
+        # Returns: Number of entries read.
+        #
         #----------------------------------------------------------------------
 
+        nread = 0
         entries = 0
         if tree.InheritsFrom('TChain'):
             entries = tree.GetEntries()
@@ -507,6 +940,7 @@ class Framework:
             nb = tree.GetEntry( jentry )
             if nb <= 0:
                 continue
+            nread += 1
 
             # Extract the current (run, subrun, event).
             # Since this script doesn't know where run, subrun, and event are
@@ -590,6 +1024,110 @@ class Framework:
 
         # Done.
 
+        return nread
+
+
+    def entry_range(self, tree):
+        #----------------------------------------------------------------------
+        # 
+        # Purpose: Calculate the range of entries of the input tree that will
+        #          be processed, taking into account events remaining to be
+        #          skipped and processed.
+        #
+        # Arguments: tree - TTree object.
+        #
+        # Returns: 2-tuple (first, last), where last is one past the last entry.
+        #
+        #----------------------------------------------------------------------
+
+        entries = tree.GetEntries()
+        first = min(self.nskip, entries)
+        last = entries
+        if self.nev > 0:
+            last = min(entries, first + self.nev)
+        return first, last
+
+
+    def read_batch(self, tree, first, last, count_events):
+        #----------------------------------------------------------------------
+        # 
+        # Purpose: Read a range of entries of the input tree in chunks of
+        #          batch_size entries as numpy arrays, and call "analyze_batch"
+        #          functions provided by batch analysis modules (the batch loop).
+        #
+        # Arguments: tree         - TTree object.
+        #            first        - First entry.
+        #            last         - Last entry (one past).
+        #            count_events - Update event counts (entry loop didn't).
+        #
+        # If the entry loop is disabled, event skip count is updated here.
+        # If count_events is true, event counts, which are otherwise updated
+        # by the entry loop, are also updated here.
+        #
+        #----------------------------------------------------------------------
+
+        # Expand branch names (wildcards) of each analyzer.
+
+        tree_branch_names = [branch.GetName() for branch in tree.GetListOfBranches()]
+        columns = []
+        all_columns = []
+        for analyzer in self.batch_analyzers:
+            analyzer_columns = []
+            for pattern in analyzer.batch_branches():
+                for branch_name in tree_branch_names:
+                    if fnmatch.fnmatchcase(branch_name, pattern) and \
+                       not branch_name in analyzer_columns:
+                        analyzer_columns.append(branch_name)
+                        if not branch_name in all_columns:
+                            all_columns.append(branch_name)
+            columns.append(analyzer_columns)
+
+        # Activate batch branches (inactive during the entry loop).
+
+        if len(all_columns) > 0 and last > first:
+            for column in all_columns:
+                tree.SetBranchStatus(column, 1)
+
+            # Loop over chunks.
+            # Each chunk is read from the same RDataFrame.
+
+            df = ROOT.RDataFrame(tree)
+            for start in range(first, last, self.batch_size):
+                stop = min(start + self.batch_size, last)
+                print('Batch = %d-%d/ %d' % (start, stop, last))
+                arrays = df.Range(start, stop).AsNumpy(all_columns)
+
+                # Call analyze batch function for each batch analyzer.
+
+                for analyzer, analyzer_columns in zip(self.batch_analyzers, columns):
+                    analyzer.analyze_batch(dict([(column, arrays[column]) \
+                                                 for column in analyzer_columns]))
+                del arrays
+
+            # Restore branch statuses of the entry loop.
+
+            for column in all_columns:
+                active = False
+                for pattern in self.branch_names:
+                    if fnmatch.fnmatchcase(column, pattern):
+                        active = True
+                        break
+                if not active:
+                    tree.SetBranchStatus(column, 0)
+
+        # Update event counts.
+
+        if not self.loop_over_entries:
+            self.nskip -= first
+        if count_events:
+            self.event_count += last - first
+            if self.nev > 0:
+                self.nev -= last - first
+                if self.nev == 0:
+                    self.done = True
+
+        # Done.
+
         return
 
 
@@ -808,8 +1346,15 @@ class Framework:
 
                     # Read entries.
 
+                    first, last = self.entry_range(tree)
+                    nread = 0
                     if self.loop_over_entries:
-                        self.read(tree)
+                        nread = self.read(tree)
+
+                    # Read entries in chunks for batch analyzers.
+
+                    if len(self.batch_analyzers) > 0:
+                        self.read_batch(tree, first, last, nread == 0)
 
                 # Close input file.
 
@@ -828,8 +1373,15 @@ class Framework:
 
             # Read entries.
 
+            first, last = self.entry_range(tchain)
+            nread = 0
             if self.loop_over_entries:
-                self.read(tchain)
+                nread = self.read(tchain)
+
+            # Read entries in chunks for batch analyzers.
+
+            if len(self.batch_analyzers) > 0:
+                self.read_batch(tchain, first, last, nread == 0)
 
         # End the current run and subrun.
 
@@ -874,6 +1426,9 @@ def main(argv):
     outfile = 'hist.root'
     nev = 0
     nskip = 0
+    jobs = 1
+    prefetch = 1
+    prefetch_disk = 4000
     args = argv[1:]
     while len(args) > 0:
         if args[0] == '-h' or args[0] == '--help':
@@ -894,6 +1449,12 @@ def main(argv):
         elif args[0] == '--sam-process-id' and len(args) > 1:
             pid = args[1]
             del args[0:2]
+        elif args[0] == '--sam-prefetch' and len(args) > 1:
+            prefetch = int(args[1])
+            del args[0:2]
+        elif args[0] == '--sam-prefetch-disk' and len(args) > 1:
+            prefetch_disk = int(args[1])
+            del args[0:2]
         elif (args[0] == '-o' or args[0] == '--output' or \
                   args[0] == '-T' or args[0] == '--TFileName') and len(args) > 1:
             outfile = args[1]
@@ -904,6 +1465,9 @@ def main(argv):
         elif args[0] == '--nskip' and len(args) > 1:
             nskip = int(args[1])
             del args[0:2]
+        elif (args[0] == '-j' or args[0] == '--jobs') and len(args) > 1:
+            jobs = int(args[1])
+            del args[0:2]
         elif args[0] == '--rethrow-default':
             del args[0]
         else:
@@ -922,6 +1486,8 @@ def main(argv):
         pset['chain'] = False
     if 'dump_every' not in pset:
         pset['dump_every'] = 10
+    if 'batch_size' not in pset:
+        pset['batch_size'] = 1000
 
     # Validate arguments.
 
@@ -950,7 +1516,10 @@ def main(argv):
         # Input from sam.
 
         n = n + 1
-        input_iter = sam_iter(prjurl, pid, cleanup=not pset['chain'])
+        if pset['chain']:
+            prefetch = 0
+        input_iter = sam_iter(prjurl, pid, cleanup=not pset['chain'],
+                              prefetch=prefetch, prefetch_disk=prefetch_disk)
 
     if n == 0:
         print('No input specified.')
@@ -959,6 +1528,30 @@ def main(argv):
         print('More than one input specified.')
         return 1
 
+    # Parallel processing.
+
+    if jobs > 1:
+        if prjurl != '':
+            print('Option --jobs is not supported for sam input.')
+            return 1
+        if nev > 0 or nskip > 0:
+            print('Option --jobs is not supported with --nevts or --nskip.')
+            return 1
+        input_files = []
+        for line in input_iter:
+            if line.strip() != '':
+                input_files.append(line.strip())
+        input_iter = input_files
+        if len(input_files) > 1:
+            mergeable = True
+            for analyzer in make_analyzers(pset):
+                if not analyzer.mergeable():
+                    print('Analyzer %s is not mergeable.' % type(analyzer).__name__)
+                    mergeable = False
+            if mergeable:
+                return run_jobs(config, input_files, outfile, jobs)
+            print('Running in a single process.')
+
     # Create framework object.
 
     fwk = Framework(pset, input_iter, outfile, nev, nskip)
@@ -970,6 +1563,7 @@ def main(argv):
     # Sam final cleanup.
 
     if prjurl != '':
+        sam_close()
         sam_clean(prjurl, pid, cleanup=True)
 
     # Done
@@ -35,6 +35,25 @@ class RootAnalyze:
 
         return ['*']
 
+    def mergeable(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Specify whether the output of this module can be produced by
+        #          several independent instances (worker processes) and merged.
+        #          Called by the framework before running in parallel mode.
+        #
+        # Returns: True or False.
+        #
+        # Histograms and TTrees written to the output file are merged using
+        # hadd.  Metadata returned by function end_job is taken from the first
+        # instance.  Modules must opt in by returning True after checking that
+        # their results are merged correctly.  This base class provides a
+        # default implementation that returns False.
+        #
+        #----------------------------------------------------------------------
+
+        return False
+
     def open_output(self, tfile):
         #----------------------------------------------------------------------
         #
@@ -97,6 +116,42 @@ class RootAnalyze:
 
         return
 
+    def batch_branches(self):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Specify which branches should be read as numpy arrays and
+        #          passed to function analyze_batch.  Called once by the
+        #          framework at initialization.
+        #
+        # Returns: List or tuple of branch names.
+        #
+        # The returned list of branch names can include wildcards.  Modules
+        # that return a nonempty list opt in to batch analysis.  This base
+        # class provides a default implementation that returns an empty list
+        # (no batch analysis).
+        #
+        #----------------------------------------------------------------------
+
+        return []
+
+    def analyze_batch(self, arrays):
+        #----------------------------------------------------------------------
+        #
+        # Purpose: Called by the framework for each chunk of TTree entries.
+        #          Only called for modules that specify batch branches.
+        #
+        # Arguments: arrays - Dictionary of numpy arrays, indexed by branch
+        #                     name, with one array element per entry.
+        #
+        # Returns: None
+        #
+        # Scalar branches are returned as numeric arrays.  Array branches are
+        # returned as object arrays, with one RVec element per entry.
+        #
+        #----------------------------------------------------------------------
+
+        return
+
     def begin_job(self):
         #----------------------------------------------------------------------
         #
@@ -14,7 +14,19 @@
 # -h|--help            - Print help message.
 # -f|--file <path>     - Specify file to check (full path, repeatable).
 # -d|--dir <dir>       - Check all .root files in specified directory (repeatable).
+# --def <dataset>      - Check files in sam dataset (streamed using xrootd).
 # -c|--config <fcl>    - Check fcl file.
+# -j|--jobs <n>        - Check up to n files concurrently (default 1).
+# --cache <db>         - Cache configuration check results in sqlite database <db>.
+# --json <path>        - Write structured results to file in json lines format.
+# --external           - Use external programs (lar, config_dumper) to extract
+#                        trigger bits and fcl configurations from artroot files.
+#
+# The following options control sampling (only for dataset mode).
+#
+# --sample <n>         - Check at most n files (default all).
+# --max-fingerprints <n> - Stop after n distinct configuration fingerprints have been
+#                        seen (default no limit).
 #
 # The following options control variations (only for fcl mode).
 #
@@ -84,13 +96,50 @@
 # 4.  When checking artroot files, trigger, beam, epoch, and overlay arguments
 #     are ignored.  They are determined from file itself.
 #
+# 5.  With option -j, files are checked in a pool of worker processes.
+#     The output for each file is buffered and printed as a block when
+#     that file is finished, so files will not be printed in a fixed order.
+#     The summary and exit status are the same as in serial mode.
+#
+# 6.  With option --cache, the fcl configuration extracted from each artroot
+#     file is reduced to a fingerprint (sha1 hash of the parameter sets in
+#     canonical form, excluding per-job source parameters such as fileNames).
+#     The fingerprint is calculated before the configuration is parsed by
+#     fhicl, so for files with a cached result, neither config_dumper (if the
+#     configuration is extracted in-process) nor fhicl parsing is needed.  Configuration
+#     check results are stored in the cache database keyed by fingerprint,
+#     trigger bit, beam, epoch, overlay flag, and selected checks.  Files with
+#     a known fingerprint reuse the stored result (and printed report) without
+#     rerunning the checks.  The key also includes a hash of this script,
+#     so changing any check invalidates previous results.
+#     CRT merge checks are not cached.
+#
+# 7.  By default, trigger bits and fcl configurations are extracted from artroot
+#     files in-process using pyroot (trigger bits from the daq raw::Trigger data
+#     product, fcl configurations from the RootFileDB parameter set database,
+#     with nested parameter set references resolved).  Both local files and
+#     urls (xrootd) are supported.  If in-process extraction fails (e.g. for
+#     unresolved references), the external programs "lar -c dump_triggers.fcl"
+#     and "config_dumper" are used.
+#
+# 8.  In dataset mode (option --def), files are not copied.  Files are opened
+#     by xrootd url, and sam metadata is fetched in bulk for the whole dataset.
+#     Files are checked in stratified order, cycling over epochs and runs, so
+#     that a small sample (option --sample) covers as many epochs and runs as
+#     possible.  Option --max-fingerprints stops checking once the specified
+#     number of distinct configurations have been seen.  Since files from
+#     one campaign usually share one configuration, this allows a whole
+#     dataset to be validated by checking a few files.
+#
 ########################################################################
 
 from __future__ import print_function
-import sys, os, random, subprocess, io, json
+import sys, os, random, subprocess, io, json, traceback, re, hashlib, time, tempfile, fnmatch
+import multiprocessing, sqlite3, ctypes
 import larbatch_utilities
 import fcl
 import check_crt_merge
+import run_periods
 import samweb_cli
 
 # Import ROOT module.
@@ -113,6 +162,20 @@ artroot_files = set()        # Files that are known to be artroot.
 non_artroot_files = set()    # Files that are known to not be artroot.
 warnfatal = False            # Make all warnings fatal.  This is true by default in fcl mode.
 skip_processes = set()       # Skip process names.
+config_cache = ''            # Path of configuration fingerprint cache database (empty = no cache).
+config_cache_conn = None     # Open connection to cache database.
+config_cache_pid = 0         # Process id that owns config_cache_conn.
+inprocess = True             # Extract trigger bits and fcl configurations in-process.
+root_file = None             # Most recently opened root file (tuple (path, TFile)).
+metadata_cache = {}          # Sam metadata of ancestor files, indexed by file name.
+beam_clues = {}              # Beam type clues (beam, source), indexed by file name.
+ancestry_batch_size = 100    # Maximum number of files per getMultipleMetadata call.
+last_fingerprint = ''        # Configuration fingerprint of most recently checked file.
+json_enabled = False         # Collect structured results.
+json_records = []            # Structured results for the current file.
+report_context = {}          # Current check, process, and module for structured results.
+file_info = {}               # Epoch, beam, etc. for the current file.
+json_out = None              # Json output file.
 
 # Help function.
 
@@ -135,6 +198,91 @@ def help():
                 print()
 
 
+# Structured results.
+#
+# Each check result is printed and, if json output is enabled, also saved as a
+# result record (a dictionary) in json_records.  Records are written in json
+# lines format (one json object per line) after each file is checked.
+# The following types of records are written.
+#
+# {"type": "result", "file", "check", "process", "module", "module_type",
+#  "status", "message", "expected", "observed"}
+#                       - Single check of one process or module.
+# {"type": "check", "file", "check", "status"}
+#                       - Overall result of one check for one file.
+# {"type": "file", "file", "status", "fingerprint", "epoch", "beam", "trigbit", "overlay"}
+#                       - Overall result for one file.
+# {"type": "summary", "files", "files_ok", "failed_checks", "rc"}
+#                       - Summary for all files (last record).
+#
+# Status is one of "ok", "warning", "error" (or "ignored" for files).
+
+
+# Set context for structured results.
+# Check name is kept unless specified.
+
+def set_report_context(check=None, process=None, module=None, module_type=None):
+
+    global report_context
+
+    if check == None and 'check' in report_context:
+        check = report_context['check']
+    report_context = {'check': check,
+                      'process': process,
+                      'module': module,
+                      'module_type': module_type}
+
+
+# Report a check result.
+# Status is "ok", "warning" (printed with "?????"), or "error" (printed with "*****").
+
+def report(status, message, expected=None, observed=None):
+
+    marker = ''
+    if status == 'warning':
+        marker = '????? '
+    elif status == 'error':
+        marker = '***** '
+    print('  %s%s' % (marker, message))
+    if json_enabled:
+        record = {'type': 'result'}
+        record.update(report_context)
+        record['status'] = status
+        record['message'] = message
+        record['expected'] = expected
+        record['observed'] = observed
+        json_records.append(record)
+
+
+# Start and end a check.
+
+def begin_check(check):
+    set_report_context(check=check)
+
+
+def end_check(check, ok):
+    if json_enabled:
+        status = 'ok'
+        if not ok:
+            status = 'error'
+        json_records.append({'type': 'check', 'check': check, 'status': status})
+    set_report_context(check=None)
+
+
+# Write structured results.
+# The file name is added to each record.
+
+def write_json_records(f, records):
+
+    if json_out == None:
+        return
+    for record in records:
+        record = dict(record)
+        record['file'] = f
+        json_out.write('%s\n' % json.dumps(record, sort_keys=True))
+    json_out.flush()
+
+
 # Determine epoch from metadata dictionary.
 
 def get_epoch(md):
@@ -152,37 +300,9 @@ def get_epoch(md):
 
     for run in runs:
 
-        # Determine epoch (1a-5) for this run.
-
-        epoch = ''
-        if run > 25769:
-            epoch = '6'
-        elif run > 24319:
-            epoch = '5'
-        elif run > 22269:
-            epoch = '4d'
-        elif run > 21285:
-            epoch = '4c'
-        elif run > 19752:
-            epoch = '4b'
-        elif run > 18960:
-            epoch = '4a'
-        elif run > 14116:
-            epoch = '3b'
-        elif run > 13696:
-            epoch = '3a'
-        elif run > 11048:
-            epoch = '2b'
-        elif run > 8316:
-            epoch = '2a'
-        elif run > 4951:
-            epoch = '1c'
-        elif run > 3984:
-            epoch = '1b'
-        elif run > 3419:
-            epoch = '1a'
-        else:
-            epoch = '0'
+        # Determine epoch (0-6) for this run.
+
+        epoch = run_periods.get_epoch(run)
 
         if not epoch in epochs:
             epochs.add(epoch)
@@ -198,1199 +318,863 @@ def get_epoch(md):
     return epoch
 
 
-# Check beam timing.  Return True of OK.
+# Nominal values.
+#
+# Beam timing, indexed by (hardware trigger bit, beam type).
+# Values are (beam gate start, beam gate end,
+#             common optical filter beam start tick, beam end tick,
+#             common optical filter veto start tick, veto end tick).
+
+beam_timings = {
+    (11, 'bnb'):  (3.195, 4.875, 190, 320, 60, 190),
+    (12, 'numi'): (5.64, 15.44, 300, 1050, 170, 300),
+    (9, 'bnb'):   (3.57, 5.25, 214, 344, 84, 214),
+    (9, 'numi'):  (6.00, 15.80, 323, 1073, 193, 323),
+}
+
+# Database tag checks.
+#
+# Each entry specifies the following.
+#
+# title      - Used in messages.
+# services   - Service name(s).
+# provider   - Provider parameter set name.
+# ok, bad    - Messages.
+# usedb      - If true, only check if provider parameter UseDB is true.
+# nonfatal   - Function (process_name, dbtag) that returns True if a wrong tag is nonfatal.
+# min_tags   - Minimum database tag by epoch range.  List of tuples (first epoch, last epoch, tag).
+#              The first matching range is used.
+
+db_tag_checks = {
+    'asics': {'title': 'ASICs',
+              'services': ['ElectronicsCalibService'],
+              'provider': 'ElectronicsCalibProvider',
+              'ok': 'ASICs settings OK.',
+              'bad': 'Wrong ASICs settings.',
+              'usedb': False,
+              'nonfatal': None,
+              'min_tags': [('1b', '3b', 'v1r2'),
+                           ('4a', '4d', 'v1r3'),
+                           ('5', '5', 'v1r4'),
+                           ('1a', '1a', 'v1r5')]},
+    'chstat': {'title': 'channel status',
+               'services': ['ChannelStatusService'],
+               'provider': 'ChannelStatusProvider',
+               'ok': 'Channel status OK.',
+               'bad': 'Wrong Channel status.',
+               'usedb': False,
+               'nonfatal': None,
+               'min_tags': [('1c', '3a', 'v2r0'),
+                            ('3b', '3b', 'v2r1'),
+                            ('4a', '4a', 'v3r0'),
+                            ('4b', '4d', 'v3r2'),
+                            ('5', '5', 'v3r4'),
+                            ('1b', '1b', 'v3r6'),
+                            ('1a', '1a', 'v3r7')]},
+    'pmt': {'title': 'PMT gains',
+            'services': ['PMTGainService', 'PmtGainService'],
+            'provider': 'PmtGainProvider',
+            'ok': 'PMT gains OK.',
+            'bad': 'Wrong PMT gains.',
+            'usedb': False,
+            'nonfatal': lambda process_name, dbtag: process_name == 'CellTreeUB',
+            'min_tags': [('1c', '3b', 'v1r0'),
+                         ('4a', '4d', 'v1r1'),
+                         ('5', '5', 'v1r2'),
+                         ('1a', '1b', 'v1r4')]},
+    'ly': {'title': 'light yield',
+           'services': ['LightYieldService'],
+           'provider': 'LightYieldProvider',
+           'ok': 'Light yield OK.',
+           'bad': 'Wrong light yield.',
+           'usedb': False,
+           'nonfatal': None,
+           'min_tags': [('5', '5', 'v2r3'),
+                        ('4d', '4d', 'v2r2'),
+                        ('4a', '4c', 'v2r1'),
+                        ('1a', '3b', 'v2r0')]},
+
+    # Electron lifetime is nonfatal if tag is at least v4r0.
+
+    'elife': {'title': 'electron lifetime',
+              'services': ['UBElectronLifetimeService'],
+              'provider': 'ElectronLifetimeProvider',
+              'ok': 'Electron lifetime OK.',
+              'bad': 'Wrong electron lifetime.',
+              'usedb': True,
+              'nonfatal': lambda process_name, dbtag: dbtag >= 'v4r0',
+              'min_tags': [('4a', '4b', 'v4r3'),
+                           ('1a', '1b', 'v4r2'),
+                           ('4c', '5', 'v4r2'),
+                           ('3b', '3b', 'v1r0'),
+                           ('1c', '3a', 'v1r0')]},
+}
+
+# Process selection for each check.
+#
+# Values are tuples (skip patterns, keep patterns).  A process is skipped if its
+# name matches any skip pattern, unless it also matches a keep pattern.
+# Pattern "*Stage1*" with keep pattern "*Stage1*Optical" means:  ignore any
+# processes run in reco1 except stand alone optical reco.
+
+process_filters = {
+    'services': (['Swizzler', '*Stage1*'], []),
+    'io':       (['Swizzler', '*Stage1*', 'Merge', 'Copy', 'CRTMerge*', 'CellTreeUB', 'DLprod',
+                  'EventWeight*', 'DataOverlay*'], []),
+    'timing':   (['Swizzler', '*Stage1*'], ['*Stage1*Optical']),
+    'optical':  (['Swizzler', 'DataOpticalFilter', '*Stage1*'], ['*Stage1*Optical']),
+    'flux':     ([], []),
+    'remap':    (['Swizzler', '*Stage1*'], ['*Stage1*Optical']),
+    'asics':    (['Swizzler', 'DataOpticalFilter'], []),
+    'chstat':   (['Swizzler', '*Stage1*', '*Stage2Lite*', '*DLprod*', 'DataOpticalFilter'],
+                 ['*Stage1*Optical']),
+    'pmt':      (['Swizzler', '*Stage1*', '*Stage2Lite*', '*DLprod*'], ['*Stage1*Optical']),
+    'ly':       (['Swizzler', '*Stage1*', '*Stage2Lite*', '*DLprod*'], ['*Stage1*Optical']),
+    'elife':    (['Swizzler', '*Stage1*', '*Stage2Lite*', '*DLprod*'], []),
+    'larpid':   (['Swizzler', '*Stage1*', '*Stage2Lite*', '*DLprod*'], []),
+
+    # Sce ignores wire cell processes (don't use space charge service), optical processes,
+    # default map sce detvar, lantern, and reco1.
+
+    'sce':      (['Swizzler', 'CellTreeUB*', 'WireCellMCS', 'PortSTM', 'PortRedux', 'PortPF',
+                  'PhotonLibraryPropagation*', 'PLPvarLY*', 'OverlayDetsimOptical',
+                  'DataOverlayOptical*', 'DataOverlayNoTPC*', 'DetSysSCEDefaultMap', 'DLDeploy*',
+                  '*Stage1*', '*Stage2Lite*', '*DLprod*', 'DataOpticalFilter'], []),
+}
+
+
+# Test whether a process should be checked by the specified check.
+
+def process_selected(check, process_name):
+
+    if process_name in skip_processes:
+        return False
+    skips, keeps = process_filters[check]
+    for pattern in skips:
+        if fnmatch.fnmatchcase(process_name, pattern):
+            for keep in keeps:
+                if fnmatch.fnmatchcase(process_name, keep):
+                    return True
+            return False
+    return True
 
-def check_beam_timing(cfg, trigbit, beam):
 
-    result = True
+# Look up minimum database tag by epoch.  Return empty string if none.
 
-    # Calculate nominal beam gate times.
-
-    beam_start = 0.
-    beam_end = 0.
-
-    # Common optical filter timing.
-
-    beam_start_tick = 0.
-    beam_end_tick = 0.
-    veto_start_tick = 0.
-    veto_end_tick = 0.
-
-    if trigbit == 11 and beam == 'bnb':
-        beam_start = 3.195
-        beam_end = 4.875
-        beam_start_tick = 190
-        beam_end_tick = 320
-        veto_start_tick = 60
-        veto_end_tick = 190
-    elif trigbit == 12 and beam == 'numi':
-        beam_start = 5.64
-        beam_end = 15.44
-        beam_start_tick = 300
-        beam_end_tick = 1050
-        veto_start_tick = 170
-        veto_end_tick = 300
-    elif trigbit == 9 and beam == 'bnb':
-        beam_start = 3.57
-        beam_end = 5.25
-        beam_start_tick = 214
-        beam_end_tick = 344
-        veto_start_tick = 84
-        veto_end_tick = 214
-    elif trigbit == 9 and beam == 'numi':
-        beam_start = 6.00
-        beam_end = 15.80
-        beam_start_tick = 323
-        beam_end_tick = 1073
-        veto_start_tick = 193
-        veto_end_tick = 323
-    else:
-        print('Unknown beam timing configuration.')
-        sys.exit(1)
+def get_min_tag(min_tags, epoch):
 
-    # Scan fcl parameters again to check beam timings.
+    for first, last, tag in min_tags:
+        if epoch >= first and epoch <= last:
+            return tag
+    return ''
 
-    print()
-    print('Checking beam timings.')
-    print('Nominal beam gate start = %8.3f, end = %8.3f' % (beam_start, beam_end))
-    print('Common optical filter gate start = %d, end = %d' % (beam_start_tick, beam_end_tick))
-    print('Common optical filter veto start = %d, end = %d' % (veto_start_tick, veto_end_tick))
-    print()
-
-    # Loop over procsss names.
 
+# Index fcl configuration.
+#
+# This function makes a single pass over the processing history and all modules
+# in trigger paths and end paths.  The result is a list of processes (in
+# processing order), where each process is a dictionary with the following keys.
+#
+# name        - Process name.
+# pset        - Process parameter set.
+# services    - Services parameter set.
+# physics     - True if process has physics parameter set.
+# source      - Source parameter set.
+# trigger     - Dictionary {(kind, module_type): [(position, module label, module pset)]}
+#               for trigger path modules (kind = "producer" or "filter").
+# end         - Dictionary for end path modules (kind = "analyzer" or "output").
+# missing_trigger - List of trigger path module labels that are not defined.
+# missing_end     - List of end path module labels that are not defined.
+
+def index_config(cfg):
+
+    index = []
     for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
-
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
-            continue
-
-        # Ignore any processes run in reco1 except stand alone optical reco.
-
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-            continue
-
-        print('Checking process name %s' % process_name)
         fcl_proc = cfg[process_name]
+        proc = {'name': process_name,
+                'pset': fcl_proc,
+                'services': {},
+                'physics': False,
+                'source': {},
+                'trigger': {},
+                'end': {},
+                'missing_trigger': [],
+                'missing_end': []}
+        index.append(proc)
+        if 'services' in fcl_proc:
+            proc['services'] = fcl_proc['services']
+        if 'source' in fcl_proc:
+            proc['source'] = fcl_proc['source']
+        if not 'physics' in fcl_proc:
+            continue
+        fcl_physics = fcl_proc['physics']
+        proc['physics'] = True
+
+        # Extract lists of module by type.
+
+        modules_by_kind = {'producer': {}, 'filter': {}, 'analyzer': {}, 'output': {}}
+        if 'producers' in fcl_physics:
+            modules_by_kind['producer'] = fcl_physics['producers']
+        if 'filters' in fcl_physics:
+            modules_by_kind['filter'] = fcl_physics['filters']
+        if 'analyzers' in fcl_physics:
+            modules_by_kind['analyzer'] = fcl_physics['analyzers']
+        if 'outputs' in fcl_proc:
+            modules_by_kind['output'] = fcl_proc['outputs']
+
+        # Loop over modules in trigger paths and end paths.
+
+        position = 0
+        for section, paths_key, kinds in (('trigger', 'trigger_paths', ('producer', 'filter')),
+                                          ('end', 'end_paths', ('analyzer', 'output'))):
+            if not paths_key in fcl_physics:
+                continue
+            for path in fcl_physics[paths_key]:
+                if not path in fcl_physics:
+                    continue
+                for module in fcl_physics[path]:
+                    position += 1
+                    found = False
+                    for kind in kinds:
+                        if module in modules_by_kind[kind]:
+                            pset = modules_by_kind[kind][module]
+                            key = (kind, pset['module_type'])
+                            if not key in proc[section]:
+                                proc[section][key] = []
+                            proc[section][key].append((position, module, pset))
+                            found = True
+                            break
+                    if not found:
+                        proc['missing_%s' % section].append(module)
 
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
-
-            # Extract lists of module by type.
-
-            producers = {}
-            filters = {}
-            analyzers = {}
-            outputs = {}
-
-            if 'producers' in fcl_physics:
-                producers = fcl_physics['producers']
-            if 'filters' in fcl_physics:
-                filters = fcl_physics['filters']
-            if 'analyzers' in fcl_physics:
-                analyzers = fcl_physics['analyzers']
-            if 'outputs' in fcl_proc:
-                outputs = fcl_proc['outputs']
-
-            # Loop over modules in trigger paths.
-
-            if 'trigger_paths' in fcl_physics:
-                trigger_paths = fcl_physics['trigger_paths']
-
-                # Loop over trigger path modules.
-
-                for trigger_path in trigger_paths:
-                    if trigger_path in fcl_physics:
-                        modules = fcl_physics[trigger_path]
-                        for module in modules:
-                            if not module in producers and not module in filters:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-                            elif module in producers:
-                                module_type = producers[module]['module_type']
-
-                                if module_type == 'StoreFlashMatchChi2':
-
-                                    print('\n  ===== Checking flash match timing.')
-                                    t1 = producers[module]['BeamWindowStart']
-                                    t2 = producers[module]['BeamWindowEnd']
-                                    print('  Flash match beam start = %8.3f, end = %8.3f' % (t1, t2))
-                                    if abs(beam_start - t1) > 0.01 or abs(beam_end -t2) > 0.01:
-                                        print('  ***** Beam timing mismatch.')
-                                        result = False
-                                    else:
-                                        print('  Timing OK.')
-                                    print()
-
-                                elif module_type == 'LArPandoraExternalEventBuilding':
-
-                                    if 'SliceIdTool' in producers[module]:
-                                        slice_id_tool = producers[module]['SliceIdTool']
-                                        if slice_id_tool['tool_type'] == 'FlashNeutrinoId':
-
-                                            print('\n  ===== Checking Slice Id tool beam timing.')
-                                            t1 = slice_id_tool['BeamWindowStartTime']
-                                            t2 = slice_id_tool['BeamWindowEndTime']
-                                            print('  Slice id beam start    = %8.3f, end = %8.3f' % (t1, t2))
-                                            if abs(beam_start - t1) > 0.01 or abs(beam_end -t2) > 0.01:
-                                                print('  ***** Slice id timing mismatch.')
-                                                result = False
-                                            else:
-                                                print('  Timing OK.')
-                                            print()
-
-                            elif module in filters:
-                                module_type = filters[module]['module_type']
-
-                                if module_type == 'UBCRTCosmicFilter' and process_name != 'DataOpticalFilter':
-
-                                    print('\n  ===== Checking UBCRTCosmicFilter timing.')
-                                    t1 = filters[module]['BeamStart']
-                                    t2 = filters[module]['BeamEnd']
-                                    print('  Cosmic veto beam start = %8.3f, end = %8.3f' % (t1, t2))
-                                    if abs(beam_start - t1) > 0.01 or abs(beam_end -t2) > 0.01:
-                                        print('  ***** Cosmic veto timing mismatch.')
-                                        result = False
-                                    else:
-                                        print('  Timing OK.')
-                                    print()
-
-                                elif module_type == 'DLPMTPreCuts':
-
-                                    # All errors for DLPMTPreCuts are nonfatal if beam type is numi.
-
-                                    # Ignore wrong trigger module in swizzler.
-
-                                    if process_name == 'Swizzler':
-                                        if trigbit == 11 and module == 'opfiltercommonext':
-                                            continue
-                                        if trigbit == 9 and module == 'opfiltercommonbnb':
-                                            continue                                            
-
-                                    print('\n  ===== Checking DLPMTPreCuts.')
-                                    inp = filters[module]['OpHitProducer']
-                                    print('  Optical filter producer = %s' % inp)
-                                    if inp != 'ophitBeam':
-                                        if beam == 'numi' and not warnfatal:
-                                            print('  ????? Wrong producer.')
-                                        else:
-                                            print('  ***** Wrong producer.')
-                                            result = False
-                                    else:
-                                        print('  Producer OK.')
-                                    t1b = filters[module]['WinStartTick']
-                                    t2b = filters[module]['WinEndTick']
-                                    t1v = filters[module]['VetoStartTick']
-                                    t2v = filters[module]['VetoEndTick']
-                                    print('  Optical filter beam start = %d, beam end = %d' % (t1b, t2b))
-                                    print('  Optical filter veto start = %d, veto end = %d' % (t1v, t2v))
-                                    if beam_start_tick != t1b or beam_end_tick != t2b or \
-                                       veto_start_tick != t1v or veto_end_tick != t2v:
-                                        if beam == 'numi' and not warnfatal:
-                                            print('  ????? Optical filter timing mismatch.')
-                                        else:
-                                            print('  ***** Optical filter timing mismatch.')
-                                            result = False
-                                    else:
-                                        print('  Timing OK.')
-                                    print()
     # Done.
 
-    print()
-    print ('Done checking beam timing.')
-    if result:
-        print('  Beam timing OK.')
-    else:
-        print('  ***** Beam timing bad.')
-    return result
+    return index
 
 
-# Check optical waveform selection.
+# Apply module rules to an indexed configuration.
+#
+# Arguments:
+#
+# index    - Indexed configuration (from index_config).
+# check    - Check name (key of process_filters).
+# rules    - Dictionary {(section, kind, module_type): rule function}.
+#            Rule functions are called as rule(ctx, process_name, module, pset),
+#            and should return False if the module is bad.
+# ctx      - Dictionary of nominal values passed to rule functions.
+# report_missing - Sections for which undefined modules are reported as errors.
+# process_hook   - Optional function called as process_hook(ctx, proc) after
+#                  rules for each process, returns False if bad.
+#
+# Within each process, rules are invoked in path order.
 
-def check_optical(cfg, trigbit, beam, epoch, is_overlay):
+def apply_module_rules(index, check, rules, ctx, report_missing, process_hook=None):
 
     result = True
+    sections = set()
+    for section, kind, module_type in rules:
+        sections.add(section)
 
-    # Calculate nominal high gain beam waveform.
-
-    hgbeam = ''
-    hgbeamwc = ''
-    hgcosmic = ''
-    if is_overlay:
-        hgbeam = 'mixer'
-        hgbeamwc = 'mixer'
-        hgcosmic = 'pmtreadout'
-    else:
-        if epoch >= '4' and trigbit == 11 and beam == 'bnb':
-            hgbeam = 'doublePMTFilter'
-            hgbeamwc = 'pmtreadout'
-            hgcosmic = 'pmtreadout'
-        elif (epoch == '1a' or epoch == '1b'):
-            hgbeam = 'doublePMTFilter'
-            hgbeamwc = 'doublePMTFilter'
-            hgcosmic = 'cosmicPMTFilter'
-        else:
-            hgbeam = 'pmtreadout'
-            hgbeamwc = 'pmtreadout'
-            hgcosmic = 'pmtreadout'
-
-    print()
-    print('Checking optical reconstruction.')
-    print('High Gain beam waveform label should be "%s".' % hgbeam)
-    print('WC High Gain beam waveform label should be "%s".' % hgbeamwc)
-    print('High Gain cosmic waveform label should be "%s".' % hgcosmic)
-    print()
-
-    # Loop over processes.
-
-    for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
-
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
+    for proc in index:
+        process_name = proc['name']
+        if not process_selected(check, process_name):
             continue
-
-        # Ignore common optical filter.
-
-        if process_name == 'DataOpticalFilter':
-            continue        
-
-        # Ignore any processes run in reco1 except stand alone optical reco.
-
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
+        print('Checking process name %s' % process_name)
+        set_report_context(process=process_name)
+        if not proc['physics']:
             continue
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
+        for section in report_missing:
+            for module in proc['missing_%s' % section]:
+                set_report_context(process=process_name, module=module)
+                report('error', 'Module %s not found.' % module)
+                result = False
 
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
-
-            # Extract lists of module by type.
-
-            producers = {}
-            filters = {}
-            analyzers = {}
-            outputs = {}
-            if 'producers' in fcl_physics:
-                producers = fcl_physics['producers']
-            if 'filters' in fcl_physics:
-                filters = fcl_physics['filters']
-            if 'analyzers' in fcl_physics:
-                analyzers = fcl_physics['analyzers']
-            if 'outputs' in fcl_proc:
-                outputs = fcl_proc['outputs']
-
-            # Loop over modules in trigger paths.
-
-            if 'trigger_paths' in fcl_physics:
-                trigger_paths = fcl_physics['trigger_paths']
-
-                # Loop over trigger path modules.
-
-                for trigger_path in trigger_paths:
-                    if trigger_path in fcl_physics:
-                        modules = fcl_physics[trigger_path]
-                        for module in modules:
-                            if not module in producers and not module in filters:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-                            elif module in producers:
-                                module_type = producers[module]['module_type']
-                                if module_type == 'OpDigitSaturationCorrection':
-
-                                    # Saturation module.
-
-                                    print('\n  ===== Checking saturation module.')
-                                    label1 = producers[module]['HGProducer']
-                                    label2 = producers[module]['HGProducerCosmic']
-                                    print('  HG Beam = %s' % label1)
-                                    print('  HG Cosmic = %s' % label2)
-
-                                    # We don't consider it an error if the expected
-                                    # waveform is pmtreadout, but the actual waveform
-                                    # is doublePMTFilter or cosmicPMTFilter.
-
-                                    if (label1 != hgbeam and (is_overlay or label1 != 'doublePMTFilter')) or \
-                                       (label2 != hgcosmic and (is_overlay or label2 != 'cosmicPMTFilter')):
-                                        print('  ***** Wrong waveform label.')
-                                        result = False
-                                    else:
-                                        print('  Waveform label OK.')
-                                    print()
-
-                                elif module_type == 'UBWCFlashFinder':
-
-                                    # WCopflash
-
-                                    print('\n  ===== Checking wcopflash module.')
-                                    label1 = producers[module]['OpDataProducerBeam']
-                                    label2 = producers[module]['OpDataProducerCosmic']
-                                    print('  HG Beam = %s' % label1)
-                                    print('  HG Cosmic = %s' % label2)
-
-                                    if (label1 != hgbeamwc and (is_overlay or label1 != 'doublePMTFilter')) or \
-                                       (label2 != hgcosmic and (is_overlay or label2 != 'cosmicPMTFilter')):
-                                        print('  ***** Wrong waveform label.')
-                                        result = False
-                                    else:
-                                        print('  Waveform label OK.')
-                                    print()
-
-                                elif module_type == 'ACPTtrig' and not is_overlay:
-
-                                    # ACPTtrig
-
-                                    print('\n  ===== Checking ACPTtrig module.')
-                                    label1 = producers[module]['OpDetWfmProducer']
-                                    n = label1.find(':')
-                                    if n >= 0:
-                                        label1 = label1[:n]
-                                    print('  HG Beam = %s' % label1)
-                                    if label1 != hgbeam and (is_overlay or label1 != 'doublePMTFilter'):
-                                        print('  ***** Wrong waveform label.')
-                                        result = False
-                                    else:
-                                        print('  Waveform label OK.')
-                                    print()
-
-                            elif module in filters:
-
-                                module_type = filters[module]['module_type']
-                                if module_type == 'NeutrinoSelectionFilter':
-
-                                    print('\n  ===== Checking NeutrinoSelectionFilter.')
-                                    if 'timing' in filters[module]['AnalysisTools']:
-                                        timing_tool = filters[module]['AnalysisTools']['timing']
-                                        label1 = 'pmtreadout:OpdetBeamHighGain'
-                                        if 'nstimePMTWFproducer' in timing_tool:
-                                            label1 = timing_tool['nstimePMTWFproducer']
-                                        n = label1.find(':')
-                                        if n >= 0:
-                                            label1 = label1[:n]
-                                        print('  HG Beam = %s' % label1)
-                                        if label1 != hgbeam and (is_overlay or label1 != 'doublePMTFilter'):
-                                            print('  ***** Wrong waveform label.')
-                                            result = False
-                                        else:
-                                            print('  Waveform label OK.')
-                                        print()
-                                    else:
-                                        print('  ????? No timing tool.')
-                                
-                                
-
-
-            # Loop over modules in end paths.
-
-            if 'end_paths' in fcl_physics:
-                end_paths = fcl_physics['end_paths']
-
-                # Loop over end path modules.
-
-                for end_path in end_paths:
-                    if end_path in fcl_physics:
-                        modules = fcl_physics[end_path]
-                        for module in modules:
-                            if not module in analyzers and not module in outputs:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-
-                            elif module in analyzers:
-
-                                module_type = analyzers[module]['module_type']
-                                if module_type == 'CellTreeUB':
-
-                                    # CellTreeUB analyzer (part of reco2).
-
-                                    print('\n  ===== Checking CellTreeUB module.')
-                                    label1 = ''
-                                    if is_overlay:                                        
-                                        label1 = analyzers[module]['PMT_overlay_mixer_producer']
-                                    else:
-                                        label1 = analyzers[module]['PMT_HG_beamProducer']
-                                    label2 = analyzers[module]['PMT_HG_cosmicProducer']
-                                    print('  HG Beam = %s' % label1)
-                                    print('  HG Cosmic = %s' % label2)
-                                    if (label1 != hgbeamwc and (is_overlay or label1 != 'doublePMTFilter')) or \
-                                       (label2 != hgcosmic and (is_overlay or label2 != 'cosmicPMTFilter')):
-                                        print('  ***** Wrong waveform label.')
-                                        result = False
-                                    else:
-                                        print('  Waveform label OK.')
-                                    print()
-
-                                if module_type == 'WireCellAnaTree':
-
-                                    print('\n  ===== Checking WireCellAnaTree.')
-                                    label1 = 'pmtreadout:OpdetBeamHighGain'
-                                    if 'nstimePMTLabel' in analyzers[module]:
-                                        label1 = analyzers[module]['nstimePMTLabel']
-                                    n = label1.find(':')
-                                    if n >= 0:
-                                        label1 = label1[:n]
-                                    print('  HG Beam = %s' % label1)
-                                    if label1 != hgbeamwc and (is_overlay or label1 != 'doublePMTFilter'):
-                                        print('  ***** Wrong waveform label.')
-                                        result = False
-                                    else:
-                                        print('  Waveform label OK.')
-                                    print()
+        # Gather matching modules for this process.
+
+        matches = []
+        for section, kind, module_type in rules:
+            key = (kind, module_type)
+            if key in proc[section]:
+                rule = rules[(section, kind, module_type)]
+                for position, module, pset in proc[section][key]:
+                    matches.append((position, module, pset, rule))
+        matches.sort(key=lambda m: m[0])
+        for position, module, pset, rule in matches:
+            set_report_context(process=process_name, module=module, module_type=pset['module_type'])
+            if not rule(ctx, process_name, module, pset):
+                result = False
 
+        if process_hook != None:
+            set_report_context(process=process_name)
+            if not process_hook(ctx, proc):
+                result = False
 
     # Done.
 
-    print()
-    print('Done checking waveform selection.')
-    if result:
-        print('  Optical waveform selection OK.')
-    else:
-        print('  ***** Optical waveform selection bad.')
     return result
 
 
-# Check services.
+# Beam timing rules.
 
-def check_services(cfg, is_overlay):
+def timing_flashmatch(ctx, process_name, module, pset):
 
     result = True
-
+    print('\n  ===== Checking flash match timing.')
+    t1 = pset['BeamWindowStart']
+    t2 = pset['BeamWindowEnd']
+    print('  Flash match beam start = %8.3f, end = %8.3f' % (t1, t2))
+    expected = [ctx['beam_start'], ctx['beam_end']]
+    if abs(ctx['beam_start'] - t1) > 0.01 or abs(ctx['beam_end'] -t2) > 0.01:
+        report('error', 'Beam timing mismatch.', expected, [t1, t2])
+        result = False
+    else:
+        report('ok', 'Timing OK.', expected, [t1, t2])
     print()
-    print('Checking sam service configuration.')
-
-    for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
+    return result
 
-        # Ignore any processes run in swizzler or reco1.
 
-        if process_name == 'Swizzler':
-            continue
-        if process_name.find('Stage1') >= 0:
-            continue
+def timing_slice_id(ctx, process_name, module, pset):
 
-        print()
-        print('Checking services for process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        if 'FileCatalogMetadata' in fcl_services:
-            file_type = fcl_services['FileCatalogMetadata']['fileType']
-            if (is_overlay and file_type != 'overlay') or \
-               (not is_overlay and file_type != 'data'):
-                if warnfatal:
-                    print('  ***** File type mismatch: %s.' % file_type)
-                    result = False
-                else:
-                    print('  ????? File type mismatch: %s.' % file_type)
+    result = True
+    if 'SliceIdTool' in pset:
+        slice_id_tool = pset['SliceIdTool']
+        if slice_id_tool['tool_type'] == 'FlashNeutrinoId':
+
+            print('\n  ===== Checking Slice Id tool beam timing.')
+            t1 = slice_id_tool['BeamWindowStartTime']
+            t2 = slice_id_tool['BeamWindowEndTime']
+            print('  Slice id beam start    = %8.3f, end = %8.3f' % (t1, t2))
+            expected = [ctx['beam_start'], ctx['beam_end']]
+            if abs(ctx['beam_start'] - t1) > 0.01 or abs(ctx['beam_end'] -t2) > 0.01:
+                report('error', 'Slice id timing mismatch.', expected, [t1, t2])
+                result = False
             else:
-                print('  File type OK.')
-        else:
-            print('  ***** No service FileCatalogMetadata')
-            result = False
-        print()
-
-    # Done.
-
+                report('ok', 'Timing OK.', expected, [t1, t2])
+            print()
     return result
 
-# Check i/o configuration.
 
-def check_io(cfg):
+def timing_crt_veto(ctx, process_name, module, pset):
 
     result = True
+    if process_name == 'DataOpticalFilter':
+        return result
+    print('\n  ===== Checking UBCRTCosmicFilter timing.')
+    t1 = pset['BeamStart']
+    t2 = pset['BeamEnd']
+    print('  Cosmic veto beam start = %8.3f, end = %8.3f' % (t1, t2))
+    expected = [ctx['beam_start'], ctx['beam_end']]
+    if abs(ctx['beam_start'] - t1) > 0.01 or abs(ctx['beam_end'] -t2) > 0.01:
+        report('error', 'Cosmic veto timing mismatch.', expected, [t1, t2])
+        result = False
+    else:
+        report('ok', 'Timing OK.', expected, [t1, t2])
     print()
-    print('Checking output modules.')
-
-    # Loop over processes.
+    return result
 
-    for process_name in cfg:
 
-        if process_name in skip_processes:
-            continue
+def timing_dlpmt(ctx, process_name, module, pset):
 
-        # Ignore some processes.
+    # All errors for DLPMTPreCuts are nonfatal if beam type is numi.
 
-        if process_name == 'Swizzler':
-            continue
-        if process_name.find('Stage1') >= 0:
-            continue
-        if process_name == 'Merge':
-            continue
-        if process_name == 'Copy':
-            continue
-        if process_name.startswith('CRTMerge'):
-            continue
-        if process_name == 'CellTreeUB':
-            continue
-        if process_name == 'DLprod':
-            continue
-        if process_name.startswith('EventWeight'):
-            continue
-        if process_name.startswith('DataOverlay'):
-            continue
+    result = True
+    trigbit = ctx['trigbit']
+    beam = ctx['beam']
+
+    # Ignore wrong trigger module in swizzler.
+
+    if process_name == 'Swizzler':
+        if trigbit == 11 and module == 'opfiltercommonext':
+            return result
+        if trigbit == 9 and module == 'opfiltercommonbnb':
+            return result
+
+    print('\n  ===== Checking DLPMTPreCuts.')
+    inp = pset['OpHitProducer']
+    print('  Optical filter producer = %s' % inp)
+    if inp != 'ophitBeam':
+        if beam == 'numi' and not warnfatal:
+            report('warning', 'Wrong producer.', 'ophitBeam', inp)
+        else:
+            report('error', 'Wrong producer.', 'ophitBeam', inp)
+            result = False
+    else:
+        report('ok', 'Producer OK.', 'ophitBeam', inp)
+    t1b = pset['WinStartTick']
+    t2b = pset['WinEndTick']
+    t1v = pset['VetoStartTick']
+    t2v = pset['VetoEndTick']
+    print('  Optical filter beam start = %d, beam end = %d' % (t1b, t2b))
+    print('  Optical filter veto start = %d, veto end = %d' % (t1v, t2v))
+    expected = [ctx['beam_start_tick'], ctx['beam_end_tick'], ctx['veto_start_tick'], ctx['veto_end_tick']]
+    observed = [t1b, t2b, t1v, t2v]
+    if expected != observed:
+        if beam == 'numi' and not warnfatal:
+            report('warning', 'Optical filter timing mismatch.', expected, observed)
+        else:
+            report('error', 'Optical filter timing mismatch.', expected, observed)
+            result = False
+    else:
+        report('ok', 'Timing OK.', expected, observed)
+    print()
+    return result
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
 
-        # Loop over output modules in end_paths.
-
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
-
-            # Extract list of analyzer and output modules.
-
-            analyzers = {}
-            outputs = {}
-            if 'analyzers' in fcl_physics:
-                analyzers = fcl_physics['analyzers']
-            if 'outputs' in fcl_proc:
-                outputs = fcl_proc['outputs']
-
-            if 'end_paths' in fcl_physics:
-                end_paths = fcl_physics['end_paths']
-
-                # Loop over end path modules.
-
-                for end_path in end_paths:
-                    if end_path in fcl_physics:
-                        modules = fcl_physics[end_path]
-                        for module in modules:
-                            if not module in analyzers and not module in outputs:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-                            elif module in outputs:
-                                fcl_out = outputs[module]
-                                module_type = fcl_out['module_type']
-                                if module_type == 'RootOutput':
-
-                                    if not 'saveMemoryObjectThreshold' in fcl_out:
-                                        if warnfatal:
-                                            print('  ***** Parameter "saveMemoryObjectThreshold" is not defined in RootOutput.')
-                                            result = False
-                                        else:
-                                            print('  ????? Parameter "saveMemoryObjectThreshold" is not defined in RootOutput.')
-                                    else:
-                                        sm = fcl_out['saveMemoryObjectThreshold']
-                                        if sm != 0:
-                                            if warnfatal:
-                                                print('  ***** Parameter "saveMemoryObjectThreshold" is present but nonzero in RootOutput.')
-                                                result = False
-                                            else:
-                                                print('  ????? Parameter "saveMemoryObjectThreshold" is present but nonzero in RootOutput.')
-                                        else:
-                                            print('  Output OK.')
-
-            # Check source module.
-
-            if 'source' in fcl_proc:
-                fcl_source = fcl_proc['source']
-                module_type = fcl_source['module_type']
-                if module_type == 'RootInput':
-                    if not 'saveMemoryObjectThreshold' in fcl_source:
-                        if warnfatal:
-                            print('  ***** Parameter "saveMemoryObjectThreshold" is not defined in RootInput.')
-                            result = False
-                        else:
-                            print('  ????? Parameter "saveMemoryObjectThreshold" is not defined in RootInput.')
-                    else:
-                        sm = fcl_source['saveMemoryObjectThreshold']
-                        if sm != 0:
-                            if warnfatal:
-                                print('  ***** Parameter "saveMemoryObjectThreshold" is present but nonzero in RootInput.')
-                                result = False
-                            else:
-                                print('  ????? Parameter "saveMemoryObjectThreshold" is present but nonzero in RootInput.')
-                        else:
-                            print('  Source OK.')
+timing_rules = {
+    ('trigger', 'producer', 'StoreFlashMatchChi2'): timing_flashmatch,
+    ('trigger', 'producer', 'LArPandoraExternalEventBuilding'): timing_slice_id,
+    ('trigger', 'filter', 'UBCRTCosmicFilter'): timing_crt_veto,
+    ('trigger', 'filter', 'DLPMTPreCuts'): timing_dlpmt,
+}
 
-    # Done
 
-    return result
+# Check beam timing.  Return True of OK.
 
+def check_beam_timing(index, trigbit, beam):
 
-# Check Flux.
+    # Look up nominal beam gate times and common optical filter timing.
 
-def check_flux(cfg, beam, epoch):
+    if not (trigbit, beam) in beam_timings:
+        print('Unknown beam timing configuration.')
+        sys.exit(1)
+    beam_start, beam_end, beam_start_tick, beam_end_tick, veto_start_tick, veto_end_tick = \
+        beam_timings[(trigbit, beam)]
 
-    result = True
     print()
-    print('Check run 4a flux.')
-
-    # Loop over procsss names.
-
-    for process_name in cfg:
+    print('Checking beam timings.')
+    print('Nominal beam gate start = %8.3f, end = %8.3f' % (beam_start, beam_end))
+    print('Common optical filter gate start = %d, end = %d' % (beam_start_tick, beam_end_tick))
+    print('Common optical filter veto start = %d, end = %d' % (veto_start_tick, veto_end_tick))
+    print()
 
-        if process_name in skip_processes:
-            continue
+    ctx = {'trigbit': trigbit,
+           'beam': beam,
+           'beam_start': beam_start,
+           'beam_end': beam_end,
+           'beam_start_tick': beam_start_tick,
+           'beam_end_tick': beam_end_tick,
+           'veto_start_tick': veto_start_tick,
+           'veto_end_tick': veto_end_tick}
+    result = apply_module_rules(index, 'timing', timing_rules, ctx, ['trigger'])
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
-
-            # Extract lists of module by type.
-
-            producers = {}
-            filters = {}
-
-            if 'producers' in fcl_physics:
-                producers = fcl_physics['producers']
-            if 'filters' in fcl_physics:
-                filters = fcl_physics['filters']
-
-            # Loop over modules in trigger paths.
-
-            if 'trigger_paths' in fcl_physics:
-                trigger_paths = fcl_physics['trigger_paths']
-
-                # Loop over trigger path modules.
-
-                for trigger_path in trigger_paths:
-                    if trigger_path in fcl_physics:
-                        modules = fcl_physics[trigger_path]
-                        for module in modules:
-                            if not module in producers and not module in filters:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-                            elif module in producers:
-                                module_type = producers[module]['module_type']
-
-                                if module_type == 'GENIEGen':
-
-                                    print('\n  ===== Checking GENIEGen flux.')
-                                    flux_path = producers[module]['FluxSearchPaths']
-                                    print('  Flux path = %s' % flux_path)
-
-                                    # Make sure flux type matches beam type.
-
-                                    flux_path_lc = flux_path.lower()
-                                    flux_type = ''
-                                    if flux_path_lc.find('bnb') >= 0:
-                                        flux_type = 'bnb'
-                                    elif flux_path_lc.find('numi') >= 0:
-                                        flux_type = 'numi'
-                                    elif flux_path_lc.find('fhc') >= 0:
-                                        flux_type = 'numi'
-                                    elif flux_path_lc.find('rhc') >= 0:
-                                        flux_type = 'numi'
-
-                                    # All flux files in Nitish's persistent area are numi:
-
-                                    elif flux_path.startswith('/pnfs/uboone/persistent/users/bnayak/flux_files'):
-                                        flux_type = 'numi'
-
-                                    print('  Flux type = %s' % flux_type)
-                                    if flux_type != beam:
-                                        print('  ***** Flux type mismatch.')
-                                        result = False
-
-                                    # Check run 4a bnb flux.
-
-                                    if flux_type == 'bnb':
-                                        r4a = (flux_path_lc.find('run4a') >= 0)
-                                        if r4a:
-                                            print('  Run 4a flux.')
-                                        else:
-                                            print('  Not run 4a flux.')
-                                        if epoch == '4a' and not r4a:
-                                            print('  ***** Epoch is run 4a but bnb flux is not run 4a.')
-                                            result = False
-                                        elif epoch != '4a' and r4a:
-                                            print('  ***** Epoch is not run 4a but bnb flux is run 4a.')
-                                            result = False
-                                    if result:
-                                        print('  Flux OK.')
-                                    print()
     # Done.
 
+    print()
+    print ('Done checking beam timing.')
+    if result:
+        print('  Beam timing OK.')
+    else:
+        print('  ***** Beam timing bad.')
     return result
 
 
-# Check larpid weights.
-
-def check_larpid(cfg, epoch, beam):
-
-    result = True
+# Optical waveform selection rules.
+#
+# We don't consider it an error if the expected waveform is pmtreadout, but the
+# actual waveform is doublePMTFilter or cosmicPMTFilter (except for overlay).
 
-    # Calculate the appropriate larpid weight (default or alternate)..
+def waveform_ok(ctx, label, nominal, alternate):
+    return label == nominal or (not ctx['is_overlay'] and label == alternate)
 
-    wt = 'default'
-    if epoch >= '3a' and epoch <= '3b' and beam == 'bnb':
-        wt = 'alternate'
 
+def print_waveform_result(ok, expected, observed):
+    if ok:
+        report('ok', 'Waveform label OK.', expected, observed)
+    else:
+        report('error', 'Wrong waveform label.', expected, observed)
     print()
-    print('Checking LArPID weights.')
-    print('LArPID weights should be: %s' % wt)
+    return ok
 
-    # Loop over procsss names.
 
-    for process_name in cfg:
+def optical_saturation(ctx, process_name, module, pset):
 
-        if process_name in skip_processes:
-            continue
+    print('\n  ===== Checking saturation module.')
+    label1 = pset['HGProducer']
+    label2 = pset['HGProducerCosmic']
+    print('  HG Beam = %s' % label1)
+    print('  HG Cosmic = %s' % label2)
+    return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeam'], 'doublePMTFilter') and
+                                 waveform_ok(ctx, label2, ctx['hgcosmic'], 'cosmicPMTFilter'),
+                                 [ctx['hgbeam'], ctx['hgcosmic']], [label1, label2])
 
-        # Ignore any processes run in swizzler.
 
-        if process_name == 'Swizzler':
-            continue
+def optical_wcopflash(ctx, process_name, module, pset):
 
-        # Ignore any processes run in reco1 including stand alone optical reco.
+    print('\n  ===== Checking wcopflash module.')
+    label1 = pset['OpDataProducerBeam']
+    label2 = pset['OpDataProducerCosmic']
+    print('  HG Beam = %s' % label1)
+    print('  HG Cosmic = %s' % label2)
+    return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeamwc'], 'doublePMTFilter') and
+                                 waveform_ok(ctx, label2, ctx['hgcosmic'], 'cosmicPMTFilter'),
+                                 [ctx['hgbeamwc'], ctx['hgcosmic']], [label1, label2])
 
-        if process_name.find('Stage1') >= 0:
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
+def optical_acpttrig(ctx, process_name, module, pset):
 
-            # Extract analyzer modules.
+    if ctx['is_overlay']:
+        return True
+    print('\n  ===== Checking ACPTtrig module.')
+    label1 = pset['OpDetWfmProducer'].split(':')[0]
+    print('  HG Beam = %s' % label1)
+    return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeam'], 'doublePMTFilter'),
+                                 ctx['hgbeam'], label1)
+
+
+def optical_nusel(ctx, process_name, module, pset):
+
+    print('\n  ===== Checking NeutrinoSelectionFilter.')
+    if 'timing' in pset['AnalysisTools']:
+        timing_tool = pset['AnalysisTools']['timing']
+        label1 = 'pmtreadout:OpdetBeamHighGain'
+        if 'nstimePMTWFproducer' in timing_tool:
+            label1 = timing_tool['nstimePMTWFproducer']
+        label1 = label1.split(':')[0]
+        print('  HG Beam = %s' % label1)
+        return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeam'], 'doublePMTFilter'),
+                                     ctx['hgbeam'], label1)
+    else:
+        report('warning', 'No timing tool.')
+        return True
 
-            analyzers = {}
 
-            if 'analyzers' in fcl_physics:
-                analyzers = fcl_physics['analyzers']
+def optical_celltree(ctx, process_name, module, pset):
 
-            # Loop over modules in end paths.
+    # CellTreeUB analyzer (part of reco2).
 
-            if 'end_paths' in fcl_physics:
-                end_paths = fcl_physics['end_paths']
+    print('\n  ===== Checking CellTreeUB module.')
+    label1 = ''
+    if ctx['is_overlay']:
+        label1 = pset['PMT_overlay_mixer_producer']
+    else:
+        label1 = pset['PMT_HG_beamProducer']
+    label2 = pset['PMT_HG_cosmicProducer']
+    print('  HG Beam = %s' % label1)
+    print('  HG Cosmic = %s' % label2)
+    return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeamwc'], 'doublePMTFilter') and
+                                 waveform_ok(ctx, label2, ctx['hgcosmic'], 'cosmicPMTFilter'),
+                                 [ctx['hgbeamwc'], ctx['hgcosmic']], [label1, label2])
 
-                # Loop over end path modules.
 
-                for end_path in end_paths:
-                    if end_path in fcl_physics:
-                        modules = fcl_physics[end_path]
-                        for module in modules:
-                            if module in analyzers:
+def optical_wcanatree(ctx, process_name, module, pset):
 
-                                module_type = analyzers[module]['module_type']
-                                if module_type == 'WireCellAnaTree':
+    print('\n  ===== Checking WireCellAnaTree.')
+    label1 = 'pmtreadout:OpdetBeamHighGain'
+    if 'nstimePMTLabel' in pset:
+        label1 = pset['nstimePMTLabel']
+    label1 = label1.split(':')[0]
+    print('  HG Beam = %s' % label1)
+    return print_waveform_result(waveform_ok(ctx, label1, ctx['hgbeamwc'], 'doublePMTFilter'),
+                                 ctx['hgbeamwc'], label1)
 
-                                    print('  Found module WireCellAnaTree')
-                                    fclwt = analyzers[module]['LArPIDModel']
-                                    print('  Weight file: %s' % fclwt)
-                                    if fclwt.find(wt) >= 0:
-                                        print('  LarPID weights OK.')
-                                    else:
-                                        print('  ***** Wrong LArPID weights.')
-                                        result = False
-    # Done.
 
-    return result
+optical_rules = {
+    ('trigger', 'producer', 'OpDigitSaturationCorrection'): optical_saturation,
+    ('trigger', 'producer', 'UBWCFlashFinder'): optical_wcopflash,
+    ('trigger', 'producer', 'ACPTtrig'): optical_acpttrig,
+    ('trigger', 'filter', 'NeutrinoSelectionFilter'): optical_nusel,
+    ('end', 'analyzer', 'CellTreeUB'): optical_celltree,
+    ('end', 'analyzer', 'WireCellAnaTree'): optical_wcanatree,
+}
 
 
-# Check SCE E-field scale factor.
-
-def check_sce(cfg):
-
-    result = True
-
-    # Calculate the appropriate SCE scale factor.
+# Check optical waveform selection.
 
-    scale = 3.65096750639
+def check_optical(index, trigbit, beam, epoch, is_overlay):
 
-    # If the processing history includes a G4 process, and the G4 process
-    # sets the scale factor, use that as the expected scale factor.
+    # Calculate nominal high gain beam waveform.
 
-    for process_name in cfg:
-        if process_name.startswith('G4'):
-            fcl_proc = cfg[process_name]
-            if 'services' in fcl_proc:
-                fcl_services = fcl_proc['services']
-                if 'SpaceCharge' in fcl_services:
-                    fcl_sce = fcl_services['SpaceCharge']
-                    if 'EfieldOffsetScale' in fcl_sce:
-                        scale = fcl_sce['EfieldOffsetScale']
-                    else:
-                        scale = 1.
+    hgbeam = ''
+    hgbeamwc = ''
+    hgcosmic = ''
+    if is_overlay:
+        hgbeam = 'mixer'
+        hgbeamwc = 'mixer'
+        hgcosmic = 'pmtreadout'
+    else:
+        if epoch >= '4' and trigbit == 11 and beam == 'bnb':
+            hgbeam = 'doublePMTFilter'
+            hgbeamwc = 'pmtreadout'
+            hgcosmic = 'pmtreadout'
+        elif (epoch == '1a' or epoch == '1b'):
+            hgbeam = 'doublePMTFilter'
+            hgbeamwc = 'doublePMTFilter'
+            hgcosmic = 'cosmicPMTFilter'
+        else:
+            hgbeam = 'pmtreadout'
+            hgbeamwc = 'pmtreadout'
+            hgcosmic = 'pmtreadout'
 
     print()
-    print('Checking SCE E-field scale factor.')
-    print('Scale factor should be: %f' % scale)
-
-    # Loop over procsss names.
-
-    for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
-
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
-            continue
+    print('Checking optical reconstruction.')
+    print('High Gain beam waveform label should be "%s".' % hgbeam)
+    print('WC High Gain beam waveform label should be "%s".' % hgbeamwc)
+    print('High Gain cosmic waveform label should be "%s".' % hgcosmic)
+    print()
 
-        # Ignore wire cell processes (don't use space charge service).
+    ctx = {'is_overlay': is_overlay,
+           'hgbeam': hgbeam,
+           'hgbeamwc': hgbeamwc,
+           'hgcosmic': hgcosmic}
+    result = apply_module_rules(index, 'optical', optical_rules, ctx, ['trigger', 'end'])
 
-        if process_name.startswith('CellTreeUB'):
-            continue
-        if process_name == 'WireCellMCS':
-            continue
-        if process_name == 'PortSTM':
-            continue
-        if process_name == 'PortRedux':
-            continue
-        if process_name == 'PortPF':
-            continue
-
-        # Ignore optical processes.
+    # Done.
 
-        if process_name.startswith('PhotonLibraryPropagation'):
-            continue
-        if process_name.startswith('PLPvarLY'):
-            continue
-        if process_name == 'OverlayDetsimOptical':
-            continue
-        if process_name.startswith('DataOverlayOptical'):
-            continue
-        if process_name.startswith('DataOverlayNoTPC'):
-            continue
+    print()
+    print('Done checking waveform selection.')
+    if result:
+        print('  Optical waveform selection OK.')
+    else:
+        print('  ***** Optical waveform selection bad.')
+    return result
 
-        # Ignore default map sce detvar.
 
-        if process_name == 'DetSysSCEDefaultMap':
-            continue
+# Check services.
 
-        # Ignore lantern.
+def check_services(index, is_overlay):
 
-        if process_name.startswith('DLDeploy'):
-            continue
+    result = True
 
-        # Ignore any processes run in reco1 including stand alone optical reco.
+    print()
+    print('Checking sam service configuration.')
 
-        if process_name.find('Stage1') >= 0:
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
-        if process_name == 'DataOpticalFilter':
+    for proc in index:
+        process_name = proc['name']
+        if not process_selected('services', process_name):
             continue
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        if 'services' in fcl_proc:
-            fcl_services = fcl_proc['services']
-            if 'SpaceCharge' in fcl_services:
-                fcl_sce = fcl_services['SpaceCharge']
-                sc = 1.
-                if 'EfieldOffsetScale' in fcl_sce:
-                    sc = fcl_sce['EfieldOffsetScale']
-                print('  SCE scale factor %f' % sc)
-                if 'InputFilename' in fcl_sce:
-                    print('  Forward map:  %s' % fcl_sce['InputFilename'])
-                if 'CalibrationInputFilename' in fcl_sce:
-                    print('  Backward map: %s' % fcl_sce['CalibrationInputFilename'])
-                if abs(scale - sc) < 1.e-6:
-                    print('  Scale factor OK.')
-                else:
-                    print('  ***** Wrong scale factor.')
+        print()
+        print('Checking services for process name %s' % process_name)
+        set_report_context(process=process_name, module='FileCatalogMetadata')
+        fcl_services = proc['services']
+        expected = 'data'
+        if is_overlay:
+            expected = 'overlay'
+        if 'FileCatalogMetadata' in fcl_services:
+            file_type = fcl_services['FileCatalogMetadata']['fileType']
+            if file_type != expected:
+                if warnfatal:
+                    report('error', 'File type mismatch: %s.' % file_type, expected, file_type)
                     result = False
+                else:
+                    report('warning', 'File type mismatch: %s.' % file_type, expected, file_type)
+            else:
+                report('ok', 'File type OK.', expected, file_type)
+        else:
+            report('error', 'No service FileCatalogMetadata')
+            result = False
+        print()
 
     # Done.
 
     return result
 
 
-# Check electron lifetime database tag.
+# Check parameter "saveMemoryObjectThreshold" of RootInput or RootOutput.
 
-def check_elife(cfg, epoch):
+def check_save_memory(pset, module_type, ok_message):
 
     result = True
-
-    # Calculate the minimum database tag based on epoch.
-
-    min_tag = ''
-    if epoch >= '4a' and epoch <= '4b':
-        min_tag = 'v4r3'
-    elif (epoch >= '1a' and epoch <= '1b') or (epoch >= '4c' and epoch <= '5'):
-        min_tag = 'v4r2'
-    elif epoch == '3b':
-        min_tag = 'v1r0'
-    elif epoch >= '1c' and epoch <= '3a':
-        min_tag = 'v1r0'
-
-    print()
-    print('Checking electron lifetime database tag.')
-    if min_tag == '':
-        print('Could not determine minimum database tag.')
+    status = 'warning'
+    if warnfatal:
+        status = 'error'
         result = False
-        return result
+    if not 'saveMemoryObjectThreshold' in pset:
+        report(status, 'Parameter "saveMemoryObjectThreshold" is not defined in %s.' % module_type, 0, None)
     else:
-        print('Minimum database tag = %s' % min_tag)
-
-    # Loop over procsss names.
-
-    for process_name in cfg:
+        sm = pset['saveMemoryObjectThreshold']
+        if sm != 0:
+            report(status, 'Parameter "saveMemoryObjectThreshold" is present but nonzero in %s.' % module_type,
+                   0, sm)
+        else:
+            report('ok', ok_message, 0, sm)
+            result = True
+    return result
 
-        if process_name in skip_processes:
-            continue
 
-        # Ignore any processes run in swizzler.
+def io_root_output(ctx, process_name, module, pset):
+    return check_save_memory(pset, 'RootOutput', 'Output OK.')
 
-        if process_name == 'Swizzler':
-            continue
 
-        # Ignore any processes run in reco1 including stand alone optical reco.
+def io_source(ctx, proc):
+    fcl_source = proc['source']
+    if 'module_type' in fcl_source and fcl_source['module_type'] == 'RootInput':
+        set_report_context(process=proc['name'], module='source', module_type='RootInput')
+        return check_save_memory(fcl_source, 'RootInput', 'Source OK.')
+    return True
 
-        if process_name.find('Stage1') >= 0:
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
 
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        if 'UBElectronLifetimeService' in fcl_services:
-            fcl_elife_p = fcl_services['UBElectronLifetimeService']['ElectronLifetimeProvider']
-            usedb = False
-            if 'UseDB' in fcl_elife_p:
-                usedb = fcl_elife_p['UseDB']
-            if usedb:
-                print('  Electron lifetime database is being used.')
-                dbtag = fcl_elife_p['DatabaseRetrievalAlg']['DBTag']
-                print('  Database tag = %s' % dbtag)
-                if dbtag >= min_tag:
-                    print('  Electron lifetime OK.')
-                else:
+io_rules = {
+    ('end', 'output', 'RootOutput'): io_root_output,
+}
 
-                    # Nonfatal if electron lifetime tag is at least v4r0.
 
-                    if dbtag >= 'v4r0' and not warnfatal:
-                        print('  ????? Wrong electron lifetime.')
-                    else:
-                        print('  ***** Wrong electron lifetime.')
-                        result = False
-            else:
-                print('  Electron lifetime database is not being used.')
+# Check i/o configuration.
 
-    # Done.
+def check_io(index):
 
-    return result
+    print()
+    print('Checking output modules.')
+    return apply_module_rules(index, 'io', io_rules, {}, ['end'], io_source)
 
 
-# Check light yield database tag.
+# Flux rules.
 
-def check_ly(cfg, epoch):
+def flux_genie(ctx, process_name, module, pset):
 
     result = True
-
-    # Calculate the minimum database tag based on epoch.
-
-    min_tag = ''
-    if epoch == '5':
-        min_tag = 'v2r3'
-    elif epoch == '4d':
-        min_tag = 'v2r2'
-    elif epoch >= '4a' and epoch <= '4c':
-        min_tag = 'v2r1'
-    elif epoch >= '1a' and epoch <= '3b':
-        min_tag = 'v2r0'
-
-    print()
-    print('Checking light yield database tag.')
-    if min_tag == '':
-        print('Could not determine minimum database tag.')
+    beam = ctx['beam']
+    epoch = ctx['epoch']
+    print('\n  ===== Checking GENIEGen flux.')
+    flux_path = pset['FluxSearchPaths']
+    print('  Flux path = %s' % flux_path)
+
+    # Make sure flux type matches beam type.
+
+    flux_path_lc = flux_path.lower()
+    flux_type = ''
+    if flux_path_lc.find('bnb') >= 0:
+        flux_type = 'bnb'
+    elif flux_path_lc.find('numi') >= 0:
+        flux_type = 'numi'
+    elif flux_path_lc.find('fhc') >= 0:
+        flux_type = 'numi'
+    elif flux_path_lc.find('rhc') >= 0:
+        flux_type = 'numi'
+
+    # All flux files in Nitish's persistent area are numi:
+
+    elif flux_path.startswith('/pnfs/uboone/persistent/users/bnayak/flux_files'):
+        flux_type = 'numi'
+
+    print('  Flux type = %s' % flux_type)
+    if flux_type != beam:
+        report('error', 'Flux type mismatch.', beam, flux_type)
         result = False
-        return result
-    else:
-        print('Minimum database tag = %s' % min_tag)
 
-    # Loop over procsss names.
-
-    for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
-
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
-            continue
-
-        # Ignore any processes run in reco1 except stand alone optical reco.
-
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
-
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        if 'LightYieldService' in fcl_services:
-            fcl_ly = fcl_services['LightYieldService']
-            dbtag = fcl_ly['LightYieldProvider']['DatabaseRetrievalAlg']['DBTag']
-            print('  Database tag = %s' % dbtag)
-            if dbtag >= min_tag:
-                print('  Light yield OK.')
-            else:
-                print('  ***** Wrong light yield.')
-                result = False
-
-    # Done.
+    # Check run 4a bnb flux.
 
+    if flux_type == 'bnb':
+        r4a = (flux_path_lc.find('run4a') >= 0)
+        if r4a:
+            print('  Run 4a flux.')
+        else:
+            print('  Not run 4a flux.')
+        if epoch == '4a' and not r4a:
+            report('error', 'Epoch is run 4a but bnb flux is not run 4a.', epoch, flux_path)
+            result = False
+        elif epoch != '4a' and r4a:
+            report('error', 'Epoch is not run 4a but bnb flux is run 4a.', epoch, flux_path)
+            result = False
+    if result:
+        report('ok', 'Flux OK.', beam, flux_type)
+    print()
     return result
 
 
-# Check PMT gains database tag.
+flux_rules = {
+    ('trigger', 'producer', 'GENIEGen'): flux_genie,
+}
 
-def check_pmt(cfg, epoch):
-
-    result = True
 
-    # Calculate the minimum database tag based on epoch.
+# Check Flux.
 
-    min_tag = ''
-    if epoch >= '1c' and epoch <= '3b':
-        min_tag = 'v1r0'
-    elif epoch >= '4a' and epoch <= '4d':
-        min_tag = 'v1r1'
-    elif epoch == '5':
-        min_tag = 'v1r2'
-    elif epoch >= '1a' and epoch <= '1b':
-        min_tag = 'v1r4'
+def check_flux(index, beam, epoch):
 
     print()
-    print('Checking PMT gains database tag.')
-    if min_tag == '':
-        print('Could not determine minimum database tag.')
-        result = False
-        return result
-    else:
-        print('Minimum database tag = %s' % min_tag)
+    print('Check run 4a flux.')
+    ctx = {'beam': beam, 'epoch': epoch}
+    return apply_module_rules(index, 'flux', flux_rules, ctx, ['trigger'])
 
-    # Loop over procsss names.
 
-    for process_name in cfg:
+# Larpid rules.
 
-        if process_name in skip_processes:
-            continue
+def larpid_wcanatree(ctx, process_name, module, pset):
 
-        # Ignore any processes run in swizzler.
+    print('  Found module WireCellAnaTree')
+    fclwt = pset['LArPIDModel']
+    print('  Weight file: %s' % fclwt)
+    if fclwt.find(ctx['wt']) >= 0:
+        report('ok', 'LarPID weights OK.', ctx['wt'], fclwt)
+        return True
+    else:
+        report('error', 'Wrong LArPID weights.', ctx['wt'], fclwt)
+        return False
 
-        if process_name == 'Swizzler':
-            continue
 
-        # Ignore any processes run in reco1 except stand alone optical reco.
+larpid_rules = {
+    ('end', 'analyzer', 'WireCellAnaTree'): larpid_wcanatree,
+}
 
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
-
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        fcl_pmt = None
-        if 'PMTGainService' in fcl_services:
-            fcl_pmt = fcl_services['PMTGainService']
-        if 'PmtGainService' in fcl_services:
-            fcl_pmt = fcl_services['PmtGainService']
-        if fcl_pmt != None:
-            dbtag = fcl_pmt['PmtGainProvider']['DatabaseRetrievalAlg']['DBTag']
-            print('  Database tag = %s' % dbtag)
-            if dbtag >= min_tag:
-                print('  PMT gains OK.')
-            else:
-                if process_name == 'CellTreeUB' and not warnfatal:
-                    print('  ????? Wrong PMT gains.')
-                else:
-                    print('  ***** Wrong PMT gains.')
-                    result = False
 
-    # Done.
+# Check larpid weights.
 
-    return result
+def check_larpid(index, epoch, beam):
 
+    # Calculate the appropriate larpid weight (default or alternate)..
 
-# Check channel status database tag.
+    wt = 'default'
+    if epoch >= '3a' and epoch <= '3b' and beam == 'bnb':
+        wt = 'alternate'
 
-def check_chstat(cfg, epoch):
+    print()
+    print('Checking LArPID weights.')
+    print('LArPID weights should be: %s' % wt)
+    return apply_module_rules(index, 'larpid', larpid_rules, {'wt': wt}, [])
 
-    result = True
 
-    # Calculate the minimum database tag based on epoch.
+# Check SCE E-field scale factor.
 
-    min_tag = ''
-    if epoch >= '1c' and epoch <= '3a':
-        min_tag = 'v2r0'
-    elif epoch == '3b':
-        min_tag = 'v2r1'
-    elif epoch == '4a':
-        min_tag = 'v3r0'
-    elif epoch >= '4b' and epoch <= '4d':
-        min_tag = 'v3r2'
-    elif epoch == '5':
-        min_tag = 'v3r4'
-    elif epoch == '1b':
-        min_tag = 'v3r6'
-    elif epoch == '1a':
-        min_tag = 'v3r7'
+def check_sce(index):
 
-    print()
-    print('Checking channel status database tag.')
-    if min_tag == '':
-        print('Could not determine minimum database tag.')
-        result = False
-        return result
-    else:
-        print('Minimum database tag = %s' % min_tag)
+    result = True
 
-    # Loop over procsss names.
+    # Calculate the appropriate SCE scale factor.
 
-    for process_name in cfg:
+    scale = 3.65096750639
 
-        if process_name in skip_processes:
-            continue
+    # If the processing history includes a G4 process, and the G4 process
+    # sets the scale factor, use that as the expected scale factor.
 
-        # Ignore any processes run in swizzler.
+    for proc in index:
+        if proc['name'].startswith('G4'):
+            fcl_services = proc['services']
+            if 'SpaceCharge' in fcl_services:
+                fcl_sce = fcl_services['SpaceCharge']
+                if 'EfieldOffsetScale' in fcl_sce:
+                    scale = fcl_sce['EfieldOffsetScale']
+                else:
+                    scale = 1.
 
-        if process_name == 'Swizzler':
-            continue
+    print()
+    print('Checking SCE E-field scale factor.')
+    print('Scale factor should be: %f' % scale)
 
-        # Ignore any processes run in reco1 except stand alone optical reco.
+    # Loop over procsss names.
 
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-            continue
-        if process_name.find('Stage2Lite') >= 0:
-            continue
-        if process_name.find('DLprod') >= 0:
-            continue
-        if process_name == 'DataOpticalFilter':
+    for proc in index:
+        process_name = proc['name']
+        if not process_selected('sce', process_name):
             continue
 
         print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        if 'ChannelStatusService' in fcl_services:
-            fcl_chstat = fcl_services['ChannelStatusService']
-            dbtag = fcl_chstat['ChannelStatusProvider']['DatabaseRetrievalAlg']['DBTag']
-            print('  Database tag = %s' % dbtag)
-            if dbtag >= min_tag:
-                print('  Channel status OK.')
+        set_report_context(process=process_name, module='SpaceCharge')
+        fcl_services = proc['services']
+        if 'SpaceCharge' in fcl_services:
+            fcl_sce = fcl_services['SpaceCharge']
+            sc = 1.
+            if 'EfieldOffsetScale' in fcl_sce:
+                sc = fcl_sce['EfieldOffsetScale']
+            print('  SCE scale factor %f' % sc)
+            if 'InputFilename' in fcl_sce:
+                print('  Forward map:  %s' % fcl_sce['InputFilename'])
+            if 'CalibrationInputFilename' in fcl_sce:
+                print('  Backward map: %s' % fcl_sce['CalibrationInputFilename'])
+            if abs(scale - sc) < 1.e-6:
+                report('ok', 'Scale factor OK.', scale, sc)
             else:
-                print('  ***** Wrong Channel status.')
+                report('error', 'Wrong scale factor.', scale, sc)
                 result = False
 
     # Done.
@@ -1398,26 +1182,20 @@ def check_chstat(cfg, epoch):
     return result
 
 
-# Check ASICs settings database tag.
+# Check a database tag (asics, chstat, pmt, ly, elife).
+# The check is specified by an entry in db_tag_checks.
 
-def check_asics(cfg, epoch):
+def check_db_tag(index, epoch, check):
 
     result = True
+    spec = db_tag_checks[check]
 
     # Calculate the minimum database tag based on epoch.
 
-    min_tag = ''
-    if epoch >= '1b' and epoch <= '3b':
-        min_tag = 'v1r2'
-    elif epoch >= '4a' and epoch <= '4d':
-        min_tag = 'v1r3'
-    elif epoch == '5':
-        min_tag = 'v1r4'
-    elif epoch == '1a':
-        min_tag = 'v1r5'
+    min_tag = get_min_tag(spec['min_tags'], epoch)
 
     print()
-    print('Checking ASICs database tag.')
+    print('Checking %s database tag.' % spec['title'])
     if min_tag == '':
         print('Could not determine minimum database tag.')
         result = False
@@ -1427,38 +1205,38 @@ def check_asics(cfg, epoch):
 
     # Loop over procsss names.
 
-    for process_name in cfg:
-
-        if process_name in skip_processes:
+    for proc in index:
+        process_name = proc['name']
+        if not process_selected(check, process_name):
             continue
 
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
-            continue
-
-        # Ignore common optical filter.
-
-        if process_name == 'DataOpticalFilter':
-            continue
-
-        # Ignore any processes run in reco1 except stand alone optical reco.
-
-        #if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-        #    continue
-
         print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
-        fcl_services = fcl_proc['services']
-        if 'ElectronicsCalibService' in fcl_services:
-            fcl_asics = fcl_services['ElectronicsCalibService']
-            dbtag = fcl_asics['ElectronicsCalibProvider']['DatabaseRetrievalAlg']['DBTag']
-            print('  Database tag = %s' % dbtag)
-            if dbtag >= min_tag:
-                print('  ASICs settings OK.')
-            else:
-                print('  ***** Wrong ASICs settings.')
-                result = False
+        fcl_services = proc['services']
+        fcl_service = None
+        for service in spec['services']:
+            if service in fcl_services:
+                fcl_service = fcl_services[service]
+                set_report_context(process=process_name, module=service)
+        if fcl_service == None:
+            continue
+        fcl_provider = fcl_service[spec['provider']]
+        if spec['usedb']:
+            usedb = False
+            if 'UseDB' in fcl_provider:
+                usedb = fcl_provider['UseDB']
+            if not usedb:
+                print('  %s database is not being used.' % spec['title'].capitalize())
+                continue
+            print('  %s database is being used.' % spec['title'].capitalize())
+        dbtag = fcl_provider['DatabaseRetrievalAlg']['DBTag']
+        print('  Database tag = %s' % dbtag)
+        if dbtag >= min_tag:
+            report('ok', spec['ok'], min_tag, dbtag)
+        elif spec['nonfatal'] != None and spec['nonfatal'](process_name, dbtag) and not warnfatal:
+            report('warning', spec['bad'], min_tag, dbtag)
+        else:
+            report('error', spec['bad'], min_tag, dbtag)
+            result = False
 
     # Done.
 
@@ -1471,91 +1249,48 @@ def check_asics(cfg, epoch):
 #
 # PMT remapping refers to the fact that OpChannels may have a different
 # interpretaiton in OpDetWaveforms vs. OpHits and OpFlashes.  This is the
-# case for real data and overlay, but not for pure mc.  This programs 
+# case for real data and overlay, but not for pure mc.  This programs
 # assumes that we are dealing with real data or overlay, therefomre PMT
 # remapping is always required.
 #
 # The only action performed by this function is to check whether producer
 # modules OpHitFinder and OpHitRemapProducer have been run in any given
-# trigger path.  It is an error if a trigger path contains an instance
-# of OpHitFinder but not OpHitRemapProducer.
-
-def check_remap(cfg):
-
-    result = True
+# process.  It is an error if a process contains an instance of OpHitFinder
+# but not OpHitRemapProducer.
+
+def remap_count(ctx, process_name, module, pset):
+    ctx[pset['module_type']] += 1
+    return True
+
+
+def remap_process(ctx, proc):
+    num_ophit = ctx['OpHitFinder']
+    num_remap = ctx['OpHitRemapProducer']
+    ctx['OpHitFinder'] = 0
+    ctx['OpHitRemapProducer'] = 0
+    if num_ophit != 0 or num_remap != 0:
+        print('  Number of OpHitFinder modules = %d' % num_ophit)
+        print('  Number of OpHitRemapProducer modules = %d' % num_remap)
+    if num_ophit != num_remap:
+        report('error', 'PMT remap mismatch.', num_ophit, num_remap)
+    else:
+        report('ok', 'PMT remap OK.', num_ophit, num_remap)
     print()
-    print('Checking PMT remap configuraiton.')
-
-    # Loop over procsss names.
-
-    for process_name in cfg:
-
-        if process_name in skip_processes:
-            continue
-
-        # Ignore any processes run in swizzler.
-
-        if process_name == 'Swizzler':
-            continue
+    return True
 
-        # Ignore any processes run in reco1 except stand alone optical reco.
 
-        if process_name.find('Stage1') >= 0 and not process_name.endswith('Optical'):
-            continue
-
-        print('Checking process name %s' % process_name)
-        fcl_proc = cfg[process_name]
+remap_rules = {
+    ('trigger', 'producer', 'OpHitFinder'): remap_count,
+    ('trigger', 'producer', 'OpHitRemapProducer'): remap_count,
+}
 
-        if 'physics' in fcl_proc:
-            fcl_physics = fcl_proc['physics']
-
-            # Extract lists of module by type.
-
-            producers = {}
-            filters = {}
-
-            if 'producers' in fcl_physics:
-                producers = fcl_physics['producers']
-            if 'filters' in fcl_physics:
-                filters = fcl_physics['filters']
-
-            # Loop over modules in trigger paths.
-
-            if 'trigger_paths' in fcl_physics:
-                trigger_paths = fcl_physics['trigger_paths']
-
-                # Loop over trigger path modules.
-
-                num_ophit = 0
-                num_remap = 0
-                for trigger_path in trigger_paths:
-                    if trigger_path in fcl_physics:
-                        modules = fcl_physics[trigger_path]
-                        for module in modules:
-                            if not module in producers and not module in filters:
-                                print('  ***** Module %s not found.' % module)
-                                result = False
-                            elif module in producers:
-                                module_type = producers[module]['module_type']
-                                if module_type == 'OpHitFinder':
-                                    #print('  Found OpHitFinder.')
-                                    num_ophit += 1
-                                elif module_type == 'OpHitRemapProducer':
-                                    #print('  Found OpHitRemapProducer.')
-                                    num_remap += 1
-
-                        if num_ophit != 0 or num_remap != 0:
-                            print('  Number of OpHitFinder modules = %d' % num_ophit)
-                            print('  Number of OpHitRemapProducer modules = %d' % num_remap)
-                        if num_ophit != num_remap:
-                            print('  ***** PMT remap mismatch.')
-                        else:
-                            print('  PMT remap OK.')
-                        print()
 
-    # Done.
+def check_remap(index):
 
-    return result
+    print()
+    print('Checking PMT remap configuraiton.')
+    ctx = {'OpHitFinder': 0, 'OpHitRemapProducer': 0}
+    return apply_module_rules(index, 'remap', remap_rules, ctx, ['trigger'], remap_process)
 
 
 # Check config.
@@ -1567,94 +1302,124 @@ def check_config(cfg, trigbit, beam, epoch, is_overlay,
 
     result = True
 
+    # Index configuration (single pass over all processes and modules).
+
+    index = index_config(cfg)
+
     # Check services.
 
     if do_services:
-        services_ok = check_services(cfg, is_overlay)
+        begin_check('services')
+        services_ok = check_services(index, is_overlay)
+        end_check('services', services_ok)
         if not services_ok:
             result = False
 
     # Check i/o.
 
     if do_io:
-        io_ok = check_io(cfg)
+        begin_check('io')
+        io_ok = check_io(index)
+        end_check('io', io_ok)
         if not io_ok:
             result = False
 
     # Check beam timing.
 
     if do_timing and trigbit != 0 and beam != '':
-        timing_ok = check_beam_timing(cfg, trigbit, beam)
+        begin_check('timing')
+        timing_ok = check_beam_timing(index, trigbit, beam)
+        end_check('timing', timing_ok)
         if not timing_ok:
             result = False
 
     # Check optical waveform selection.
 
     if do_optical and epoch != '':
-        optical_ok = check_optical(cfg, trigbit, beam, epoch, is_overlay)
+        begin_check('optical')
+        optical_ok = check_optical(index, trigbit, beam, epoch, is_overlay)
+        end_check('optical', optical_ok)
         if not optical_ok:
             result = False
 
     # Check flux.
 
     if do_flux and epoch != '' and is_overlay:
-        flux_ok = check_flux(cfg, beam, epoch)
+        begin_check('flux')
+        flux_ok = check_flux(index, beam, epoch)
+        end_check('flux', flux_ok)
         if not flux_ok:
             result = False
 
     # Check PMT remapping.
 
     if do_remap:
-        remap_ok = check_remap(cfg)
+        begin_check('remap')
+        remap_ok = check_remap(index)
+        end_check('remap', remap_ok)
         if not remap_ok:
             result = False
 
     # Check ASICs settigs database tag.
 
     if do_asics:
-        asics_ok = check_asics(cfg, epoch)
+        begin_check('asics')
+        asics_ok = check_db_tag(index, epoch, 'asics')
+        end_check('asics', asics_ok)
         if not asics_ok:
             result = False
 
     # Check channel status database tag.
 
     if do_chstat:
-        chstat_ok = check_chstat(cfg, epoch)
+        begin_check('chstat')
+        chstat_ok = check_db_tag(index, epoch, 'chstat')
+        end_check('chstat', chstat_ok)
         if not chstat_ok:
             result = False
 
     # Check PMT gains database tag.
 
     if do_pmt:
-        pmt_ok = check_pmt(cfg, epoch)
+        begin_check('pmt')
+        pmt_ok = check_db_tag(index, epoch, 'pmt')
+        end_check('pmt', pmt_ok)
         if not pmt_ok:
             result = False
 
     # Check light yield database tag.
 
     if do_ly:
-        ly_ok = check_ly(cfg, epoch)
+        begin_check('ly')
+        ly_ok = check_db_tag(index, epoch, 'ly')
+        end_check('ly', ly_ok)
         if not ly_ok:
             result = False
 
     # Check electron lifetime database tag.
 
     if do_elife:
-        elife_ok = check_elife(cfg, epoch)
+        begin_check('elife')
+        elife_ok = check_db_tag(index, epoch, 'elife')
+        end_check('elife', elife_ok)
         if not elife_ok:
             result = False
 
     # Check larpid weights.
 
     if do_larpid:
-        larpid_ok = check_larpid(cfg, epoch, beam)
+        begin_check('larpid')
+        larpid_ok = check_larpid(index, epoch, beam)
+        end_check('larpid', larpid_ok)
         if not larpid_ok:
             result = False
 
     # Check SCE E-field correction.
 
     if do_sce:
-        sce_ok = check_sce(cfg)
+        begin_check('sce')
+        sce_ok = check_sce(index)
+        end_check('sce', sce_ok)
         if not sce_ok:
             result = False
 
@@ -1663,6 +1428,35 @@ def check_config(cfg, trigbit, beam, epoch, is_overlay,
     return result
 
 
+# Open a root file, or return the already open file.
+# The most recently opened file is kept open, so that the artroot check and
+# the in-process trigger and configuration extraction only open each file once.
+
+def open_root_file(f):
+
+    global root_file
+
+    if root_file != None and root_file[0] == f:
+        return root_file[1]
+    close_root_file()
+    root = ROOT.TFile.Open(f, 'read')
+    if root and root.IsOpen() and not root.IsZombie():
+        root_file = (f, root)
+        return root
+    return None
+
+
+# Close the cached root file, if any.
+
+def close_root_file():
+
+    global root_file
+
+    if root_file != None:
+        root_file[1].Close()
+        root_file = None
+
+
 # Determine of a file is artroot format (return True if artroot)
 
 def is_artroot(f):
@@ -1675,43 +1469,76 @@ def is_artroot(f):
 
     # Try to open file as a root file.
 
-    root = ROOT.TFile.Open(f, 'read')
-    if root and root.IsOpen() and not root.IsZombie():
+    root = open_root_file(f)
+    if root:
 
         # File opened successfully.
-        # Loop over this file keys.
         # To qualify as an artroot file, this file must contain the following objects:
         # 1.  A TTree called 'Events'
         # 2.  A TKey called 'RootFileDB'
+        # Only the keys are examined (objects are not read).
 
-        events = None
         has_events = False
         has_db = False
-        keys = root.GetListOfKeys()
-        for key in keys:
-            objname = key.GetName()
-            obj = root.Get(objname)
-            if objname == 'Events' and obj.InheritsFrom('TTree'):
-                has_events = True
-                events = obj
-            if objname == 'RootFileDB' and obj.InheritsFrom('TKey'):
-                has_db = True
-
-            artroot = has_db and has_events
+        key = root.GetKey('Events')
+        if key and ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom('TTree'):
+            has_events = True
+        if root.GetKey('RootFileDB'):
+            has_db = True
+        artroot = has_db and has_events
 
     # Done.
 
     if artroot:
         print('This is an artroot file.')
+        artroot_files.add(f)
     else:
         print('This is not an artroot file.')
+        non_artroot_files.add(f)
     return artroot
 
 
-# Extract trigger bit for artroot files.
+# Extract hardware trigger bits in-process from the raw::Trigger data product(s)
+# made by the daq (swizzler) module.
+# Trigger words are read from the split branch using the streamer information
+# stored in the file, so no dictionaries are needed.
+# Return a set of trigger bits, or None if the trigger product could not be read.
+
+def get_trigbits_root(f):
+
+    root = open_root_file(f)
+    if not root:
+        return None
+    events = root.Get('Events')
+    if not events:
+        return None
+
+    trigbits = set()
+    nbranch = 0
+    events.SetEstimate(events.GetEntries() + 1)
+    for branch in events.GetListOfBranches():
+        bname = branch.GetName()
+        if not bname.startswith('raw::Triggers_daq_'):
+            continue
+        n = events.Draw('%sobj.fTriggerBits' % bname, '', 'goff')
+        if n < 0:
+            return None
+        nbranch += 1
+        v = events.GetV1()
+        for i in range(n):
+            word = int(v[i])
+            for bit in range(32):
+                if word & (1 << bit):
+                    trigbits.add(bit)
+    if nbranch == 0:
+        return None
+    return trigbits
+
+
+# Extract trigger bits using an external lar process.
+
+def get_trigbits_lar(f):
 
-def get_trigbit(f):
-    trigbit = 0
     trigbits = set()
     cmd = ['lar', '-c', 'dump_triggers.fcl', '-s', f]
     out = larbatch_utilities.convert_str(subprocess.check_output(cmd))
@@ -1729,6 +1556,23 @@ def get_trigbit(f):
                 bit = int(words[0])
                 if not bit in trigbits:
                     trigbits.add(bit)
+    return trigbits
+
+
+# Extract trigger bit for artroot files.
+
+def get_trigbit(f):
+    trigbit = 0
+    trigbits = None
+    if inprocess:
+        try:
+            trigbits = get_trigbits_root(f)
+        except:
+            trigbits = None
+        if trigbits == None:
+            print('In-process trigger extraction failed, using lar.')
+    if trigbits == None:
+        trigbits = get_trigbits_lar(f)
     print()
     print('Trigger bits:', end='')
     for bit in trigbits:
@@ -1752,108 +1596,589 @@ def get_trigbit(f):
     return trigbit
 
 
-# Get beam type based on metadata.
+# Parse a parameter set blob.
+# Parameter set blobs are compact fcl ("key1:value1 key2:{...} key3:[...]").
+# Nested tables are normally stored as references to the ID of another
+# parameter set.
+# Parsed tables are lists of (key, value) tuples, where each value is a tuple
+# ('atom', text), ('table', list), or ('seq', list of values).
+
+def parse_pset_blob(blob):
+
+    items, i = parse_pset_table(blob, 0, None)
+    return items
+
+
+def parse_pset_table(blob, i, close):
+
+    items = []
+    n = len(blob)
+    while True:
+        while i < n and blob[i].isspace():
+            i += 1
+        if i >= n:
+            if close != None:
+                raise ValueError('Unterminated table in parameter set')
+            return items, i
+        if blob[i] == close:
+            return items, i+1
+        j = blob.find(':', i)
+        if j < 0:
+            raise ValueError('Bad parameter set %s' % blob[i:])
+        key = blob[i:j].strip()
+        value, i = parse_pset_value(blob, j+1)
+        items.append((key, value))
+
+
+def parse_pset_value(blob, i):
+
+    n = len(blob)
+    while i < n and blob[i].isspace():
+        i += 1
+    if i < n and blob[i] == '{':
+        items, i = parse_pset_table(blob, i+1, '}')
+        return ('table', items), i
+    if i < n and blob[i] == '[':
+        values = []
+        i += 1
+        while True:
+            while i < n and (blob[i].isspace() or blob[i] == ','):
+                i += 1
+            if i >= n:
+                raise ValueError('Unterminated sequence in parameter set')
+            if blob[i] == ']':
+                return ('seq', values), i+1
+            value, i = parse_pset_value(blob, i)
+            values.append(value)
+
+    # Atom (quoted string or bare word).
+
+    start = i
+    if i < n and blob[i] == '"':
+        i += 1
+        while i < n and blob[i] != '"':
+            if blob[i] == '\\':
+                i += 1
+            i += 1
+        i += 1
+    else:
+        while i < n and not blob[i].isspace() and blob[i] not in ',]}':
+            i += 1
+    return ('atom', blob[start:i]), i
 
-def get_beam(md):
 
-    result = ''
+# Pattern of parameter set ID references.
 
-    # Make a list of the current file name and all ancestor file names.
+pset_id_pattern = re.compile(r'^(@id::)?([0-9a-f]{32})$')
 
-    filenames = set()
-    filenames.add(md['file_name'])
-    dim = 'isancestorof: ( file_name %s )' % md['file_name']
-    ancestors = samweb.listFiles(dimensions = dim)
-    for ancestor in ancestors:
-        if ancestor.endswith('.ubdaq'):
-            continue
-        if ancestor.endswith('.crtdaq'):
-            continue
-        if ancestor.startswith('CRTHits'):
-            continue
-        if not ancestor in filenames:
-            filenames.add(ancestor)
 
-    # Loop over files.
+# Expand parameter set ID references in a parsed value, using a dictionary
+# of parameter set blobs indexed by ID.
+# Raise KeyError if a reference can not be resolved.
 
-    for f in filenames:
+def expand_pset_value(value, psets):
 
-        # Loop for clues in file names.
-
-        if f.lower().find('_bnb_') >= 0:
-            result = 'bnb'
-            print('Beam type is %s based on file name.' % result)
-        elif f.lower().find('_numi_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on file name.' % result)
-        elif f.lower().find('_rhc_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on file name.' % result)
-        elif f.lower().find('_fhc_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on file name.' % result)
-        if result != '':
-            break
+    if value[0] == 'table':
+        return ('table', [(key, expand_pset_value(v, psets)) for key, v in value[1]])
+    elif value[0] == 'seq':
+        return ('seq', [expand_pset_value(v, psets) for v in value[1]])
+    m = pset_id_pattern.match(value[1])
+    if m and (m.group(1) or not m.group(2).isdigit()):
+        psetid = m.group(2)
+        if psetid not in psets:
+            raise KeyError('Unresolved parameter set reference %s' % value[1])
+        return expand_pset_value(('table', parse_pset_blob(psets[psetid])), psets)
+    return value
 
-        # Look for clues in metadata.
 
-        mdf = None
-        if f == md['file_name']:
-            mdf = md
-        else:
-            mdf = samweb.getMetadata(f)
+# Format a parsed (expanded) table as multiline fcl text.
+
+def format_pset_table(items, indent, lines):
+
+    for key, value in items:
+        format_pset_value('%s%s: ' % (indent, key), value, indent, lines, '')
+
+
+def format_pset_value(prefix, value, indent, lines, suffix):
+
+    if value[0] == 'table':
+        lines.append('%s{' % prefix)
+        format_pset_table(value[1], indent + '   ', lines)
+        lines.append('%s}%s' % (indent, suffix))
+    elif value[0] == 'seq':
+        lines.append('%s[' % prefix)
+        for k in range(len(value[1])):
+            sep = ','
+            if k == len(value[1]) - 1:
+                sep = ''
+            format_pset_value(indent + '   ', value[1][k], indent + '   ', lines, sep)
+        lines.append('%s]%s' % (indent, suffix))
+    else:
+        lines.append('%s%s%s' % (prefix, value[1], suffix))
+
+
+# Convert parameter set blobs (dictionary indexed by ID, in database order) to
+# a parsed configuration, which is a list of (process name, table) tuples for the
+# top level parameter sets (those containing "process_name").  Nested parameter
+# set references are resolved.
+# Raise an exception if a reference can not be resolved.
+
+def psets_to_tables(psets):
+
+    tables = []
+    for psetid in psets:
+        items = parse_pset_blob(psets[psetid])
+        process_name = None
+        for key, value in items:
+            if key == 'process_name' and value[0] == 'atom':
+                process_name = value[1].strip('"')
+        if process_name != None:
+            tables.append((process_name, expand_pset_value(('table', items), psets)))
+    return tables
+
+
+# Convert a parsed configuration (see psets_to_tables) to multiline fcl text in
+# the same form as produced by "config_dumper -P".
+
+def tables_to_fcl_text(tables):
+
+    lines = []
+    format_pset_table(tables, '', lines)
+    return ''.join(['%s\n' % line for line in lines])
+
+
+# Read the RootFileDB sqlite database image from an open root file.
+# The database is stored as the payload of an ordinary key.  The payload is read
+# using TFile::ReadBuffer, which works for local files and urls (xrootd), and
+# decompressed block by block using root's own R__unzip (as in TKey::ReadObj).
+# Return database image (bytes), or None if it can not be read.
+
+def read_root_db(root):
+
+    key = root.GetKey('RootFileDB')
+    if not key:
+        return None
+    nbytes = key.GetNbytes() - key.GetKeylen()
+    objlen = key.GetObjlen()
+    src = ctypes.create_string_buffer(nbytes)
+    if root.ReadBuffer(src, key.GetSeekKey() + key.GetKeylen(), nbytes):
+        return None
+    if objlen <= nbytes:
+        return src.raw[:nbytes]
+
+    # Payload is compressed.
+
+    ROOT.gInterpreter.Declare('#include "RZip.h"')
+    tgt = (ctypes.c_ubyte * objlen)()
+    pos = 0
+    nout = 0
+    while pos < nbytes and nout < objlen:
+        srcblock = (ctypes.c_ubyte * (nbytes - pos)).from_buffer(src, pos)
+        tgtblock = (ctypes.c_ubyte * (objlen - nout)).from_buffer(tgt, nout)
+        nin = ctypes.c_int(0)
+        nbuf = ctypes.c_int(0)
+        irep = ctypes.c_int(0)
+        if ROOT.R__unzip_header(nin, srcblock, nbuf) != 0:
+            return None
+        ROOT.R__unzip(nin, srcblock, nbuf, tgtblock, irep)
+        if irep.value <= 0:
+            return None
+        pos += nin.value
+        nout += irep.value
+    return bytes(tgt)
+
+
+# Extract fcl configurations in-process from the RootFileDB sqlite database.
+# The database image is read with root (see read_root_db), so this works for
+# local files and urls.  The image is opened with sqlite, all parameter sets
+# are loaded, and top level parameter sets are expanded (see psets_to_tables).
+# Return parsed configuration, or None if in-process extraction is not possible.
+
+def get_fcl_tables_root(f):
+
+    root = open_root_file(f)
+    if not root:
+        return None
+    data = read_root_db(root)
+    if data == None or not data.startswith(b'SQLite format 3'):
+        return None
+
+    # Copy database to a temporary file and load parameter sets.
+
+    psets = {}
+    tmp = tempfile.NamedTemporaryFile(suffix='.db')
+    try:
+        tmp.write(data)
+        tmp.flush()
+        conn = sqlite3.connect(tmp.name)
+        for row in conn.execute('SELECT ID, PSetBlob FROM ParameterSets ORDER BY ROWID'):
+            psetid = larbatch_utilities.convert_str(row[0])
+            if psetid not in psets:
+                psets[psetid] = larbatch_utilities.convert_str(row[1])
+        conn.close()
+    finally:
+        tmp.close()
+
+    # Expand top level parameter sets.
+    # If any parameter set reference can not be resolved, give up (the caller
+    # falls back to config_dumper).
+
+    try:
+        return psets_to_tables(psets)
+    except (KeyError, ValueError) as e:
+        print(e)
+        return None
+
+
+# Extract fcl configurations using external program config_dumper.
+
+def get_fcl_text_dumper(f):
+
+    fcltext = io.StringIO()
+    cmd = ['config_dumper', '-P', '-s', f]
+    out = subprocess.check_output(cmd)
+    parse = False
+    for lineb in out.splitlines():
+        line = larbatch_utilities.convert_str(lineb)
+
+        # Start processing fcl parameters after first blank line.
+
+        if len(line) == 0:
+            parse = True
+        if parse:
+            fcltext.write('%s\n' % line)
+    return fcltext.getvalue()
+
+
+# Extract fcl configurations for artroot files.
+# Return a tuple (tables, fcltext), where tables is the parsed configuration
+# (see psets_to_tables), or None if the configuration could not be parsed, and
+# fcltext is the fcl text (input for fcl.make_pset_str).
+
+def get_fcl_config(f):
+
+    tables = None
+    if inprocess:
+        try:
+            tables = get_fcl_tables_root(f)
+        except:
+            tables = None
+        if tables == None or len(tables) == 0:
+            print('In-process configuration extraction failed, using config_dumper.')
+            tables = None
+    if tables != None:
+        return tables, tables_to_fcl_text(tables)
+
+    # Use config_dumper.  Its output has the same form as a parameter set blob.
+
+    fcltext = get_fcl_text_dumper(f)
+    try:
+        tables = parse_pset_blob(fcltext)
+    except ValueError:
+        tables = None
+    return tables, fcltext
+
+
+# Fetch sam metadata for a list of files, using the metadata cache.
+# Missing metadata is fetched in batches using getMultipleMetadata.
+# Files that are not known to sam are remembered as having empty metadata.
+
+def get_multiple_metadata(filenames):
+
+    missing = []
+    for f in filenames:
+        if not f in metadata_cache and not f in missing:
+            missing.append(f)
+    for i in range(0, len(missing), ancestry_batch_size):
+        chunk = missing[i:i+ancestry_batch_size]
+        for mdf in samweb.getMultipleMetadata(chunk):
+            metadata_cache[mdf['file_name']] = mdf
+        for f in chunk:
+            if not f in metadata_cache:
+                metadata_cache[f] = {}
+    return
+
+
+# Find beam type clues for a single file, based on its name and metadata.
+# Return a tuple (beam, source) where beam is "bnb", "numi", or "" (no clue),
+# and source is a description of where the clue came from.
+# Results are remembered, since sibling files share most of their ancestry.
+
+def get_beam_clue(f, mdf):
+
+    if f in beam_clues:
+        return beam_clues[f]
+    result = ('', '')
+
+    # Look for clues in file names.
+
+    if f.lower().find('_bnb_') >= 0:
+        result = ('bnb', 'file name')
+    elif f.lower().find('_numi_') >= 0:
+        result = ('numi', 'file name')
+    elif f.lower().find('_rhc_') >= 0:
+        result = ('numi', 'file name')
+    elif f.lower().find('_fhc_') >= 0:
+        result = ('numi', 'file name')
+
+    # Look for clues in metadata.
+
+    if result[0] == '':
         prj = ''
         if 'ub_project.name' in mdf:
             prj = mdf['ub_project.name']
         if prj.lower().find('_bnb_') >= 0:
-            result = 'bnb'
-            print('Beam type is %s based on sam project name.' % result)
+            result = ('bnb', 'sam project name')
         elif prj.lower().find('_numi_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on sam project name.' % result)
+            result = ('numi', 'sam project name')
         elif prj.lower().find('_fhc_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on sam project name.' % result)
+            result = ('numi', 'sam project name')
         elif prj.lower().find('_rhc_') >= 0:
-            result = 'numi'
-            print('Beam type is %s based on sam project name.' % result)
-        if result != '':
-            break
+            result = ('numi', 'sam project name')
 
-        # Look for clues in fcl file names.
-        
+    # Look for clues in fcl file names.
+
+    if result[0] == '':
         fcls = ''
         if 'fcl.name' in mdf:
             fcls = mdf['fcl.name']
         for fclname in fcls.split('/'):
             if fclname.lower().find('_bnb_') >= 0:
-                result = 'bnb'
-                print('Beam type is %s based on fcl name.' % result)
+                result = ('bnb', 'fcl name')
             elif fclname.lower().find('_numi_') >= 0:
-                result = 'numi'
-                print('Beam type is %s based on fcl name.' % result)
+                result = ('numi', 'fcl name')
+            if result[0] != '':
+                break
+
+    # Done.
+
+    beam_clues[f] = result
+    return result
+
+
+# Get beam type based on metadata.
+#
+# The current file and its ancestors are examined one generation at a time,
+# starting with the current file, until a clue is found.  Ancestors are found
+# using the parentage information in sam metadata.  The metadata for each
+# generation is fetched in a single batch, and both metadata and clues are
+# cached, so that files with common ancestors don't repeat any sam queries.
+
+def get_beam(md):
+
+    result = ''
+    source = ''
+
+    fname = md['file_name']
+    visited = set([fname])
+    generation = [fname]
+    first = True
+    while len(generation) > 0:
+
+        # Loop over files in this generation.
+
+        for f in generation:
+
+            # Skip raw and crt files (except the current file).
+
+            if not first:
+                if f.endswith('.ubdaq'):
+                    continue
+                if f.endswith('.crtdaq'):
+                    continue
+                if f.startswith('CRTHits'):
+                    continue
+
+            mdf = md
+            if not first:
+                mdf = metadata_cache[f]
+            result, source = get_beam_clue(f, mdf)
             if result != '':
                 break
         if result != '':
             break
 
+        # Find the next generation of ancestors.
+
+        parents = []
+        for f in generation:
+            mdf = md
+            if not first:
+                mdf = metadata_cache[f]
+            if 'parents' in mdf:
+                for parent in mdf['parents']:
+                    pname = parent
+                    if type(parent) == type({}):
+                        pname = parent['file_name']
+                    if not pname in visited:
+                        visited.add(pname)
+                        parents.append(pname)
+        get_multiple_metadata(parents)
+        generation = parents
+        first = False
+
     # If we still haven't determined the beam type, assume it is bnb.
 
     if result == '':
         result = 'bnb'
         print('Last resort assuming beam type is bnb.')
+    else:
+        print('Beam type is %s based on %s.' % (result, source))
 
     # Done
 
     return result
 
 
+# Per-job parameters (of source parameter sets) that are excluded from
+# configuration fingerprints.
+
+fingerprint_skip_params = ['fileNames', 'firstRun', 'firstSubRun', 'firstEvent',
+                           'maxEvents', 'skipEvents']
+
+
+# Return a canonical copy of a parsed value (see parse_pset_blob), with table
+# keys sorted, and per-job parameters removed from source parameter sets.
+
+def canonical_pset_value(value, key=''):
+
+    if value[0] == 'table':
+        items = []
+        for k, v in value[1]:
+            if key == 'source' and k in fingerprint_skip_params:
+                continue
+            items.append((k, canonical_pset_value(v, k)))
+        items.sort(key=lambda item: item[0])
+        return ('table', items)
+    elif value[0] == 'seq':
+        return ('seq', [canonical_pset_value(v) for v in value[1]])
+    return value
+
+
+# Calculate the configuration fingerprint (sha1 hash) from the parsed
+# configuration returned by get_fcl_config.  The fingerprint is calculated
+# before (and without) converting the configuration with fcl.make_pset_str,
+# so that files with a cached fingerprint are not parsed by fhicl at all.
+# Per-job source parameters are removed, and the remaining configuration is
+# hashed in canonical form, so that the fingerprint does not depend on the
+# layout of the fcl text.  If the configuration could not be parsed, the fcl
+# text itself is hashed.
+
+def config_fingerprint(tables, fcltext):
+
+    text = fcltext
+    if tables != None:
+        lines = []
+        format_pset_value('', canonical_pset_value(('table', tables)), '', lines, '')
+        text = '\n'.join(lines)
+    return hashlib.sha1(larbatch_utilities.convert_bytes(text)).hexdigest()
+
+
+# Return a string that identifies the check options and check code,
+# for use in the fingerprint cache key.
+
+def config_checks_key(do_services, do_io, do_timing, do_optical, do_flux, do_remap,
+                      do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce):
+
+    flags = (do_services, do_io, do_timing, do_optical, do_flux, do_remap,
+             do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce, warnfatal)
+    key = ''.join([str(int(bool(flag))) for flag in flags])
+    key += ':' + ','.join(sorted(skip_processes))
+    with open(os.path.abspath(__file__), 'rb') as script:
+        key += ':' + hashlib.sha1(script.read()).hexdigest()
+    return key
+
+
+# Open the fingerprint cache database (once per process).
+# Return None if caching is not enabled.
+
+def open_config_cache():
+
+    global config_cache_conn
+    global config_cache_pid
+
+    if config_cache == '':
+        return None
+    if config_cache_conn != None and config_cache_pid == os.getpid():
+        return config_cache_conn
+
+    conn = sqlite3.connect(config_cache, timeout=60)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS config_results (
+                 fingerprint text,
+                 trigbit integer,
+                 beam text,
+                 epoch text,
+                 overlay integer,
+                 checks text,
+                 result integer,
+                 output text,
+                 create_time real,
+                 records text,
+                 PRIMARY KEY (fingerprint, trigbit, beam, epoch, overlay, checks))''')
+
+    # Add records column to caches made before structured results existed.
+
+    columns = [row[1] for row in c.execute('PRAGMA table_info(config_results)')]
+    if not 'records' in columns:
+        c.execute('ALTER TABLE config_results ADD COLUMN records text')
+    conn.commit()
+    config_cache_conn = conn
+    config_cache_pid = os.getpid()
+    return conn
+
+
+# Look up cached configuration check result.
+# Return a tuple (result, output, records), or None if not cached.
+
+def get_cached_result(fingerprint, trigbit, beam, epoch, is_overlay, checks):
+
+    conn = open_config_cache()
+    if conn == None:
+        return None
+    c = conn.cursor()
+    q = '''SELECT result, output, records FROM config_results
+           WHERE fingerprint=? AND trigbit=? AND beam=? AND epoch=? AND overlay=? AND checks=?'''
+    c.execute(q, (fingerprint, trigbit, beam, epoch, int(is_overlay), checks))
+    row = c.fetchone()
+    if row == None:
+        return None
+    records = []
+    if row[2] != None:
+        records = json.loads(row[2])
+    elif json_enabled:
+        return None
+    return (row[0] != 0, row[1], records)
+
+
+# Store configuration check result in cache.
+
+def put_cached_result(fingerprint, trigbit, beam, epoch, is_overlay, checks, result, output, records):
+
+    conn = open_config_cache()
+    if conn == None:
+        return
+    c = conn.cursor()
+    q = '''INSERT OR REPLACE INTO config_results
+           (fingerprint, trigbit, beam, epoch, overlay, checks, result, output, create_time, records)
+           VALUES(?,?,?,?,?,?,?,?,?,?)'''
+    records_json = None
+    if json_enabled:
+        records_json = json.dumps(records)
+    c.execute(q, (fingerprint, trigbit, beam, epoch, int(is_overlay), checks,
+                  int(result), output, time.time(), records_json))
+    conn.commit()
+    return
+
+
 # Check a single file.
 # Return True if file is OK, False if not OK.
 
 def check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, do_flux, do_remap,
                do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce):
 
+    global last_fingerprint
+
     fname = os.path.basename(f)
     result = True
 
@@ -1862,7 +2187,9 @@ def check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, do_flux
 
     epoch = get_epoch(md)
     if epoch == '':
-        print('Could not determine epoch.')
+        begin_check('epoch')
+        report('error', 'Could not determine epoch.')
+        end_check('epoch', False)
         result = False
     else:
         print('Epoch %s' % epoch)
@@ -1877,7 +2204,9 @@ def check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, do_flux
 
         print()
         print('Checking CRT merging.')
+        begin_check('crt')
         crtok = check_crt_merge.check_file(fname)
+        end_check('crt', crtok)
         if not crtok:
             result = False
 
@@ -1913,35 +2242,324 @@ def check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, do_flux
     if md['file_type'] == 'overlay':
         is_overlay = True
 
+    file_info['epoch'] = epoch
+    file_info['beam'] = beam
+    file_info['trigbit'] = trigbit
+    file_info['overlay'] = is_overlay
+
     # For artroot files, extract all fcl configurations.
 
     if artroot:
         print('Extracting fcl parameters.')
-        fcltext = io.StringIO()
-        cmd = ['config_dumper', '-P', '-s', f]
-        out = subprocess.check_output(cmd)
-        parse = False
-        for lineb in out.splitlines():
-            line = larbatch_utilities.convert_str(lineb)
-
-            # Start processing fcl parameters after first blank line.
-
-            if len(line) == 0:
-                parse = True
-            if parse:
-                fcltext.write('%s\n' % line)
-
-        # Convert fcl configuration to python dictionary.
-
-        cfg = fcl.make_pset_str(fcltext.getvalue())
-        cfgok = check_config(cfg, trigbit, beam, epoch, is_overlay,
-                             do_services, do_io, do_timing, do_optical, do_flux, do_remap,
-                             do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce)
+        tables, fcltext = get_fcl_config(f)
+        fingerprint = config_fingerprint(tables, fcltext)
+        print('Configuration fingerprint %s' % fingerprint)
+        last_fingerprint = fingerprint
+
+        # Look for a cached result with the same configuration fingerprint.
+
+        cached = None
+        if config_cache != '':
+            checks = config_checks_key(do_services, do_io, do_timing, do_optical, do_flux,
+                                       do_remap, do_asics, do_chstat, do_pmt, do_ly, do_elife,
+                                       do_larpid, do_sce)
+            cached = get_cached_result(fingerprint, trigbit, beam, epoch, is_overlay, checks)
+
+        if cached != None:
+            cfgok, output, records = cached
+            print('Using cached configuration check results.')
+            sys.stdout.write(output)
+            json_records.extend(records)
+
+        else:
+
+            # Convert fcl configuration to python dictionary.
+
+            cfg = fcl.make_pset_str(fcltext)
+
+            # If caching, capture the check output so that it can be stored.
+
+            nrecords = len(json_records)
+            saved_stdout = sys.stdout
+            if config_cache != '':
+                sys.stdout = io.StringIO()
+            try:
+                cfgok = check_config(cfg, trigbit, beam, epoch, is_overlay,
+                                     do_services, do_io, do_timing, do_optical, do_flux, do_remap,
+                                     do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce)
+            finally:
+                if sys.stdout != saved_stdout:
+                    output = sys.stdout.getvalue()
+                    sys.stdout = saved_stdout
+                    sys.stdout.write(output)
+            if config_cache != '':
+                put_cached_result(fingerprint, trigbit, beam, epoch, is_overlay, checks,
+                                  cfgok, output, json_records[nrecords:])
         if not cfgok:
             result = False
 
     # Done.
 
+    close_root_file()
+    return result
+
+
+# Check one file, including sam metadata extraction.
+# The file may be a local path or a url.  If sam metadata is already known,
+# it can be passed as argument md.
+# Return a tuple (counted, ok), where "counted" is False if the file was ignored
+# (no sam metadata), and "ok" is True if the file passed all checks.
+# The configuration fingerprint is left in global variable last_fingerprint.
+
+def check_one_file(f, do_crt, do_services, do_io, do_timing, do_optical, do_flux, do_remap,
+                   do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce, md=None):
+
+    global last_fingerprint
+    global json_records
+    global file_info
+
+    last_fingerprint = ''
+    json_records = []
+    file_info = {}
+    set_report_context()
+    print('Checking file %s' % f)
+
+    # Do preliminary checks to ensure that a) file exists, nd b) has sam metadata.
+
+    if f.find('://') < 0 and not os.path.exists(f):
+        print('File does not exist.')
+        sys.exit(1)
+
+    # Extract sam metadata for this file.
+    # If this file doesn't have sam metadata, skip this file (not an error).
+
+    mdok = False
+    ignore = False
+    fname = os.path.basename(f)
+
+    try:
+        if md == None:
+            md = samweb.getMetadata(fname)
+        mdok = True
+        ignore = False
+
+    except samweb_cli.exceptions.FileNotFound:
+
+        # File not found errors are ignored.
+
+        md = {}
+        mkok = False
+        ignore = True
+
+    except:
+
+        # Any other exception treat as error.
+
+        print('Error extracting sam metadata for file %s.' % fname)
+        md = {}
+        mdok = False
+        ignore = False
+
+    # If we got an ignorable metadata error, try sam_metadata_dumper
+
+    if ignore and not mdok and is_artroot(f):
+        print('File %s is not declared in sam.' % fname)
+        print('Trying sam_metadata_dumper')
+        cmd = ['sam_metadata_dumper', f]
+        mdout = larbatch_utilities.convert_str(subprocess.check_output(cmd))
+        mdtop = json.loads(mdout)
+        md = {}
+        if fname in mdtop:
+            md = mdtop[fname]
+
+        # If sam_metadata_dumper worked, fix up metadata dictionary to resemble 
+        # format returned by samweb.
+
+        if md != {}:
+            md['file_name'] = fname
+            if 'fclName' in md:
+                md['fcl.name'] = md['fclName']
+            if 'fclVersion' in md:
+                md['fcl.version'] = md['fclVersion']
+            if 'ubProjectName' in md:
+                md['ub_project.name'] = md['ubProjectName']
+            if 'ubProjectStage' in md:
+                md['ub_project.stage'] = md['ubProjectStage']
+            if 'ubProjectVersion' in md:
+                md['ub_project.version'] = md['ubProjectVersion']
+
+            print('Extracted sam metadata using sam_metadata_dumper.')
+            mdok = True
+            ignore = False
+
+            # Skip crt checks if file is not declared to sam.
+
+            do_crt = False
+
+    if ignore or not mdok:
+        close_root_file()
+    if ignore:
+        print('Ignoring file %s because it does not have metadata.' % fname)
+        add_file_record('ignored')
+        return False, False
+
+    if not mdok:
+        add_file_record('error')
+        return True, False
+
+    # Do further checks for this file.
+
+    ok = check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, 
+                    do_flux, do_remap, do_asics, do_chstat, do_pmt, do_ly, do_elife,
+                    do_larpid, do_sce)
+    if ok:
+        add_file_record('ok')
+    else:
+        add_file_record('error')
+    return True, ok
+
+
+# Add the overall result record for the current file.
+
+def add_file_record(status):
+
+    if json_enabled:
+        record = {'type': 'file', 'status': status, 'fingerprint': last_fingerprint}
+        record.update(file_info)
+        json_records.append(record)
+
+
+# Count failed checks by check name, based on structured results.
+
+def count_failed_checks(failed_checks, records):
+
+    for record in records:
+        if record['type'] == 'check' and record['status'] == 'error':
+            check = record['check']
+            if not check in failed_checks:
+                failed_checks[check] = 0
+            failed_checks[check] += 1
+
+
+# Check one file in serial or parallel mode, including url lookup for dataset files.
+# Argument md is sam metadata (or None), and checks is a tuple of check flags.
+# Exceptions (including dataset files without an xrootd url) are treated as
+# a failed check, so that checking continues with the next file.
+# Return a tuple (f, counted, ok), where f is the url of dataset files.
+
+def check_one_file_safe(f, md, checks):
+
+    global last_fingerprint
+    global json_records
+    global file_info
+
+    last_fingerprint = ''
+    json_records = []
+    file_info = {}
+    counted = True
+    ok = False
+    try:
+        f = get_file_url(f, md)
+        counted, ok = check_one_file(f, *checks, md=md)
+    except SystemExit:
+        print('***** Check aborted.')
+        add_file_record('error')
+    except:
+        traceback.print_exc(file=sys.stdout)
+        print('***** Exception while checking file.')
+        add_file_record('error')
+    return f, counted, ok
+
+
+# Process pool worker function for parallel mode.
+# Argument is a tuple (f, md, checks) (see check_one_file_safe).
+# Output is captured and returned, so that output from different files
+# doesn't get interleaved.
+# Return a tuple (f, counted, ok, fingerprint, output, records).
+
+def check_one_file_captured(args):
+
+    f, md, checks = args
+    out = io.StringIO()
+    saved_stdout = sys.stdout
+    sys.stdout = out
+    try:
+        f, counted, ok = check_one_file_safe(f, md, checks)
+    finally:
+        sys.stdout = saved_stdout
+    return f, counted, ok, last_fingerprint, out.getvalue(), json_records
+
+
+# Get the url of a dataset file.
+# Argument md is None for local files (in which case f is returned unchanged).
+
+def get_file_url(f, md):
+
+    if md == None:
+        return f
+    urls = samweb.getFileAccessUrls(f, schema='root')
+    if len(urls) == 0:
+        raise IOError('No xrootd url for file %s' % f)
+    return urls[0]
+
+
+# Get files in a sam dataset.
+#
+# Sam metadata for all files is fetched in batches.  Files are ordered by
+# stratified sampling:  files are grouped by epoch and run, and the list
+# cycles over epochs, and within each epoch over runs, taking a randomly
+# chosen file from each run.  If nsample is nonzero, the list is truncated
+# to nsample files.
+#
+# Return a list of tuples (file name, metadata).
+
+def get_dataset_files(defname, nsample):
+
+    print('Querying files in dataset %s' % defname)
+    filenames = samweb.listFiles(defname=defname)
+    print('Dataset contains %d files.' % len(filenames))
+
+    # Group files by epoch and run.
+
+    strata = {}
+    for i in range(0, len(filenames), ancestry_batch_size):
+        for md in samweb.getMultipleMetadata(filenames[i:i+ancestry_batch_size]):
+            run = 0
+            if 'runs' in md and len(md['runs']) > 0:
+                run = md['runs'][0][0]
+            epoch = get_epoch(md)
+            if not epoch in strata:
+                strata[epoch] = {}
+            if not run in strata[epoch]:
+                strata[epoch][run] = []
+            strata[epoch][run].append((md['file_name'], md))
+
+    # Make round robin list of runs for each epoch.
+
+    epoch_lists = []
+    for epoch in sorted(strata.keys()):
+        runs = list(strata[epoch].values())
+        for files in runs:
+            random.shuffle(files)
+        random.shuffle(runs)
+        epoch_list = []
+        while len(runs) > 0:
+            for files in runs:
+                epoch_list.append(files.pop())
+            runs = [files for files in runs if len(files) > 0]
+        epoch_list.reverse()
+        epoch_lists.append(epoch_list)
+
+    # Interleave epochs.
+
+    result = []
+    while len(epoch_lists) > 0:
+        for epoch_list in epoch_lists:
+            result.append(epoch_list.pop())
+        epoch_lists = [epoch_list for epoch_list in epoch_lists if len(epoch_list) > 0]
+    if nsample > 0:
+        result = result[:nsample]
+    print('Checking %d files from %d epochs.' % (len(result), len(strata)))
     return result
 
 
@@ -1951,6 +2569,10 @@ def main(argv):
 
     global warnfatal
     global skip_processes
+    global config_cache
+    global inprocess
+    global json_enabled
+    global json_out
 
     # Statistics.
 
@@ -1962,10 +2584,14 @@ def main(argv):
     filenames = set()
     dirnames = set()
     fclname = ''
+    defname = ''
+    nsample = 0
+    max_fingerprints = 0
     trigbit = 0      # bnb=11, numi=12, ext=9
     beam_type = ''   # "bnb" or "numi"
     epoch = ''       # "1x", "2x", "3x", "4x", "5"
     is_overlay = False
+    njobs = 1
 
     do_all = True
     do_crt = False
@@ -2012,10 +2638,35 @@ def main(argv):
             if not dirname in dirnames:
                 dirnames.add(dirname)
             del args[0:2]
+        elif args[0] == '--def' and len(args) > 1:
+            defname = args[1]
+            del args[0:2]
+        elif args[0] == '--sample' and len(args) > 1:
+            nsample = int(args[1])
+            del args[0:2]
+        elif args[0] == '--max-fingerprints' and len(args) > 1:
+            max_fingerprints = int(args[1])
+            del args[0:2]
         elif (args[0] == '-c' or args[0] == '--config') and len(args) > 1:
             fclname = args[1]
             warnfatal = True
             del args[0:2]
+        elif (args[0] == '-j' or args[0] == '--jobs') and len(args) > 1:
+            njobs = int(args[1])
+            if njobs < 1:
+                print('Invalid number of jobs %d' % njobs)
+                sys.exit(1)
+            del args[0:2]
+        elif args[0] == '--cache' and len(args) > 1:
+            config_cache = args[1]
+            del args[0:2]
+        elif args[0] == '--json' and len(args) > 1:
+            json_out = open(args[1], 'w')
+            json_enabled = True
+            del args[0:2]
+        elif args[0] == '--external':
+            inprocess = False
+            del args[0]
         elif (args[0] == '--trigger') and len(args) > 1:
             trigger = args[1]
             if trigger == 'bnb':
@@ -2156,7 +2807,7 @@ def main(argv):
 
     # Default if no options specified.
 
-    if fclname == '' and len(filenames) == 0 and len(dirnames) == 0:
+    if fclname == '' and defname == '' and len(filenames) == 0 and len(dirnames) == 0:
         dirnames.add('.')
 
     # Update action flags.
@@ -2247,6 +2898,9 @@ def main(argv):
     if fclname != '' and len(files_to_check) > 0:
         print('Fcl and files both specified.')
         sys.exit(1)
+    if defname != '' and (fclname != '' or len(files_to_check) > 0):
+        print('Dataset and fcl or files both specified.')
+        sys.exit(1)
 
     # If checking a fcl, name sure that trigger, beam, and epoch are specified.
 
@@ -2270,100 +2924,86 @@ def main(argv):
                           do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce)
         if ok:
             nfileok += 1        
+        write_json_records(fclname, json_records)
 
     # Check files.
+    # Make a list of tuples (file, metadata), where metadata is None for local files.
 
-    for f in files_to_check:
-
-        print('Checking file %s' % f)
-
-        # Do preliminary checks to ensure that a) file exists, nd b) has sam metadata.
-
-        if not os.path.exists(f):
-            print('File does not exist.')
-            sys.exit(1)
-
-        # Extract sam metadata for this file.
-        # If this file doesn't have sam metadata, skip this file (not an error).
-
-        md = {}
-        mdok = False
-        ignore = False
-        fname = os.path.basename(f)
-
+    tasks = []
+    if defname != '':
+        tasks = get_dataset_files(defname, nsample)
+    else:
+        for f in files_to_check:
+            tasks.append((f, None))
+
+    checks = (do_crt, do_services, do_io, do_timing, do_optical, do_flux, do_remap,
+              do_asics, do_chstat, do_pmt, do_ly, do_elife, do_larpid, do_sce)
+    fingerprints = set()
+    failed_checks = {}
+    nfiles = len(tasks)
+    ndone = 0
+    if njobs > 1 and nfiles > 1:
+
+        # Parallel mode.
+        # Each worker process checks one file at a time and returns its captured output,
+        # which is printed as soon as the file is finished.
+
+        pool = multiprocessing.Pool(min(njobs, nfiles))
         try:
-            md = samweb.getMetadata(fname)
-            mdok = True
-            ignore = False
-
-        except samweb_cli.exceptions.FileNotFound:
-
-            # File not found errors are ignored.
-
-            md = {}
-            mkok = False
-            ignore = True
-
+            for f, counted, ok, fingerprint, out, records in \
+                pool.imap_unordered(check_one_file_captured,
+                                    [(f, md, checks) for f, md in tasks]):
+                ndone += 1
+                sys.stdout.write(out)
+                write_json_records(f, records)
+                count_failed_checks(failed_checks, records)
+                if counted:
+                    nfile += 1
+                    if ok:
+                        nfileok += 1
+                        print('\nFinished file %s (%d/%d): OK' % (f, ndone, nfiles))
+                    else:
+                        print('\nFinished file %s (%d/%d): ***** Bad' % (f, ndone, nfiles))
+                else:
+                    print('\nFinished file %s (%d/%d): Ignored' % (f, ndone, nfiles))
+                sys.stdout.flush()
+                if fingerprint != '':
+                    fingerprints.add(fingerprint)
+                if max_fingerprints > 0 and len(fingerprints) >= max_fingerprints:
+                    break
+            if ndone < nfiles:
+                pool.terminate()
+            else:
+                pool.close()
         except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
-            # Any other exception treat as error.
-
-            print('Error extracting sam metadata for file %s.' % fname)
-            md = {}
-            mdok = False
-            ignore = False
-
-        # If we got an ignorable metadata error, try sam_metadata_dumper
-
-        if ignore and not mdok and is_artroot(f):
-            print('File %s is not declared in sam.' % fname)
-            print('Trying sam_metadata_dumper')
-            cmd = ['sam_metadata_dumper', f]
-            mdout = larbatch_utilities.convert_str(subprocess.check_output(cmd))
-            mdtop = json.loads(mdout)
-            md = {}
-            if fname in mdtop:
-                md = mdtop[fname]
-
-            # If sam_metadata_dumper worked, fix up metadata dictionary to resemble 
-            # format returned by samweb.
-
-            if md != {}:
-                md['file_name'] = fname
-                if 'fclName' in md:
-                    md['fcl.name'] = md['fclName']
-                if 'fclVersion' in md:
-                    md['fcl.version'] = md['fclVersion']
-                if 'ubProjectName' in md:
-                    md['ub_project.name'] = md['ubProjectName']
-                if 'ubProjectStage' in md:
-                    md['ub_project.stage'] = md['ubProjectStage']
-                if 'ubProjectVersion' in md:
-                    md['ub_project.version'] = md['ubProjectVersion']
-
-                print('Extracted sam metadata using sam_metadata_dumper.')
-                mdok = True
-                ignore = False
-
-                # Skip crt checks if file is not declared to sam.
-
-                do_crt = False
-
-        if ignore:
-            print('Ignoring file %s because it does not have metadata.' % fname)
-            continue
-
-        nfile += 1
-        if not mdok:
-            continue
+    else:
 
-        # Do further checks for this file.
+        # Serial mode.
+
+        for f, md in tasks:
+            url, counted, ok = check_one_file_safe(f, md, checks)
+            ndone += 1
+            write_json_records(f, json_records)
+            count_failed_checks(failed_checks, json_records)
+            if counted:
+                nfile += 1
+                if ok:
+                    nfileok += 1
+            if last_fingerprint != '':
+                fingerprints.add(last_fingerprint)
+            if max_fingerprints > 0 and len(fingerprints) >= max_fingerprints:
+                break
 
-        ok = check_file(f, md, do_crt, do_services, do_io, do_timing, do_optical, 
-                        do_flux, do_remap, do_asics, do_chstat, do_pmt, do_ly, do_elife,
-                        do_larpid, do_sce)
-        if ok:
-            nfileok += 1
+    if ndone < nfiles:
+        print('\nStopping after %d distinct configuration fingerprints.' % len(fingerprints))
+        print('%d files not checked.' % (nfiles - ndone))
+    elif len(fingerprints) > 0:
+        print('\n%d distinct configuration fingerprints.' % len(fingerprints))
 
     # Print statistics.
 
@@ -2379,6 +3019,13 @@ def main(argv):
     else:
         print('Configuration checks failed.')
         rc = 1
+    if json_out != None:
+        json_out.write('%s\n' % json.dumps({'type': 'summary',
+                                             'files': nfile,
+                                             'files_ok': nfileok,
+                                             'failed_checks': failed_checks,
+                                             'rc': rc}, sort_keys=True))
+        json_out.close()
     return rc
 
 
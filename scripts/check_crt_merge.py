@@ -15,20 +15,60 @@
 # -f|--file - Specify single file.
 # -d|--def  - Specify dataset.
 # -n        - Number of dataset files to chedk (default 10).
+# -j        - Number of files to check concurrently (default 1).
+# --all     - Audit all files in dataset (see below).
+# --summary <db> - Sqlite database for per-run audit summary (with --all).
 #
 ########################################################################
 #
 # Created: 17-Nov-2023  H. Greenlee
 #
+# Usage notes.
+#
+# 1.  Parentage is determined from sam metadata ("parents"), which is
+#     cached for the lifetime of this program.  Before checking, the
+#     ancestry of all files to be checked is fetched one generation at
+#     a time using bulk metadata queries (getMultipleMetadata), so that
+#     files that share ancestors don't repeat any sam queries.
+#     Parents are filtered by sam availability using bulk dimension
+#     queries (also cached), with the same availability clauses as the
+#     original "isparentof:" queries ("anylocation" when looking for
+#     unmerged parents of merged files, default availability when
+#     following ancestry to the CRT parent), so retired or virtual
+#     parents are not chosen.
+#
+# 2.  With option -j, files are checked in a pool of worker processes,
+#     which inherit the prefetched metadata cache.  The output for each
+#     file is printed as a block when that file is finished.
+#
+# 3.  With option --all, every file in the dataset is audited.  Files are
+#     grouped by run, and within each run by CRT signature, which consists
+#     of the top panel CRT swizzler sam and ups versions and the CRT merge
+#     fcl name and version.  One representative file for each signature is
+#     checked in full, and its verdict is propagated to the other files
+#     with the same signature.  A per-run summary is printed.
+#
+# 4.  With option --summary, audit results are stored in an sqlite database,
+#     with one row per file (table crt_files) and one row per run (table
+#     crt_runs).  Files that are already in the database are not checked
+#     again, so that repeated audits of a growing dataset only check new
+#     files.  Files that have been removed from the dataset are removed
+#     from the database.
+#
 ########################################################################
 
 from __future__ import print_function
-import sys, os, random
+import sys, os, random, io, traceback, fnmatch, time
+import multiprocessing, sqlite3
 import samweb_cli
+import run_periods
 
 # Global variables.
 
 samweb = samweb_cli.SAMWebClient(experiment = 'uboone')
+metadata_cache = {}      # Sam metadata, indexed by file name.
+availability_cache = {}  # Available file names, indexed by sam availability.
+batch_size = 100         # Maximum number of files per getMultipleMetadata call.
 
 
 # Help function.
@@ -52,16 +92,114 @@ def help():
                 print()
 
 
+# Fetch sam metadata for a list of files into the metadata cache.
+# Files that are not known to sam are cached as empty metadata.
+
+def get_multiple_metadata(filenames):
+
+    missing = []
+    for f in filenames:
+        if not f in metadata_cache and not f in missing:
+            missing.append(f)
+    for i in range(0, len(missing), batch_size):
+        chunk = missing[i:i+batch_size]
+        for md in samweb.getMultipleMetadata(chunk):
+            metadata_cache[md['file_name']] = md
+        for f in chunk:
+            if not f in metadata_cache:
+                metadata_cache[f] = {}
+    return
+
+
+# Get sam metadata of a single file (cached).
+
+def get_metadata(f):
+
+    get_multiple_metadata([f])
+    return metadata_cache[f]
+
+
+# Determine which of a list of files satisfy a sam availability clause
+# ("default" or "anylocation"), using bulk dimension queries (cached).
+
+def get_multiple_availability(filenames, availability):
+
+    if not availability in availability_cache:
+        availability_cache[availability] = {}
+    cache = availability_cache[availability]
+    missing = []
+    for f in filenames:
+        if not f in cache and not f in missing:
+            missing.append(f)
+    for i in range(0, len(missing), batch_size):
+        chunk = missing[i:i+batch_size]
+        dim = 'file_name %s with availability %s' % (', '.join(chunk), availability)
+        available = set(samweb.listFiles(dim))
+        for f in chunk:
+            cache[f] = f in available
+    return
+
+
+# Get parent file names of a single file (sorted).
+# If availability is specified, only parents that satisfy the sam
+# availability clause are returned, matching the semantics of an
+# "isparentof:" query with that availability.
+
+def get_parents(f, availability=None):
+
+    result = []
+    md = get_metadata(f)
+    if 'parents' in md:
+        for parent in md['parents']:
+            if type(parent) == type({}):
+                result.append(parent['file_name'])
+            else:
+                result.append(parent)
+    if availability != None and len(result) > 0:
+        get_multiple_availability(result, availability)
+        cache = availability_cache[availability]
+        result = [parent for parent in result if cache[parent]]
+    result.sort()
+    return result
+
+
+# Prefetch the ancestry of a list of files.
+# Metadata is fetched one generation at a time using bulk queries.
+# Ancestry is not followed beyond CRT files (their parents are not needed).
+
+def prefetch_ancestry(filenames):
+
+    visited = set(filenames)
+    generation = list(filenames)
+    ngen = 0
+    while len(generation) > 0:
+        get_multiple_metadata(generation)
+        ngen += 1
+        parents = []
+        for f in generation:
+            if f.startswith('CRT'):
+                continue
+            for parent in get_parents(f):
+                if not parent in visited:
+                    visited.add(parent)
+                    parents.append(parent)
+        generation = parents
+    get_multiple_availability(sorted(visited), 'default')
+    get_multiple_availability(sorted(visited), 'anylocation')
+    print('Prefetched metadata for %d files (%d generations).' % (len(visited), ngen))
+
+
 # Filter grandparents out of parent list.
 
 def filter_parents(parents):
 
     result = set(parents)
+    get_multiple_metadata(parents)
 
     # Loop over original parents.
 
     for parent in parents:
-        gparents = samweb.listFiles('isparentof:( file_name %s ) with availability anylocation' % parent)
+        gparents = get_parents(parent, 'anylocation')
         for gparent in gparents:
             if gparent in result:
                 result.remove(gparent)
@@ -79,17 +217,17 @@ def get_crt_merge_fcl(f):
     fclname = ''
     fclversion = ''
 
-    md = samweb.getMetadata(f)
+    md = get_metadata(f)
     if 'fcl.name' in md:
         fclname = md['fcl.name']
 
         # If this is a standard merge fcl, check unmerged parents.
 
         if fclname.startswith('merge'):
-            parents = samweb.listFiles('isparentof:( file_name %s ) and not file_name CRT%% with availability anylocation' % f)
+            parents = [parent for parent in get_parents(f, 'anylocation') if not parent.startswith('CRT')]
             fparents = filter_parents(parents)
             if len(fparents) > 0:
-                mdp = samweb.getMetadata(fparents.pop())
+                mdp = get_metadata(sorted(fparents)[0])
                 if 'fcl.name' in mdp:
                     fclname = mdp['fcl.name']
                 if 'fcl.version' in mdp:
@@ -113,23 +251,228 @@ def get_crt_parent(f):
 
         # Look for top panel CRT parent.
 
-        crts = samweb.listFiles('isparentof:( file_name %s ) and file_name CRTHits%%-crt01.1%%' % f)
+        parents = get_parents(f, 'default')
+        crts = fnmatch.filter(parents, 'CRTHits*-crt01.1*')
         if len(crts) > 0:
             crt = crts[0]
             break
 
         # This file doesn't have CRT parents.  Find non-CRT parent
+        # (any parent if there are only CRT parents).
 
-        parents = samweb.listFiles('isparentof:( file_name %s )' % f)
         if len(parents) == 0:
             break
-        f = parents[0]
+        noncrts = [parent for parent in parents if not parent.startswith('CRT')]
+        if len(noncrts) > 0:
+            f = noncrts[0]
+        else:
+            f = parents[0]
 
     # Done.
 
     return crt, f
 
 
+# Extract run number and epoch from metadata.
+# Return run=-1 if run can not be determined, or epoch='' if epoch can not
+# be determined.  Epochs before '2b' are before CRT era.  CRT merge
+# requirements are only defined up to epoch '5'.
+
+def get_run_epoch(md):
+
+    run = -1
+    if 'runs' in md:
+        runs = md['runs']
+        if len(runs) > 0:
+            run = runs[0][0]
+
+    epoch = ''
+    if run >= 0:
+        epoch = run_periods.get_epoch(run)
+        if epoch > '5':
+            epoch = ''
+
+    return run, epoch
+
+
+# Get the CRT signature of a file, without printing anything.
+# Return a tuple (run, epoch, signature), where signature is a tuple
+# (CRT swizzler sam version, CRT swizzler ups version, merge fcl name, merge fcl version).
+# Signature is None if run or epoch can not be determined, or if the
+# file is before the CRT era.
+
+def get_signature(filename):
+
+    md = get_metadata(filename)
+    run, epoch = get_run_epoch(md)
+    if run < 0 or epoch == '' or epoch < '2b':
+        return run, epoch, None
+
+    crtfile, pfile = get_crt_parent(filename)
+    samv = ''
+    upsv = ''
+    if crtfile != '':
+        mdcrt = get_metadata(crtfile)
+        if 'ub_project.version' in mdcrt:
+            samv = mdcrt['ub_project.version']
+        if 'fcl.version' in mdcrt:
+            upsv = mdcrt['fcl.version']
+    fclname, fclversion = get_crt_merge_fcl(pfile)
+    return run, epoch, (samv, upsv, fclname, fclversion)
+
+
+# Open audit summary database.
+
+def open_summary(dbpath):
+
+    conn = sqlite3.connect(dbpath, timeout=60)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS crt_files (
+                 defname text,
+                 file_name text,
+                 run integer,
+                 epoch text,
+                 signature text,
+                 representative text,
+                 ok integer,
+                 check_time real,
+                 PRIMARY KEY (defname, file_name))''')
+    c.execute('CREATE INDEX IF NOT EXISTS crt_files_run ON crt_files (defname, run)')
+    c.execute('''CREATE TABLE IF NOT EXISTS crt_runs (
+                 defname text,
+                 run integer,
+                 epoch text,
+                 nfiles integer,
+                 nfiles_ok integer,
+                 nsignatures integer,
+                 update_time real,
+                 PRIMARY KEY (defname, run))''')
+    conn.commit()
+    return conn
+
+
+# Audit all files in a dataset.
+# Return a tuple (nfile, nfileok).
+
+def audit_dataset(defname, files, summary):
+
+    conn = None
+    known = {}
+    if summary != '':
+        conn = open_summary(summary)
+        c = conn.cursor()
+
+        # Remove files that are no longer in the dataset.
+
+        c.execute('SELECT file_name, run FROM crt_files WHERE defname=?', (defname,))
+        rows = c.fetchall()
+        fileset = set(files)
+        touched_runs = set()
+        for file_name, run in rows:
+            if file_name in fileset:
+                known[file_name] = run
+            else:
+                c.execute('DELETE FROM crt_files WHERE defname=? AND file_name=?',
+                          (defname, file_name))
+                touched_runs.add(run)
+        print('%d files already audited.' % len(known))
+        if len(rows) > len(known):
+            print('%d files removed from dataset.' % (len(rows) - len(known)))
+
+    # Find signatures of new files.
+
+    new_files = [f for f in files if not f in known]
+    print('Auditing %d files.' % len(new_files))
+    prefetch_ancestry(new_files)
+    runs = {}
+    for f in new_files:
+        run, epoch, signature = get_signature(f)
+        if not run in runs:
+            runs[run] = {}
+        if not signature in runs[run]:
+            runs[run][signature] = []
+        runs[run][signature].append(f)
+
+    # Check one representative file per run and signature.
+
+    verdicts = {}      # Verdicts, indexed by file name.
+    epochs = {}        # Epochs, indexed by run.
+    for run in sorted(runs.keys()):
+        for signature in sorted(runs[run].keys(), key=str):
+            group = runs[run][signature]
+            rep = group[0]
+            ok = check_file(rep)
+            if len(group) > 1:
+                print('Propagating verdict to %d files with the same signature.' % (len(group) - 1))
+            for f in group:
+                verdicts[f] = (run, signature, rep, ok)
+            epochs[run] = get_run_epoch(get_metadata(rep))[1]
+
+    # Update database.
+
+    if conn != None:
+        now = time.time()
+        for f in new_files:
+            run, signature, rep, ok = verdicts[f]
+            c.execute('''INSERT OR REPLACE INTO crt_files
+                         (defname, file_name, run, epoch, signature, representative, ok, check_time)
+                         VALUES(?,?,?,?,?,?,?,?)''',
+                      (defname, f, run, epochs[run], str(signature), rep, int(ok), now))
+            touched_runs.add(run)
+
+        # Update per-run summary for runs with new or removed files.
+
+        for run in touched_runs:
+            c.execute('''SELECT MAX(epoch), COUNT(*), SUM(ok), COUNT(DISTINCT signature)
+                         FROM crt_files WHERE defname=? AND run=?''', (defname, run))
+            epoch, n, nok, nsig = c.fetchone()
+            if n == 0:
+                c.execute('DELETE FROM crt_runs WHERE defname=? AND run=?', (defname, run))
+            else:
+                c.execute('''INSERT OR REPLACE INTO crt_runs
+                             (defname, run, epoch, nfiles, nfiles_ok, nsignatures, update_time)
+                             VALUES(?,?,?,?,?,?,?)''',
+                          (defname, run, epoch, n, nok, nsig, now))
+        conn.commit()
+
+        # Read back summary for the whole dataset.
+
+        c.execute('''SELECT run, epoch, nfiles, nfiles_ok, nsignatures FROM crt_runs
+                     WHERE defname=? ORDER BY run''', (defname,))
+        rows = c.fetchall()
+        conn.close()
+
+    else:
+
+        # Make summary from this audit only.
+
+        rows = []
+        for run in sorted(runs.keys()):
+            n = 0
+            nok = 0
+            for signature in runs[run]:
+                for f in runs[run][signature]:
+                    n += 1
+                    if verdicts[f][3]:
+                        nok += 1
+            rows.append((run, epochs[run], n, nok, len(runs[run])))
+
+    # Print per-run summary.
+
+    nfile = 0
+    nfileok = 0
+    print('\nPer-run summary:')
+    print('%8s %6s %8s %8s %8s %10s' % ('Run', 'Epoch', 'Files', 'OK', 'Bad', 'Signatures'))
+    for run, epoch, n, nok, nsig in rows:
+        print('%8d %6s %8d %8d %8d %10d' % (run, epoch, n, nok, n - nok, nsig))
+        nfile += n
+        nfileok += nok
+
+    # Done.
+
+    return nfile, nfileok
+
+
 # Check CRT status of a single file.
 # Return False if remerge recommended.
 
@@ -141,15 +484,11 @@ def check_file(filename):
 
     # Get metadata of this file.
 
-    md = samweb.getMetadata(filename)
+    md = get_metadata(filename)
 
-    # Extract run number.
+    # Extract run number and epoch.
 
-    run = -1
-    if 'runs' in md:
-        runs = md['runs']
-        if len(runs) > 0:
-            run = runs[0][0]
+    run, epoch = get_run_epoch(md)
 
     if run >= 0:
         print('Run number %d' % run)
@@ -157,28 +496,6 @@ def check_file(filename):
         print('Unable to determine run number.')
         return False
 
-    # Determine epoch (2b-5).
-
-    epoch=''
-    if run <= 25769:
-        epoch = '5'
-    if run <= 24319:
-        epoch = '4d'
-    if run <= 22269:
-        epoch = '4c'
-    if run <= 21285:
-        epoch = '4b'
-    if run <= 19752:
-        epoch = '4a'
-    if run <= 18960:
-        epoch = '3b'
-    if run <= 14116:
-        epoch = '3a'
-    if run <= 13696:
-        epoch = '2b'
-    if run <= 11048:
-        epoch = '1'
-
     if epoch != '':
         print('Epoch %s' % epoch)
         if epoch < '2b':
@@ -198,7 +515,7 @@ def check_file(filename):
     crtupsok = False
     if crtfile != '':
         print('Found top panel CRT parent %s' % crtfile)
-        mdcrt = samweb.getMetadata(crtfile)
+        mdcrt = get_metadata(crtfile)
         samv = ''
         upsv = ''
         if 'ub_project.version' in mdcrt:
@@ -289,6 +606,27 @@ def check_file(filename):
 
 
 
+# Process pool worker function.
+# Output is captured and returned, so that output from different files
+# doesn't get interleaved.  Exceptions are treated as a failed check.
+# Return a tuple (filename, ok, output).
+
+def check_file_captured(filename):
+
+    out = io.StringIO()
+    saved_stdout = sys.stdout
+    sys.stdout = out
+    ok = False
+    try:
+        ok = check_file(filename)
+    except:
+        traceback.print_exc(file=out)
+        print('Exception while checking file.')
+    finally:
+        sys.stdout = saved_stdout
+    return filename, ok, out.getvalue()
+
+
 # Main function.
 
 def main(argv):
@@ -303,6 +641,9 @@ def main(argv):
     defname = ''
     filename = ''
     ncheck = 10
+    njobs = 1
+    audit = False
+    summary = ''
 
     args = argv[1:]
     while len(args) > 0:
@@ -318,6 +659,15 @@ def main(argv):
         elif (args[0] == '-n') and len(args) > 1:
             ncheck = int(args[1])
             del args[0:2]
+        elif (args[0] == '-j') and len(args) > 1:
+            njobs = int(args[1])
+            del args[0:2]
+        elif args[0] == '--all':
+            audit = True
+            del args[0]
+        elif args[0] == '--summary' and len(args) > 1:
+            summary = args[1]
+            del args[0:2]
         else:
             print('Unknown option %s' % args[0])
             sys.exit(1)
@@ -333,6 +683,9 @@ def main(argv):
     if defname != '' and filename != '':
         print('Only specify one of dataset or file name.')
         sys.exit(1)
+    if audit and defname == '':
+        print('Option --all requires a dataset.')
+        sys.exit(1)
 
     # Make a set of filenames to check.
 
@@ -359,6 +712,14 @@ def main(argv):
             print('Dataset is empty.')
             sys.exit(1)
 
+        # Full audit mode.
+
+        if audit:
+            nfile, nfileok = audit_dataset(defname, files, summary)
+            print('\n%d files checked.' % nfile)
+            print('%d files OK.' % nfileok)
+            return (nfileok < nfile)
+
         # Choose files
 
         random.shuffle(files)
@@ -368,16 +729,41 @@ def main(argv):
             print('Adding %s' % files[i])
             files_to_check.add(files[i])
 
+    # Fetch metadata for all files and their ancestors in bulk.
+
+    prefetch_ancestry(sorted(files_to_check))
+
     # Loop over files.
 
-    for filename in files_to_check:
+    if njobs > 1 and len(files_to_check) > 1:
 
-        # Check this file.
+        # Parallel mode.
 
-        nfile += 1
-        ok = check_file(filename)
-        if ok:
-              nfileok += 1
+        pool = multiprocessing.Pool(min(njobs, len(files_to_check)))
+        try:
+            for filename, ok, out in pool.imap_unordered(check_file_captured, files_to_check):
+                sys.stdout.write(out)
+                sys.stdout.flush()
+                nfile += 1
+                if ok:
+                    nfileok += 1
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    else:
+
+        for filename in files_to_check:
+
+            # Check this file.
+
+            nfile += 1
+            ok = check_file(filename)
+            if ok:
+                  nfileok += 1
 
     # Print statistics.
 
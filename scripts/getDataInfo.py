@@ -8,91 +8,288 @@ import sys
 sys.path.append("/uboone/data/uboonebeam/beamdb")
 import os
 import samweb_cli
-import threading
+import multiprocessing
+import multiprocessing.pool
 import time
 import logging
 import json
+import csv
+import re
 import confDB
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+def getPrescaleFactors(runs):
+    #returns prescale factors for a list of runs as dictionary pf[run]
+    #prescale factors are constant within a run, so they are memoized per run (runPrescale)
+    #runs not yet known are loaded in bulk from the local cache (if any), then from confDB
+    global cfgDB
+    need=[run for run in set(runs) if run not in runPrescale]
+    if len(need)>0:
+        ccon=None
+        if args.prescale_cache is not None:
+            ccon=sqlite3.connect(args.prescale_cache)
+            ccon.execute("CREATE TABLE IF NOT EXISTS prescale (run INTEGER PRIMARY KEY, factors TEXT)")
+            for i in range(0,len(need),500):
+                batch=need[i:i+500]
+                query="SELECT run,factors FROM prescale WHERE run IN (%s)"%(",".join(["?"]*len(batch)))
+                for row in ccon.execute(query,batch):
+                    runPrescale[row[0]]=json.loads(row[1])
+            need=[run for run in need if run not in runPrescale]
+        if len(need)>0:
+            if cfgDB is None:
+                cfgDB=confDB.confDB()
+            for run in sorted(need):
+                runPrescale[run]=cfgDB.getAllPrescaleFactors(run)
+            if ccon is not None:
+                #only runs with prescale data are cached, missing data may be added later
+                ccon.executemany("INSERT OR REPLACE INTO prescale (run,factors) VALUES (?,?)",
+                                 [(run,json.dumps(runPrescale[run])) for run in need if runPrescale[run] is not None])
+                ccon.commit()
+        if ccon is not None:
+            ccon.close()
+    return dict((run,runPrescale[run]) for run in runs)
+
+def prescaleMatch(k,pfkey):
+    #True if prescale factor pfkey applies to trigger count column k
+    return (("EXT" in k and "EXT_" in pfkey) or
+            ("Gate1" in k and "NUMI_" in pfkey) or
+            ("Gate2" in k and "BNB_" in pfkey))
+
+def applyPrescaleFactors(runsums,r,missprescale):
+    #adds prescale weighted trigger counts to r, given per run sums [(run,{col:sum}),...]
+    #returns True if prescale factors are missing for some run with data
+    prescalewarn=False
+    pfs=getPrescaleFactors([run for run,sums in runsums])
+    for run,sums in runsums:
+        pf=pfs[run]
+        if pf is None:
+            if len(sums)>0:
+                missprescale[run]=[]
+                prescalewarn=True
+            continue
+        for pfkey in pf:
+            if pfkey not in r:
+                r[pfkey]=0
+        for k in sums:
+            for pfkey in pf:
+                if prescaleMatch(k,pfkey):
+                    r[pfkey]+=pf[pfkey]*sums[k]
+    return prescalewarn
 
-def getDataGivenFileList(flist,r):
-    #query SAM for each file in file list and gets run and subrun processed from meta data
-    #puts that into dictionary rslist[run]=list_of_subruns
-    con=sqlite3.connect("%s/run.db"%dbdir)
-    con.row_factory=sqlite3.Row
-    cur=con.cursor()
-    cur.execute("ATTACH DATABASE '%s/bnb_v%i.db' AS bnb"%(dbdir,version))
-    cur.execute("ATTACH DATABASE '%s/numi_v%i.db' AS numi"%(dbdir,version))
-
-    cfgDB=confDB.confDB()
+def applyPrescaleFactorsColumnar(runs,runsum,runhas,sumcols,r,missprescale):
+    #vectorized version of applyPrescaleFactors
+    #runs is an array of runs, runsum and runhas are (run x column) arrays of sums and data flags
+    prescalewarn=False
+    pfs=getPrescaleFactors([int(run) for run in runs])
+    pfkeys=[]
+    for irun in range(len(runs)):
+        pf=pfs[int(runs[irun])]
+        if pf is None:
+            if runhas[irun].any():
+                missprescale[int(runs[irun])]=[]
+                prescalewarn=True
+            continue
+        for pfkey in pf:
+            if pfkey not in r:
+                r[pfkey]=0
+            if pfkey not in pfkeys:
+                pfkeys.append(pfkey)
+    if len(pfkeys)==0:
+        return prescalewarn
+
+    #weights (run x prescale key) and column to prescale key mapping (column x prescale key)
+    weights=numpy.zeros((len(runs),len(pfkeys)))
+    for irun in range(len(runs)):
+        pf=pfs[int(runs[irun])]
+        if pf is not None:
+            for ipf in range(len(pfkeys)):
+                weights[irun,ipf]=pf.get(pfkeys[ipf],0.)
+    match=numpy.array([[1. if prescaleMatch(k,pfkey) else 0. for pfkey in pfkeys] for k in sumcols])
+    weighted=(numpy.dot(runsum,match)*weights).sum(axis=0)
+    for ipf in range(len(pfkeys)):
+        r[pfkeys[ipf]]+=weighted[ipf]
+    return prescalewarn
+
+def getInfoStream():
+    #returns stream for informational messages, which go to stderr for machine readable output formats
+    if args.output_format=="text":
+        return sys.stdout
+    return sys.stderr
+
+def getDBURI(fname):
+    #returns URI of a beam database file, opened read only
+    #with --immutable, databases are read without locking or change detection (only safe
+    #for database copies that are not updated while querying)
+    #only %, ? and # need escaping in the path of a file: URI
+    path=os.path.join(os.path.abspath(dbdir),fname)
+    path=path.replace("%","%25").replace("?","%3f").replace("#","%23")
+    uri="file:%s?mode=ro"%path
+    if args.immutable:
+        uri+="&immutable=1"
+    return uri
+
+def getDBCursor():
+    #returns cursor on the shared connection to run.db with bnb and numi databases attached
+    #the connection is opened once per process (worker processes open their own after fork)
+    #and keeps the prepared statements for repeated (parameterized) queries
+    global dbcon
+    if dbcon is None or dbcon[0]!=os.getpid():
+        con=sqlite3.connect(getDBURI("run.db"),uri=True,cached_statements=256)
+        con.row_factory=sqlite3.Row
+        con.execute("ATTACH DATABASE ? AS bnb",(getDBURI("bnb_v%i.db"%version),))
+        con.execute("ATTACH DATABASE ? AS numi",(getDBURI("numi_v%i.db"%version),))
+        for schema in ["main","bnb","numi"]:
+            con.execute("PRAGMA %s.mmap_size=%i"%(schema,args.mmap_size*1024*1024))
+        dbcon=(os.getpid(),con)
+    return dbcon[1].cursor()
+
+def checkQueryPlan(cur,query,params=()):
+    #warns (once per query) if runinfo, bnb or numi is fully scanned, or searched with an
+    #automatic (temporary) index, instead of searched with the run/subrun index
+    if query in checkedPlans:
+        return
+    checkedPlans.add(query)
+    cur.execute("EXPLAIN QUERY PLAN "+query,params)
+    for row in cur.fetchall():
+        m=re.match(r"(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?(.*)",row[-1])
+        if m is None or (m.group(3) or m.group(2)) not in ("r","b","n"):
+            continue
+        if m.group(1)=="SCAN" or "AUTOMATIC" in m.group(4):
+            mess="Warning!! Query does not use run/subrun index (%s)."%row[-1]
+            logging.warning("%s %s"%(mess,query))
+            print(mess,file=sys.stderr)
+
+def executeQuery(cur,query,params=()):
+    #checks query plan and executes query
+    checkQueryPlan(cur,query,params)
+    cur.execute(query,params)
+    return cur
+
+def loadRunSubrunTable(cur,rspairs):
+    #loads (run, subrun) pairs into temporary table rslist
+    #returns dbquerybase joined to rslist (alias t), select list prefix is left to the caller
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS rslist (run INTEGER, subrun INTEGER)")
+    cur.execute("DELETE FROM rslist")
+    cur.executemany("INSERT INTO rslist (run, subrun) VALUES (?,?)",rspairs)
+    return dbquerybase.replace(" FROM runinfo AS r"," FROM rslist AS t LEFT OUTER JOIN runinfo AS r ON r.run=t.run AND r.subrun=t.subrun",1)
+
+def getDataGivenRunSubrunPairs(cur,rspairs,r):
+    #loads (run, subrun) pairs into a temporary table and sums the requested columns
+    #with one join against runinfo and the attached bnb and numi databases
+    #missing data is found from the same LEFT JOIN (NULL sum for a run/subrun)
+    rsquery=loadRunSubrunTable(cur,rspairs)
+
+    #per entry sums, same as querying each run/subrun separately
+    entryquery=rsquery.replace("SELECT ","SELECT t.rowid AS rowid, t.run AS run, t.subrun AS subrun,",1)
+    entryquery+=" GROUP BY t.rowid"
+
+    cur.execute("SELECT * FROM (%s) LIMIT 0"%entryquery)
+    qcols=[d[0] for d in cur.description if d[0] not in ('rowid','run','subrun')]
+    sumcols=[k for k in r if k in qcols]
 
     bnbwarn=False
     numiwarn=False
     otherwarn=False
     prescalewarn=False
-    samweb = samweb_cli.SAMWebClient(experiment='uboone')
-    try:
-        meta=samweb.getMetadataIterator(flist)
-    except Exception as e:
-        print("Failed to get metadata from SAM.")
-        print("Make sure to setup sam_web_client v2_1 or higher.")
-        print(e)
-        sys.exit(0)
-
     missbnb={}
     missnumi={}
     missother={}
     missprescale={}
 
-    mcount=0
-    for m in meta:
-        mcount+=1
-        for rs in m['runs']:
-            pf=None
+    misscols=[k for k in sumcols if k in bnbcols or k in numicols or k=="EXT"]
+
+    if columnar and len(sumcols)>0:
+        #fetch all requested subruns as columns in one query, NULL becomes NaN
+        query="SELECT run,subrun,%s FROM (%s) ORDER BY rowid"%(",".join(sumcols),entryquery)
+        executeQuery(cur,query)
+        rows=cur.fetchall()
+        runs=numpy.array([row[0] for row in rows],dtype=numpy.int64)
+        subruns=numpy.array([row[1] for row in rows],dtype=numpy.int64)
+        vals=numpy.array([tuple(row)[2:] for row in rows],dtype=float).reshape(len(rows),len(sumcols))
+        isdata=~numpy.isnan(vals)
+        vals[~isdata]=0.
+
+        #per run sums (runs in order of first appearance) and totals
+        urun,first,inv=numpy.unique(runs,return_index=True,return_inverse=True)
+        order=numpy.argsort(first)
+        runsum=numpy.zeros((len(urun),len(sumcols)))
+        numpy.add.at(runsum,inv,vals)
+        runhas=numpy.zeros((len(urun),len(sumcols)),dtype=bool)
+        numpy.logical_or.at(runhas,inv,isdata)
+        totals=runsum.sum(axis=0)
+        for icol in range(len(sumcols)):
+            if runhas[:,icol].any():
+                r[sumcols[icol]]+=totals[icol]
+        if prescaleFactor:
+            prescalewarn=applyPrescaleFactorsColumnar(urun[order],runsum[order],runhas[order],sumcols,r,missprescale)
+
+        #run/subruns with missing data
+        if len(misscols)>0:
+            imiss=[sumcols.index(k) for k in misscols]
+            missing=~isdata[:,imiss]
+            for ient in numpy.nonzero(missing.any(axis=1))[0]:
+                rs=(int(runs[ient]),int(subruns[ient]))
+                for icol in range(len(misscols)):
+                    if not missing[ient,icol]:
+                        continue
+                    k=misscols[icol]
+                    if k in bnbcols:
+                        miss=missbnb
+                        bnbwarn=True
+                    elif k in numicols:
+                        miss=missnumi
+                        numiwarn=True
+                    else:
+                        miss=missother
+                        otherwarn=True
+                    if rs[0] not in miss:
+                        miss[rs[0]]=[rs[1]]
+                    elif rs[1] not in miss[rs[0]]:
+                        miss[rs[0]].append(rs[1])
+
+    else:
+
+        #totals per run (prescale factors are per run and applied to the per run sums)
+        if len(sumcols)>0:
+            query="SELECT run,%s FROM (%s) GROUP BY run ORDER BY MIN(rowid)"%(",".join(["SUM(%s) AS %s"%(k,k) for k in sumcols]),entryquery)
+            executeQuery(cur,query)
+            runsums=[]
+            for row in cur.fetchall():
+                sums={}
+                for k in sumcols:
+                    if row[k] is not None:
+                        sums[k]=row[k]
+                        r[k]+=row[k]
+                runsums.append((row['run'],sums))
             if prescaleFactor:
-                pf=cfgDB.getAllPrescaleFactors(int(rs[0]))
-            if pf is not None:
-                for pfkey in pf:
-                    if pfkey not in r:
-                        r[pfkey]=0
-            query="%s WHERE r.run=%i AND r.subrun=%i"%(dbquerybase, int(rs[0]),int(rs[1]))
-            cur.execute(query)
-            row=cur.fetchone()
-            for k in r:
-                if k in list(row.keys()) and row[k] is not None:
-                    if pf is not None:
-                        for pfkey in pf:
-                            if "EXT" in k and "EXT_" in pfkey:
-                                r[pfkey]+=pf[pfkey]*row[k]
-                            elif "Gate1" in k and "NUMI_" in pfkey:
-                                r[pfkey]+=pf[pfkey]*row[k]
-                            elif "Gate2" in k and "BNB_" in pfkey:
-                                r[pfkey]+=pf[pfkey]*row[k]
-                    elif prescaleFactor:
-                        if rs[0] not in missprescale:
-                            missprescale[rs[0]]=[rs[1]]
-                        elif rs[1] not in missprescale[rs[0]]:
-                            missprescale[rs[0]].append(rs[1])
-                        prescalewarn=True
-                    
-                    r[k]+=row[k]
-                elif k in bnbcols:
-                    if rs[0] not in missbnb:
-                        missbnb[rs[0]]=[rs[1]]
-                    elif rs[1] not in missbnb[rs[0]]:
-                        missbnb[rs[0]].append(rs[1])
-                    bnbwarn=True
-                elif k in numicols:
-                    if rs[0] not in missnumi:
-                        missnumi[rs[0]]=[rs[1]]
-                    elif rs[1] not in missnumi[rs[0]]:
-                        missnumi[rs[0]].append(rs[1])
-                    numiwarn=True
-                elif k is "EXT":
-                    if rs[0] not in missother:
-                        missother[rs[0]]=[rs[1]]
-                    elif rs[1] not in missother[rs[0]]:
-                        missother[rs[0]].append(rs[1])
-                    otherwarn=True
+                prescalewarn=applyPrescaleFactors(runsums,r,missprescale)
+
+        #run/subruns with missing data
+        if len(misscols)>0:
+            query="SELECT * FROM (%s) WHERE %s ORDER BY rowid"%(entryquery," OR ".join(["%s IS NULL"%k for k in misscols]))
+            executeQuery(cur,query)
+            for row in cur.fetchall():
+                rs=(row['run'],row['subrun'])
+                for k in misscols:
+                    if row[k] is not None:
+                        continue
+                    if k in bnbcols:
+                        miss=missbnb
+                        bnbwarn=True
+                    elif k in numicols:
+                        miss=missnumi
+                        numiwarn=True
+                    else:
+                        miss=missother
+                        otherwarn=True
+                    if rs[0] not in miss:
+                        miss[rs[0]]=[rs[1]]
+                    elif rs[1] not in miss[rs[0]]:
+                        miss[rs[0]].append(rs[1])
+
     r['bnbwarn']=bnbwarn
     r['numiwarn']=numiwarn
     r['otherwarn']=otherwarn
@@ -101,117 +298,173 @@ def getDataGivenFileList(flist,r):
     r['missnumi']=missnumi
     r['missother']=missother
     r['missprescale']=missprescale
-    if mcount != len(flist):
-        print("Warning! Did not get metadata for all files. Looped through %i files, but only got metadata for %i. Check list for repeats or bad file names."%(len(flist),mcount))
-        logging.debug("Warning! Did not get metadata for all files.")
-
-    con.close()
-    return 
-
-def getDataGivenRSList(rslist,r):
-    con=sqlite3.connect("%s/run.db"%dbdir)
-    con.row_factory=sqlite3.Row
-    cur=con.cursor()
-    cur.execute("ATTACH DATABASE '%s/bnb_v%i.db' AS bnb"%(dbdir,version))
-    cur.execute("ATTACH DATABASE '%s/numi_v%i.db' AS numi"%(dbdir,version))
+    return
 
-    cfgDB=confDB.confDB()
+def getMetadataRunSubruns(flist):
+    #gets run and subrun processed from SAM metadata for a chunk of files
+    #returns list of (file name, run/subrun pairs) for files with metadata
+    samweb = samweb_cli.SAMWebClient(experiment='uboone')
+    try:
+        meta=samweb.getMetadataIterator(flist)
+        fpairs=[]
+        for m in meta:
+            fpairs.append((m['file_name'],[(int(rs[0]),int(rs[1])) for rs in m['runs']]))
+    except Exception as e:
+        return None,str(e)
+    return fpairs,None
 
-    bnbwarn=False
-    numiwarn=False
-    otherwarn=False
-    prescalewarn=False
-    missbnb={}
-    missnumi={}
-    missother={}
-    missprescale={}
+def getRunSubrunsGivenFileList(flist,nthr):
+    #query SAM for each file in file list and gets run and subrun processed from meta data
+    #metadata for chunks of files is fetched concurrently in nthr threads (I/O bound)
+    #run/subruns of a file never change, so they are cached per file name in the local
+    #run/subrun cache (if any) and only files not in the cache are fetched from SAM
+    filers={}
+    rcon=None
+    ufiles=[]
+    for f in flist:
+        if f not in filers:
+            filers[f]=None
+            ufiles.append(f)
+    if args.rs_cache is not None:
+        rcon=sqlite3.connect(args.rs_cache)
+        rcon.execute("CREATE TABLE IF NOT EXISTS filers (file_name TEXT PRIMARY KEY, runs TEXT)")
+        for i in range(0,len(ufiles),500):
+            batch=ufiles[i:i+500]
+            query="SELECT file_name,runs FROM filers WHERE file_name IN (%s)"%(",".join(["?"]*len(batch)))
+            for row in rcon.execute(query,batch):
+                filers[row[0]]=[tuple(rs) for rs in json.loads(row[1])]
+    fetch=[f for f in ufiles if filers[f] is None]
+    logging.debug("Fetching metadata for %i of %i files"%(len(fetch),len(ufiles)))
+
+    if len(fetch)>0:
+        chunksize=max(1,min(1000,(len(fetch)+nthr-1)//nthr))
+        chunks=[fetch[i:i+chunksize] for i in range(0,len(fetch),chunksize)]
+        pool=multiprocessing.pool.ThreadPool(max(1,min(nthr,len(chunks))))
+        results=pool.map(getMetadataRunSubruns,chunks)
+        pool.close()
+        pool.join()
+
+        fetched=[]
+        for fpairs,err in results:
+            if err is not None:
+                print("Failed to get metadata from SAM.")
+                print("Make sure to setup sam_web_client v2_1 or higher.")
+                print(err)
+                sys.exit(0)
+            for fname,pairs in fpairs:
+                if fname in filers:
+                    filers[fname]=pairs
+                    fetched.append((fname,json.dumps(pairs)))
+        if rcon is not None:
+            rcon.executemany("INSERT OR REPLACE INTO filers (file_name,runs) VALUES (?,?)",fetched)
+            rcon.commit()
+    if rcon is not None:
+        rcon.close()
+
+    rspairs=[]
     mcount=0
+    for f in ufiles:
+        if filers[f] is not None:
+            rspairs.extend(filers[f])
+            mcount+=1
+    return rspairs,mcount
+
+def getRunSubrunsGivenRSList(rslist):
+    rspairs=[]
     for rsrow in rslist:
         rs=rsrow.split(" ")
-        pf=None
-        if prescaleFactor:
-            pf=cfgDB.getAllPrescaleFactors(rs[0])
-        if pf is not None:
-            for pfkey in pf:
-                if pfkey not in r:
-                    r[pfkey]=0
+        rspairs.append((int(rs[0]),int(rs[1])))
+    return rspairs
+
+def getDataGivenRunSubrunChunk(rspairs):
+    #worker for one chunk of run/subrun pairs, returns partial result
+    r=dict(rtemplate)
+    getDataGivenRunSubrunPairs(getDBCursor(),rspairs,r)
+    return r
+
+def mergeResults(r,rlist):
+    #adds partial results in rlist to r (in order)
+    #counts are summed, warnings or-ed, and missing run/subrun lists combined
+    for rpart in rlist:
+        for k in rpart:
+            if isinstance(rpart[k],bool):
+                r[k]=r.get(k,False) or rpart[k]
+            elif isinstance(rpart[k],dict):
+                if k not in r:
+                    r[k]={}
+                for rk in rpart[k]:
+                    if rk not in r[k]:
+                        r[k][rk]=[]
+                    for sr in rpart[k][rk]:
+                        if sr not in r[k][rk]:
+                            r[k][rk].append(sr)
+            else:
+                r[k]=r.get(k,0)+rpart[k]
+    return
 
-        query="%s WHERE r.run=%i AND r.subrun=%i"%(dbquerybase, int(rs[0]),int(rs[1]))
-        cur.execute(query)
-        row=cur.fetchone()
-        for k in r:
-            if k in list(row.keys()) and row[k] is not None:
-                if pf is not None:
-                    for pfkey in pf:
-                        if "EXT" in k and "EXT_" in pfkey:
-                            r[pfkey]+=pf[pfkey]*row[k]
-                        elif "Gate1" in k and "NUMI_" in pfkey:
-                            r[pfkey]+=pf[pfkey]*row[k]
-                        elif "Gate2" in k and "BNB_" in pfkey:
-                            r[pfkey]+=pf[pfkey]*row[k]
-                elif prescaleFactor:
-                    if rs[0] not in missprescale:
-                        missprescale[rs[0]]=[rs[1]]
-                    elif rs[1] not in missprescale[rs[0]]:
-                        missprescale[rs[0]].append(rs[1])
-                    prescalewarn=True
-                    
-                r[k]+=row[k]
-            elif k in bnbcols:
-                if rs[0] not in missbnb:
-                    missbnb[rs[0]]=[rs[1]]
-                elif rs[1] not in missbnb[rs[0]]:
-                    missbnb[rs[0]].append(rs[1])
-                bnbwarn=True
-            elif k in numicols:
-                if rs[0] not in missnumi:
-                    missnumi[rs[0]]=[rs[1]]
-                elif rs[1] not in missnumi[rs[0]]:
-                    missnumi[rs[0]].append(rs[1])
-                numiwarn=True
-            elif k is "EXT":
-                if rs[0] not in missother:
-                    missother[rs[0]]=[rs[1]]
-                elif rs[1] not in missother[rs[0]]:
-                    missother[rs[0]].append(rs[1])
-                otherwarn=True
+def getDataGivenRunSubrunList(rspairs,r,nproc):
+    #splits run/subrun list into contiguous chunks and aggregates each chunk
+    #in a separate process, partial results are merged in list order
+    nproc=max(1,min(nproc,len(rspairs)))
+    chunks=[]
+    for ich in range(nproc):
+        chunks.append(rspairs[ich*len(rspairs)//nproc:(ich+1)*len(rspairs)//nproc])
+    logging.debug("Running in %i process(es)"%nproc)
 
-    r['bnbwarn']=bnbwarn
-    r['numiwarn']=numiwarn
-    r['otherwarn']=otherwarn
-    r['prescalewarn']=prescalewarn
-    r['missbnb']=missbnb
-    r['missnumi']=missnumi
-    r['missother']=missother
-    r['missprescale']=missprescale
+    #load prescale factors for all runs before starting worker processes
+    if prescaleFactor:
+        getPrescaleFactors(sorted(set([rs[0] for rs in rspairs])))
+
+    if nproc==1:
+        rlist=[getDataGivenRunSubrunChunk(rspairs)]
+    else:
+        #check query plans once (on an empty list) before starting worker processes
+        getDataGivenRunSubrunChunk([])
+        pool=multiprocessing.Pool(nproc)
+        rlist=pool.map(getDataGivenRunSubrunChunk,chunks)
+        pool.close()
+        pool.join()
+    for k in ['bnbwarn','numiwarn','otherwarn','prescalewarn']:
+        r[k]=False
+    for k in ['missbnb','missnumi','missother','missprescale']:
+        r[k]={}
+    mergeResults(r,rlist)
+    return
 
-    con.close()
-    return 
+def benchmark(flist,rspairs,nmax):
+    #times metadata fetching (if file list is given) and aggregation of the same
+    #run/subrun list for increasing number of threads/processes
+    print("%10s %10s %10s"%("nthreads","time (s)","speedup"),file=getInfoStream())
+    n=1
+    t1=None
+    while True:
+        r=dict(rtemplate)
+        t0=time.time()
+        if flist is not None:
+            rspairs,mcount=getRunSubrunsGivenFileList(flist,n)
+        getDataGivenRunSubrunList(rspairs,r,n)
+        dt=time.time()-t0
+        if t1 is None:
+            t1=dt
+        print("%10i %10.3f %10.2f"%(n,dt,t1/dt if dt>0 else 0.),file=getInfoStream())
+        if n>=nmax:
+            break
+        n=min(2*n,nmax)
+    return
 
 def getDataGivenRunSubrun(run,subrun,r):
     logging.debug("getDataGivenRunSubrun called.")
-    con=sqlite3.connect("%s/run.db"%dbdir)
-    con.row_factory=sqlite3.Row
-    cur=con.cursor()
-    cur.execute("ATTACH DATABASE '%s/bnb_v%i.db' AS bnb"%(dbdir,version))
-    cur.execute("ATTACH DATABASE '%s/numi_v%i.db' AS numi"%(dbdir,version))
-            
-    cfgDB=confDB.confDB()
-
-    query="%s WHERE r.run=%i AND r.subrun=%i"%(dbquerybase,run,subrun)
-    cur.execute(query)
-    row=cur.fetchone()
-    con.close()
+    query="%s WHERE r.run=? AND r.subrun=?"%dbquerybase
+    row=executeQuery(getDBCursor(),query,(run,subrun)).fetchone()
     bnbwarn=False
     numiwarn=False
     otherwarn=False
     prescalewarn=False
     pf=None
     if prescaleFactor:
-        pf=cfgDB.getAllPrescaleFactors(run)
+        pf=getPrescaleFactors([run])[run]
         if pf is None:
             prescalewarn=True
-            missprescale[run]=[subrun]
         else:
             for pfkey in pf:
                 if pfkey not in r:
@@ -232,7 +485,7 @@ def getDataGivenRunSubrun(run,subrun,r):
             bnbwarn=True
         elif k in numicols:
             numiwarn=True
-        elif k is "EXT":
+        elif k=="EXT":
             otherwarn=True
 
     r['bnbwarn']=bnbwarn
@@ -242,23 +495,15 @@ def getDataGivenRunSubrun(run,subrun,r):
     return
 
 def getDataGivenRun(run,r):
-    con=sqlite3.connect("%s/run.db"%dbdir)
-    con.row_factory=sqlite3.Row
-    cur=con.cursor()
-    cur.execute("ATTACH DATABASE '%s/bnb_v%i.db' AS bnb"%(dbdir,version))
-    cur.execute("ATTACH DATABASE '%s/numi_v%i.db' AS numi"%(dbdir,version))
-    query="%s WHERE r.run=%i"%(dbquerybase,run)
-    cur.execute(query)
-    row=cur.fetchone()
-    con.close()
-    cfgDB=confDB.confDB()
+    query="%s WHERE r.run=?"%dbquerybase
+    row=executeQuery(getDBCursor(),query,(run,)).fetchone()
     bnbwarn=False
     numiwarn=False
     otherwarn=False
     prescalewarn=False
     pf=None
     if  prescaleFactor:
-        pf=cfgDB.getAllPrescaleFactors(run)
+        pf=getPrescaleFactors([run])[run]
         if pf is None:
             prescalewarn=True
         else:
@@ -281,7 +526,7 @@ def getDataGivenRun(run,r):
             bnbwarn=True
         elif k in numicols:
             numiwarn=True
-        elif k is "EXT":
+        elif k=="EXT":
             otherwarn=True
 
     r['bnbwarn']=bnbwarn
@@ -291,19 +536,10 @@ def getDataGivenRun(run,r):
     return
 
 def getDataGivenWhere(where,r):
-    con=sqlite3.connect("%s/run.db"%dbdir)
-    con.row_factory=sqlite3.Row
-    cur=con.cursor()
-    cur.execute("ATTACH DATABASE '%s/bnb_v%i.db' AS bnb"%(dbdir,version))
-    cur.execute("ATTACH DATABASE '%s/numi_v%i.db' AS numi"%(dbdir,version))
-    cfgDB=confDB.confDB()
-
-    wherec=" "+where
-    for kw in [' run',' subrun',' begin_time',' end_time']:
-        wherec=wherec.replace(kw," r."+kw.lstrip())
-    query="%s WHERE %s GROUP BY r.run"%(dbquerybase,wherec)
-    query=query.replace("SELECT ","SELECT r.run,")
-    cur.execute(query)
+    #the condition is user supplied SQL, the connection is read only and runs a single statement
+    query="%s WHERE %s GROUP BY r.run"%(dbquerybase,getWhereClause(where))
+    query=query.replace("SELECT ","SELECT r.run,",1)
+    cur=executeQuery(getDBCursor(),query)
     bnbwarn=False
     numiwarn=False
     otherwarn=False
@@ -313,11 +549,13 @@ def getDataGivenWhere(where,r):
     missother={}
     missprescale={}
     allrows=cur.fetchall()
-    con.close()
+    pfs={}
+    if prescaleFactor:
+        pfs=getPrescaleFactors([row['run'] for row in allrows])
     for row in allrows:
         pf=None
         if prescaleFactor:
-            pf=cfgDB.getAllPrescaleFactors(row['run'])
+            pf=pfs[row['run']]
         if pf is not None:
             for pfkey in pf:
                 if pfkey not in r:
@@ -351,7 +589,7 @@ def getDataGivenWhere(where,r):
                     missnumi[row['run']]=[1]
                 else:
                     missnumi[row['run']].append(1)
-            elif k is "EXT":
+            elif k=="EXT":
                 otherwarn=True
 
     r['bnbwarn']=bnbwarn
@@ -364,6 +602,76 @@ def getDataGivenWhere(where,r):
     r['missprescale']=missprescale
     return
 
+def getWhereClause(where):
+    #prefixes runinfo columns in user supplied SQL condition with table alias
+    #(whole words not already qualified with a table name)
+    return " "+re.sub(r"(?<![\w.])(run|subrun|begin_time|end_time)\b",r"r.\1",where)
+
+def getGroupKey(cur,groupby,runcol):
+    #returns SQL expression for the group (bucket) of an entry, runcol is the run column
+    #epochs are taken from run_periods through an SQL function registered on the connection
+    if groupby=="run":
+        return runcol
+    elif groupby=="epoch":
+        import run_periods
+        cur.connection.create_function("runEpoch",1,run_periods.get_epoch)
+        return "runEpoch(%s)"%runcol
+    else:
+        return "date(r.begin_time)"
+
+def getGroupedData(cur,query):
+    #runs grouped query returning one row per (group, run) with per column sums
+    #returns list of (group, r) in query order, prescale factors are applied per run
+    executeQuery(cur,query)
+    sumcols=[d[0] for d in cur.description if d[0] in rtemplate]
+    groups=[]
+    runsums={}
+    for row in cur.fetchall():
+        if row['grp'] not in runsums:
+            groups.append((row['grp'],dict(rtemplate)))
+            runsums[row['grp']]=[]
+        r=groups[-1][1]
+        sums={}
+        for k in sumcols:
+            if row[k] is not None:
+                sums[k]=row[k]
+                r[k]+=row[k]
+        runsums[row['grp']].append((row['run'],sums))
+    if prescaleFactor:
+        getPrescaleFactors(sorted(set([run for grp in runsums for run,sums in runsums[grp]])))
+        for grp,r in groups:
+            applyPrescaleFactors(runsums[grp],r,{})
+    return groups
+
+def getGroupedDataGivenRunSubrunList(rspairs,groupby):
+    #per group sums for a run/subrun list from one grouped query
+    cur=getDBCursor()
+    query=loadRunSubrunTable(cur,rspairs)
+    query=query.replace("SELECT ","SELECT %s AS grp, t.run AS run,"%getGroupKey(cur,groupby,"t.run"),1)
+    query+=" GROUP BY grp, t.run ORDER BY grp, t.run"
+    return getGroupedData(cur,query)
+
+def getGroupedDataGivenWhere(where,groupby):
+    #per group sums for SQL condition from one grouped query
+    cur=getDBCursor()
+    query="%s WHERE %s GROUP BY grp, r.run ORDER BY grp, r.run"%(dbquerybase,getWhereClause(where))
+    query=query.replace("SELECT ","SELECT %s AS grp, r.run AS run,"%getGroupKey(cur,groupby,"r.run"),1)
+    return getGroupedData(cur,query)
+
+def getOutputRow(r,outcols):
+    #values for machine readable output, toroid values in the same units as the table (1e12)
+    row=[]
+    for var in outcols:
+        if var=="run":
+            row.append(args.run)
+        elif var=="subrun":
+            row.append(args.subrun)
+        elif "tor" in var:
+            row.append(r.get(var,0)*1e12)
+        else:
+            row.append(r.get(var,0))
+    return row
+
 def getFileListFromDefinition(defname):
     samweb = samweb_cli.SAMWebClient(experiment='uboone')
     flist=[]
@@ -375,7 +683,7 @@ def getFileListFromDefinition(defname):
 
     flist.sort()
     if (not args.noheader):
-        print("Definition %s contains %i files"%(defname,len(flist)))
+        print("Definition %s contains %i files"%(defname,len(flist)),file=getInfoStream())
 
     return flist
 
@@ -392,7 +700,7 @@ def getListFromFile(fname):
         sys.exit(1)
 
     if (not args.noheader):
-        print("Read %i lines from %s"%(len(flist),fname))
+        print("Read %i lines from %s"%(len(flist),fname),file=getInfoStream())
 
     return flist
 
@@ -413,18 +721,6 @@ def getListFromJSON(jsonflist):
                 rslist=getListFromJSON(jlist)
     return rslist
 
-def getListForThreads(flist, nthreads):
-    flist_thread=[]
-    while len(flist)>0:
-        for ith in range(0,nthreads):
-            if (len(flist)==0):
-                break
-            if len(flist_thread)>ith:
-                flist_thread[ith].append(flist.pop())
-            else:
-                flist_thread.append([flist.pop()])
-    return flist_thread
-
 def getDBQueryBase(cols):
     dbq="SELECT "
     addBNB=False
@@ -514,11 +810,27 @@ parser.add_argument("-v","--version", type=int, default=1,
 parser.add_argument("--dbdir",default="/uboone/data/uboonebeam/beamdb/",
                     help="Should not be changed from default unless you know what you are doing.")
 parser.add_argument("--nthreads", type=int, default=4,
-                    help="Run in multiple threads to speed up.")
+                    help="Number of concurrent SAM metadata requests and database worker processes.")
+parser.add_argument("--benchmark", action="store_true",
+                    help="Print timing of run/subrun list aggregation for 1 up to nthreads processes.")
+parser.add_argument("--immutable", action="store_true",
+                    help="Open databases as immutable (no locking). Only use for database copies that can not change while querying.")
+parser.add_argument("--mmap-size", type=int, default=256,
+                    help="Memory map size for each database (MB), 0 to disable.")
 parser.add_argument("--noheader",action="store_true",
                     help="Don't print table header.")
 parser.add_argument("--prescale", action="store_true", 
                     help="Apply prescale factor to trigger count. Specify which factor to apply.")
+parser.add_argument("--prescale-cache", type=str,
+                    help="Local sqlite file used to cache prescale factors per run.")
+parser.add_argument("--rs-cache", type=str,
+                    help="Local sqlite file used to cache run/subrun lists per file name (skips SAM metadata for cached files).")
+parser.add_argument("--columnar", action="store_true",
+                    help="Accumulate run/subrun lists as columns with numpy (vectorized).")
+parser.add_argument("--group-by", type=str, choices=["run","epoch","day"],
+                    help="Also print sums per run, epoch or day (begin time of subrun). Requires SAM definition, list or SQL query.")
+parser.add_argument("--output-format", type=str, choices=["text","csv","json"], default="text",
+                    help="Output format. Warnings are printed to stderr for csv and json.")
 
 
 args = parser.parse_args()
@@ -530,6 +842,10 @@ if (args.run is None and args.defname is None and args.where is None and args.fi
     parser.print_help()
     sys.exit(0)
 
+if args.group_by is not None and args.run is not None:
+    print("Option --group-by requires SAM definition, or SQL query, or list of files, or list of runs and subruns, or json file(s).")
+    sys.exit(1)
+
 logging.basicConfig(filename="%s/dbquery.log"%dbdir,level=logging.DEBUG,format='%(asctime)s '+str(os.getpid())+' ['+os.environ['USER']+'] %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
 logging.debug(" ".join(sys.argv))
 
@@ -566,6 +882,16 @@ for icol in cols:
 
 prescaleFactor=args.prescale
 runPrescale={}
+cfgDB=None
+columnar=args.columnar
+dbcon=None
+checkedPlans=set()
+if columnar and numpy is None:
+    print("Option --columnar requires numpy.")
+    sys.exit(1)
+nthreads=max(1,args.nthreads)
+rtemplate=dict(res)
+groups=None
 
 if args.defname is not None or args.file_list is not None:
     while "run" in cols: cols.remove('run')
@@ -576,40 +902,15 @@ if args.defname is not None or args.file_list is not None:
     else:
         flist=getListFromFile(args.file_list)
 
-    flist_thread=getListForThreads(flist, args.nthreads)
-
-    nthreads=min(len(flist_thread),args.nthreads)
-    logging.debug("Running in %i thread(s)"%nthreads)    
-    threads=[]
-    rthread=[]
-    for ith in range(0,nthreads):
-        rthread.append(res.copy())
-        t=threading.Thread(target=getDataGivenFileList, args=(flist_thread[ith],rthread[ith]))
-        threads.append(t)
-        t.start()
-
-    res['bnbwarn']=False
-    res['numiwarn']=False
-    res['otherwarn']=False
-    res['prescalewarn']=False
-    res['missbnb']={}
-    res['missnumi']={}
-    res['missother']={}
-    res['missprescale']={}
-
-    for ith in range(0,nthreads):
-        threads[ith].join()
-        for k in rthread[0]:
-            if k not in res:
-                res[k]=0
-            if not isinstance(res[k],dict):
-                res[k]+=rthread[ith][k]
-            else:
-                for rk in rthread[ith][k]:
-                    if rk in res[k]:
-                        res[k][rk].extend(rthread[ith][k][rk])
-                    else:
-                        res[k][rk]=rthread[ith][k][rk]
+    rspairs,mcount=getRunSubrunsGivenFileList(flist,nthreads)
+    if mcount != len(flist):
+        print("Warning! Did not get metadata for all files. Looped through %i files, but only got metadata for %i. Check list for repeats or bad file names."%(len(flist),mcount),file=getInfoStream())
+        logging.debug("Warning! Did not get metadata for all files.")
+    if args.benchmark:
+        benchmark(flist,rspairs,nthreads)
+    getDataGivenRunSubrunList(rspairs,res,nthreads)
+    if args.group_by is not None:
+        groups=getGroupedDataGivenRunSubrunList(rspairs,args.group_by)
 
 elif args.run_subrun_list or args.json_file:
     while "run" in cols: cols.remove('run')
@@ -619,45 +920,19 @@ elif args.run_subrun_list or args.json_file:
         rslist=getListFromFile(args.run_subrun_list)
     else:
         rslist=getListFromJSON(args.json_file)
-    rslist_thread=getListForThreads(rslist, args.nthreads)
-
-    nthreads=min(len(rslist_thread),args.nthreads)
-    logging.debug("Running in %i thread(s)"%nthreads)    
-    threads=[]
-    rthread=[]
-
-    for ith in range(0,nthreads):
-        rthread.append(res.copy())
-        t=threading.Thread(target=getDataGivenRSList, args=(rslist_thread[ith],rthread[ith]))
-        threads.append(t)
-        t.start()
-
-    res['bnbwarn']=False
-    res['numiwarn']=False
-    res['otherwarn']=False
-    res['prescalewarn']=False
-    res['missbnb']={}
-    res['missnumi']={}
-    res['missother']={}
-    res['missprescale']={}
-    for ith in range(0,nthreads):
-        threads[ith].join()
-        for k in rthread[0]:
-            if k not in res:
-                res[k]=0
-            if not isinstance(res[k],dict):
-                res[k]+=rthread[ith][k]
-            else:
-                for rk in rthread[ith][k]:
-                    if rk in res[k]:
-                        res[k][rk].extend(rthread[ith][k][rk])
-                    else:
-                        res[k][rk]=rthread[ith][k][rk]
+    rspairs=getRunSubrunsGivenRSList(rslist)
+    if args.benchmark:
+        benchmark(None,rspairs,nthreads)
+    getDataGivenRunSubrunList(rspairs,res,nthreads)
+    if args.group_by is not None:
+        groups=getGroupedDataGivenRunSubrunList(rspairs,args.group_by)
 
 elif args.where is not None:
     while "run" in cols: cols.remove('run')
     while "subrun" in cols: cols.remove('subrun')
     getDataGivenWhere(args.where,res)
+    if args.group_by is not None:
+        groups=getGroupedDataGivenWhere(args.where,args.group_by)
 else:
     if args.subrun is not None:
         getDataGivenRunSubrun(args.run,args.subrun,res)
@@ -679,9 +954,45 @@ for var in cols:
     else:
         output+="%14.1f"%res[var]
 
-if not args.noheader:
-    print(header)
-print(output)
+#machine readable output includes prescale weighted trigger counts
+outcols=list(cols)
+outcols.extend(sorted([k for k in res if k not in rtemplate and not isinstance(res[k],(bool,dict))]))
+if args.output_format=="csv":
+    writer=csv.writer(sys.stdout)
+    if not args.noheader:
+        writer.writerow(([args.group_by] if groups is not None else [])+outcols)
+    if groups is not None:
+        for grp,r in groups:
+            writer.writerow([grp]+getOutputRow(r,outcols))
+        writer.writerow(["total"]+getOutputRow(res,outcols))
+    else:
+        writer.writerow(getOutputRow(res,outcols))
+elif args.output_format=="json":
+    jout={"columns":outcols,"total":dict(zip(outcols,getOutputRow(res,outcols)))}
+    if groups is not None:
+        jout["group_by"]=args.group_by
+        jout["groups"]=[]
+        for grp,r in groups:
+            jgrp={args.group_by:grp}
+            jgrp.update(zip(outcols,getOutputRow(r,outcols)))
+            jout["groups"].append(jgrp)
+    print(json.dumps(jout,indent=2))
+else:
+    if groups is not None:
+        if not args.noheader:
+            print("%14s%s"%(args.group_by,header))
+        for grp,r in groups:
+            line="%14s"%(grp if grp is not None else "")
+            for var in cols:
+                if "tor" in var:
+                    line+="%14.4g"%(r[var]*1e12)
+                else:
+                    line+="%14.1f"%r[var]
+            print(line)
+        output="%14s%s"%("total",output)
+    elif not args.noheader:
+        print(header)
+    print(output)
 
 logging.debug(output)
 
@@ -727,8 +1038,11 @@ for r in res:
     if "Algo" in r and res[r]>0:
         mess+="\n\t%-50s %f"%(r,res[r])
 
-if mess is not "":
+if mess != "":
     mess+="\n"
-    print(mess) 
+    if args.output_format=="text":
+        print(mess) 
+    else:
+        print(mess,file=sys.stderr)
     logging.warning(mess)
 
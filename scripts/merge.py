@@ -19,12 +19,20 @@
 # --stage <stage>     - Project stage.
 # --defname <defname> - Process files belonging to this definition (optional).
 # --database <path>   - Path of sqlite database file (default "merge.db").
+#                       Only one instance of this script can use a given database
+#                       at a time (enforced by a lock on file <path>.lock).
 # --max_size <bytes>  - Maximum merged file size in bytes (default 2.5e9).
 # --min_size <bytes>  - Minimum merged file size in bytes (default 1e9).
 # --max_age <seconds> - Maximum unmerged file age in seconds (default 72 hours).
 #                       Optionally use suffix 'h' for hours, 'd' for days.
 # --min_status <status> - Minimum status (default 0).
 # --max_status <status> - Maximum status (default 6).
+# --batch_size <n>    - Maximum number of files per bulk sam location or
+#                       metadata query (default 100).
+# --benchmark <n>     - Benchmark mode.  Run the unmerged file scan and cleanup
+#                       phases against a local sam stand-in containing <n>
+#                       synthetic files, and report timing and sam call counts.
+#                       The merge database is a temporary file.
 #
 ######################################################################
 #
@@ -146,7 +154,8 @@
 ######################################################################
 
 from __future__ import print_function
-import sys, os, datetime, uuid, traceback, tempfile, subprocess
+import sys, os, time, datetime, uuid, traceback, tempfile, subprocess, socket
+import fcntl
 import threading
 try:
     import queue as Queue
@@ -180,15 +189,18 @@ class MergeEngine:
 
     def __init__(self, xmlfile, projectname, stagename, defname,
                  database, max_size, min_size, max_age,
-                 min_status, max_status):
+                 min_status, max_status, batch_size, samweb=None):
 
         # Open database connection.
 
         self.conn = self.open_database(database)
 
-        # Create samweb object.
+        # Create samweb object (unless one was supplied).
 
-        self.samweb = project_utilities.samweb()
+        if samweb == None:
+            self.samweb = project_utilities.samweb()
+        else:
+            self.samweb = samweb
 
         # Extract project and stage objects from xml file (if specified).
 
@@ -239,6 +251,7 @@ class MergeEngine:
         self.max_age = max_age     # Maximum unmerged file age in seconds.
         self.min_status = min_status # Minimum status.
         self.max_status = max_status # Maximum status.
+        self.batch_size = batch_size # Maximum number of files per bulk sam query.
 
         # Batch job merge queue.
         # This is a list of merged file ids to be processed in one batch job.
@@ -324,8 +337,11 @@ CREATE TABLE IF NOT EXISTS unmerged_files (
         files = self.samweb.listFiles(dim)
         print('%d unmerged files.' % len(files))
         print('Updating unmerged_files table in database.')
-        for f in files:
-            self.add_unmerged_file(f)
+
+        # Add files in batches, so that locations and metadata can be queried in bulk.
+
+        for i in range(0, len(files), self.batch_size):
+            self.add_unmerged_files(files[i:i+self.batch_size])
 
         # Done.
 
@@ -333,23 +349,63 @@ CREATE TABLE IF NOT EXISTS unmerged_files (
         return
 
 
-    # Maybe add one unmerged file to unmerged_files table.
+    # Bulk location query.
+    # Return a dictionary {file_name: locations}.
+    # Sam is queried in batches of at most batch_size files.
 
-    def add_unmerged_file(self, f):
+    def location_dict(self, file_names):
 
-        # Query database to see if this file already exists.
+        result = {}
+        for i in range(0, len(file_names), self.batch_size):
+            locdict = self.samweb.locateFiles(file_names[i:i+self.batch_size])
+            result.update(locdict)
+        return result
 
-        c = self.conn.cursor()
-        q = 'SELECT id FROM unmerged_files WHERE name=?'
-        c.execute(q, (f,))
-        rows = c.fetchall()
 
-        if len(rows) == 0:
+    # Bulk metadata query.
+    # Return a dictionary {file_name: metadata}.
+    # Files that are not declared to sam are not included in the result.
+    # Sam is queried in batches of at most batch_size files.
+
+    def metadata_dict(self, file_names):
+
+        result = {}
+        for i in range(0, len(file_names), self.batch_size):
+            mds = self.samweb.getMultipleMetadata(file_names[i:i+self.batch_size])
+            for md in mds:
+                result[md['file_name']] = md
+        return result
+
+
+    # Maybe add a batch of unmerged files to unmerged_files table.
+
+    def add_unmerged_files(self, flist):
+
+        # Query database to see which of these files already exist.
+        # Limit size of queries to what sqlite can handle.
+
+        c = self.conn.cursor()
+        existing_files = set()
+        for i in range(0, len(flist), 500):
+            uq = flist[i:i+500]
+            placeholders = ('?,'*len(uq))[:-1]
+            q = 'SELECT name FROM unmerged_files WHERE name IN (%s);' % placeholders
+            c.execute(q, uq)
+            rows = c.fetchall()
+            for row in rows:
+                existing_files.add(row[0])
+        new_files = [f for f in flist if f not in existing_files]
+        if len(new_files) == 0:
+            return
 
-            # File does not exist.
-            # First check location, whether this file is on tape yet or not.
+        # First check locations, whether these files are on tape yet or not.
 
-            locs = self.samweb.locateFile(f)
+        locdict = self.location_dict(new_files)
+        add_files = []
+        for f in new_files:
+            locs = []
+            if f in locdict:
+                locs = locdict[f]
             on_tape = 0
             for loc in locs:
                 if loc['location_type'] == 'tape':
@@ -373,16 +429,24 @@ CREATE TABLE IF NOT EXISTS unmerged_files (
                 self.samweb.modifyFileMetadata(f, mdmod)
 
             else:
-
-                print('Adding unmerged file %s' % f)
-                md = self.samweb.getMetadata(f)
-                group_id = self.merge_group(md)
-                size = md['file_size']
-                merge_id = 0
-                create_date = md['create_date']
-                q = '''INSERT INTO unmerged_files (name, merge_id, group_id, size, create_date)
-                       VALUES(?,?,?,?,?);'''
-                c.execute(q, (f, merge_id, group_id, size, create_date))
+                add_files.append(f)
+
+        # Query metadata of files that are not on tape and add them to database.
+
+        mddict = self.metadata_dict(add_files)
+        for f in add_files:
+            if not f in mddict:
+                print('No metadata for file %s' % f)
+                continue
+            print('Adding unmerged file %s' % f)
+            md = mddict[f]
+            group_id = self.merge_group(md)
+            size = md['file_size']
+            merge_id = 0
+            create_date = md['create_date']
+            q = '''INSERT INTO unmerged_files (name, merge_id, group_id, size, create_date)
+                   VALUES(?,?,?,?,?);'''
+            c.execute(q, (f, merge_id, group_id, size, create_date))
 
         # Done.
 
@@ -585,6 +649,10 @@ SELECT id FROM merge_groups WHERE
         c.execute(q, (merge_id,))
         rows = c.fetchall()
 
+        # Get locations of all unmerged files.
+
+        locdict = self.location_dict([row[1] for row in rows])
+
         # Loop over unmerged files.
 
         for row in rows:
@@ -594,7 +662,9 @@ SELECT id FROM merge_groups WHERE
 
             # Get location(s).
 
-            locs = self.samweb.locateFile(f)
+            locs = []
+            if f in locdict:
+                locs = locdict[f]
             for loc in locs:
                 if loc['location_type'] == 'disk':
                     dir = os.path.join(loc['mount_point'], loc['subdir'])
@@ -638,6 +708,54 @@ SELECT id FROM merge_groups WHERE
                    FROM merged_files WHERE status=? ORDER BY id;'''
             c.execute(q, (status,))
             rows = c.fetchall()
+
+            # Gather file names for this status, and query sam locations and
+            # metadata in bulk.
+
+            locdict = {}
+            mddict = {}
+            merged_files = [row[0] for row in rows if row[0] != '' and row[0] != None]
+            unmerged_dict = {}     # {merge_id: [unmerged files]}
+
+            if status == 4:
+
+                # Unmerged files belonging to all located merged files.
+
+                q = '''SELECT merge_id, name FROM unmerged_files WHERE merge_id IN
+                       (SELECT id FROM merged_files WHERE status=?) ORDER BY id;'''
+                c.execute(q, (status,))
+                unmerged_files = []
+                for urow in c.fetchall():
+                    if not urow[0] in unmerged_dict:
+                        unmerged_dict[urow[0]] = []
+                    unmerged_dict[urow[0]].append(urow[1])
+                    unmerged_files.append(urow[1])
+                locdict = self.location_dict(unmerged_files)
+
+            elif status == 3:
+
+                # Locations of declared merged files, and metadata of merged files
+                # that are not yet located.
+
+                locdict = self.location_dict(merged_files)
+                unlocated_files = [f for f in merged_files if len(locdict.get(f, [])) == 0]
+                mddict = self.metadata_dict(unlocated_files)
+
+            elif status == 2:
+
+                # Metadata of submitted merged files (undeclared files are not included).
+                # If the bulk query fails, fall back to querying files one at a time.
+
+                try:
+                    mddict = self.metadata_dict(merged_files)
+                except:
+                    mddict = {}
+                    for f in merged_files:
+                        try:
+                            mddict[f] = self.samweb.getMetadata(f)
+                        except:
+                            pass
+
             for row in rows:
                 merged_file = row[0]
                 merge_id = row[1]
@@ -693,11 +811,18 @@ SELECT id FROM merge_groups WHERE
                         # First query unmerged files corresponsing to this merged file.
 
                         unmerged_files = []
-                        q = 'SELECT name FROM unmerged_files WHERE merge_id=?'
-                        c.execute(q, (merge_id,))
-                        rows = c.fetchall()
-                        for row in rows:
-                            unmerged_files.append(row[0])
+                        if merge_id in unmerged_dict:
+                            unmerged_files = unmerged_dict[merge_id]
+
+                        # First modify the sam metadata of unmerged files 
+                        # to set merge.merged=1.  That will make these
+                        # unmerged files invisible to this script.
+
+                        print('Updating metadata.')
+                        for i in range(0, len(unmerged_files), self.batch_size):
+                            mdmods = [{'file_name': f, 'merge.merged': 1}
+                                      for f in unmerged_files[i:i+self.batch_size]]
+                            self.samweb.modifyMetadata(mdmods)
 
                         # Loop over unmerged files.
 
@@ -705,17 +830,11 @@ SELECT id FROM merge_groups WHERE
 
                             print('Doing cleanup for unmerged file %s' % f)
 
-                            # First modify the sam metadata of unmerged files 
-                            # to set merge.merged=1.  That will make this
-                            # unmerged file invisible to this script.
-
-                            mdmod = {'merge.merged': 1}
-                            print('Updating metadata.')
-                            self.samweb.modifyFileMetadata(f, mdmod)
-
                             # Remove (disk) locations of unmerged file.
 
-                            locs = self.samweb.locateFile(f)
+                            locs = []
+                            if f in locdict:
+                                locs = locdict[f]
                             if len(locs) > 0:
                                 print('Cleaning disk locations.')
                                 for loc in locs:
@@ -755,7 +874,9 @@ SELECT id FROM merge_groups WHERE
                         # Check whether this file has a location.
 
                         print('Checking location for file %s' % merged_file)
-                        locs = self.samweb.locateFile(merged_file)
+                        locs = []
+                        if merged_file in locdict:
+                            locs = locdict[merged_file]
 
                         # If file has been located, advance to state 4.
 
@@ -769,7 +890,10 @@ SELECT id FROM merge_groups WHERE
 
                             # Check metadata of this file.
 
-                            md = self.samweb.getMetadata(merged_file)
+                            if merged_file in mddict:
+                                md = mddict[merged_file]
+                            else:
+                                md = self.samweb.getMetadata(merged_file)
 
                             # Get age of this file.
 
@@ -792,10 +916,8 @@ SELECT id FROM merge_groups WHERE
 
                         print('Checking metadata for file %s' % merged_file)
                         md = None
-                        try:
-                            md = self.samweb.getMetadata(merged_file)
-                        except:
-                            md = None
+                        if merged_file in mddict:
+                            md = mddict[merged_file]
 
                         # If file has been declared, advance status to 3.
 
@@ -929,9 +1051,10 @@ SELECT id FROM merge_groups WHERE
 
             # Query parents of unmerged files (i.e. grandparents of merged file).
 
+            mddict = self.metadata_dict(unmerged_files)
             grandparents = set([])
             for unmerged_file in unmerged_files:
-                md = self.samweb.getMetadata(unmerged_file)
+                md = mddict[unmerged_file]
                 if 'parents' in md:
                     for parent in md['parents']:
                         pname = parent['file_name']
@@ -941,7 +1064,7 @@ SELECT id FROM merge_groups WHERE
             # Query sam metadata from first unmerged file.
             # We will use this to generate metadata for merged files.
 
-            md = self.samweb.getMetadata(unmerged_files[0])
+            md = mddict[unmerged_files[0]]
             input_name = md['file_name']
             app_family = md['application']['family']
             app_version = md['application']['version']
@@ -1371,51 +1494,204 @@ SELECT id FROM merge_groups WHERE
         return n0
 
 
-# Check whether a similar process is already running.
-# Return true if yes.
+# LocalSamweb is a minimal in-memory stand-in for the samweb client, used by
+# the --benchmark option.  It implements only those samweb methods that are used
+# by class MergeEngine when scanning and cleaning up unmerged files.  Every call
+# is counted, and sleeps for a fixed time to simulate the round trip latency of
+# a real sam server.
+
+class LocalSamweb:
 
-def check_running(argv):
+    # Constructor.
+    # Generate nfiles synthetic unmerged files.  Every 50th file is on tape.
+
+    def __init__(self, nfiles, latency=0.005):
+
+        self.latency = latency     # Simulated round trip time (seconds).
+        self.ncalls = {}           # Number of calls, keyed by method name.
+        self.metadata = {}         # {file_name: metadata}
+        self.locations = {}        # {file_name: locations}
+
+        now = datetime.datetime.utcnow()
+        for n in range(nfiles):
+            f = 'benchmark_%07d.root' % n
+            run = 1000 + n // 100
+            create_date = now - datetime.timedelta(hours=n % 100)
+            self.metadata[f] = {'file_name': f,
+                                'file_type': 'data',
+                                'file_format': 'artroot',
+                                'file_size': 100000000,
+                                'create_date': create_date.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+                                'data_tier': 'reconstructed',
+                                'data_stream': 'outbnb',
+                                'ub_project.name': 'benchmark',
+                                'ub_project.stage': 'reco',
+                                'ub_project.version': 'v1',
+                                'runs': [[run, n % 100, 'physics']],
+                                'parents': [{'file_name': 'benchmark_parent_%07d.root' % n}],
+                                'merge.merge': 1,
+                                'merge.merged': 0}
+            location_type = 'disk'
+            if n % 50 == 0:
+                location_type = 'tape'
+            subdir = 'benchmark/%d' % run
+            self.locations[f] = [{'location_type': location_type,
+                                  'mount_point': '/%s' % location_type,
+                                  'subdir': subdir,
+                                  'full_path': '%s:/%s/%s' % (location_type, location_type,
+                                                               subdir)}]
+
+
+    # Count one sam call and simulate latency.
+
+    def call(self, method):
+        if not method in self.ncalls:
+            self.ncalls[method] = 0
+        self.ncalls[method] += 1
+        if self.latency > 0.:
+            time.sleep(self.latency)
+
+
+    # Total number of sam calls.
+
+    def total_calls(self):
+        return sum(self.ncalls.values())
+
+
+    # Samweb methods.
+
+    def listFiles(self, dim):
+        self.call('listFiles')
+        return [f for f in sorted(self.metadata) if self.metadata[f]['merge.merged'] == 0]
+
+    def locateFile(self, f):
+        self.call('locateFile')
+        return list(self.locations[f])
+
+    def locateFiles(self, files):
+        self.call('locateFiles')
+        return dict([(f, list(self.locations[f])) for f in files if f in self.locations])
+
+    def getMetadata(self, f):
+        self.call('getMetadata')
+        if not f in self.metadata:
+            raise RuntimeError('File %s not found.' % f)
+        return dict(self.metadata[f])
+
+    def getMultipleMetadata(self, files):
+        self.call('getMultipleMetadata')
+        return [dict(self.metadata[f]) for f in files if f in self.metadata]
+
+    def modifyFileMetadata(self, f, md):
+        self.call('modifyFileMetadata')
+        self.metadata[f].update(md)
+
+    def modifyMetadata(self, mds):
+        self.call('modifyMetadata')
+        for md in mds:
+            self.metadata[md['file_name']].update(md)
+
+    def removeFileLocation(self, f, location):
+        self.call('removeFileLocation')
+        self.locations[f] = [loc for loc in self.locations[f] if loc['full_path'] != location]
+
+
+# Benchmark bulk sam queries against a local sam stand-in.
+# The unmerged file scan and the status 4 (cleanup) phase are timed, first with
+# one file per sam query, then with the specified batch size.
+
+def benchmark(nfiles, batch_size, max_size, min_size, max_age):
+
+    print('Benchmarking with %d files.' % nfiles)
+    results = []
+    for bs in (1, batch_size):
+        samweb = LocalSamweb(nfiles)
+        tmpdir = tempfile.mkdtemp()
+        database = os.path.join(tmpdir, 'merge.db')
+        engine = MergeEngine('', '', '', '', database, max_size, min_size, max_age,
+                             4, 4, bs, samweb)
 
-    result = 0
+        # Suppress normal output while timing.
 
-    # Look over pids in /proc.
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            t0 = time.time()
+            engine.update_unmerged_files()
+            engine.update_merges()
+            t1 = time.time()
+            c = engine.conn.cursor()
+            c.execute('UPDATE merged_files SET status=4;')
+            engine.conn.commit()
+            engine.update_status()
+            t2 = time.time()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        results.append((bs, t1-t0, t2-t1, samweb.total_calls()))
+        del engine
+        larbatch_posix.rmtree(tmpdir)
+
+    print('Batch size    Scan (s)    Cleanup (s)    Sam calls')
+    for result in results:
+        print('%10d  %10.2f  %13.2f  %11d' % result)
 
-    for pid in os.listdir('/proc'):
-        if pid.isdigit() and int(pid) != os.getpid():
-            procfile = os.path.join('/proc', pid)
-            try:
-                pstat = os.stat(procfile)
+    # Done.
 
-                # Only look at processes that match this process uid.
+    return
 
-                if pstat.st_uid == os.getuid():
 
-                    # Get command line.
+# Lock file object of this process.
+# The lock is held for the lifetime of this process.  The kernel releases the
+# lock automatically when the process exits, however it exits.
 
-                    cmdfile = os.path.join('/proc', pid, 'cmdline')
-                    cmd = open(cmdfile).read()
-                    words = cmd.split('\0')
-                    if len(words) > 0 and words[0].endswith('merge.py'):
-                        result = 1
-                    if len(words) > 1 and \
-                       words[0].endswith('python') and words[1].endswith('merge.py'):
-                        result = 1
-            except:
-                pass
+lock_file = None
 
-    # Done.
 
-    return result
+# Check whether a similar process is already running on the same database.
+# Return true if yes.
+#
+# This function takes an exclusive advisory lock (flock) on lock file
+# <database>.lock, and holds it until this process exits.  Processes using
+# different databases do not interfere with each other.  The lock file records
+# the host name and process id of the lock holder (for information only).
+# The lock file is never removed.  Since the kernel releases the lock when the
+# holder exits, however it exits, a lock left behind by a dead process can not
+# block later processes.
+
+def check_running(database):
+
+    global lock_file
+
+    lock_path = '%s.lock' % os.path.abspath(database)
+    f = open(lock_path, 'a+')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+
+        # Lock is held by another process.
+
+        f.seek(0)
+        owner = f.read()
+        f.close()
+        print('Database %s is locked by %s' % (database, owner.strip()))
+        return 1
+
+    # Got lock.  Record owner.
+
+    f.seek(0)
+    f.truncate()
+    f.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+    f.flush()
+    lock_file = f
+    return 0
 
 
 # Main procedure.
 
 def main(argv):
 
-    if check_running(argv):
-        print('Quitting because similar process is already running.')
-        sys.exit(0)
-
     # Parse arguments.
 
     xmlfile = ''
@@ -1428,6 +1704,8 @@ def main(argv):
     max_age = 3*24*3600
     min_status = 0
     max_status = 6
+    batch_size = 100
+    nbenchmark = 0
 
     args = argv[1:]
     while len(args) > 0:
@@ -1469,15 +1747,35 @@ def main(argv):
         elif args[0] == '--max_status' and len(args) > 1:
             max_status = int(args[1])
             del args[0:2]
+        elif args[0] == '--batch_size' and len(args) > 1:
+            batch_size = int(args[1])
+            del args[0:2]
+        elif args[0] == '--benchmark' and len(args) > 1:
+            nbenchmark = int(args[1])
+            del args[0:2]
         else:
             print('Unknown option %s' % args[0])
             return 1
 
+    if batch_size < 1:
+        print('Batch size must be positive.')
+        return 1
+
+    # Benchmark mode.
+
+    if nbenchmark > 0:
+        benchmark(nbenchmark, batch_size, max_size, min_size, max_age)
+        return 0
+
+    if check_running(database):
+        print('Quitting because similar process is already running.')
+        sys.exit(0)
+
     # Create merge engine.
 
     engine = MergeEngine(xmlfile, projectname, stagename, defname,
                          database, max_size, min_size, max_age,
-                         min_status, max_status)
+                         min_status, max_status, batch_size)
     if min_status == 0:
         n0 = engine.nstat0()
         if n0 == 0:
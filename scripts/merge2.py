@@ -19,6 +19,8 @@
 # --stage <stage>     - Project stage.
 # --defname <defname> - Process files belonging to this definition (optional).
 # --database <path>   - Path of sqlite database file (default "merge.db").
+#                       Only one instance of this script can use a given database
+#                       at a time (enforced by a lock on file <path>.lock).
 # --logdir <dir>      - Specify directory to store log files.
 #                       If specified each invocation generates a unique set of log files.
 #                       If not specified, output to stdout and stderr (no log files).
@@ -56,9 +58,8 @@
 #     contains multiple projects and/or stages.
 #     
 #     Rather than using a predefined fcl file for batch submissions, this
-#     script generates its own customized fcl file and stores it in the 
-#     path specified by xml element <fcl>.  Any preexisting fcl file
-#     located at this path will be overwritten.
+#     script generates its own customized fcl file, which is written directly
+#     into the work tarball.  Only the base name of xml element <fcl> is used.
 #
 #     Some elements of the xml project and stage are overridden internally
 #     in this script.  If specified, these elements are ignored, or they
@@ -162,6 +163,21 @@
 #     C.  Epoch (text).
 #     D.  Quality (text).
 #
+# VI. Table group_summary.
+#
+#     A.  Merge group id (integer, primary key).
+#     B.  Number of unaffiliated unmerged files (integer).
+#     C.  Total size of unaffiliated unmerged files in bytes (integer).
+#     D.  Creation time of oldest unaffiliated unmerged file (integer, unix epoch).
+#     E.  Time when the last sam project was created for this group (integer, unix epoch).
+#     F.  Latency of the last sam project (integer, seconds from creation of oldest
+#         unmerged file to creation of sam project).
+#
+#     Unaffiliated unmerged files are files that are not yet assigned to a sam
+#     project or sam process.  Columns B-D are maintained incrementally by
+#     triggers on table unmerged_files, so that merge group readiness can be
+#     determined without scanning all unmerged files.
+#
 #
 #
 # About merging within and accross runs:
@@ -219,6 +235,7 @@
 
 from __future__ import print_function
 import sys, os, time, datetime, uuid, traceback, tempfile, subprocess, random, socket
+import fcntl, io, tarfile
 import threading
 try:
     import queue as Queue
@@ -228,12 +245,56 @@ import project, project_utilities, larbatch_posix
 from larbatch_utilities import convert_str
 from larbatch_utilities import convert_bytes
 import sqlite3
+import run_periods
 
 # Global variables.
 
 using_jobsub_lite = None
 worktarname = None
 
+# Template for merge fcl file.
+
+merge_fcl_template = '''process_name: Merge
+services:
+{
+  scheduler: { defaultExceptions: false }
+  FileCatalogMetadata:
+  {
+    applicationFamily: "%(app_family)s"
+    applicationVersion: "%(app_version)s"
+    fileType: "%(file_type)s"
+    group: "%(group)s"
+    runType: "%(run_type)s"
+  }
+  FileCatalogMetadataMicroBooNE:
+  {
+    FCLName: "%(fcl_name)s"
+    FCLVersion: "%(app_version)s"
+    ProjectName: "%(ubproject)s"
+    ProjectStage: "%(ubstage)s"
+    ProjectVersion: "%(ubversion)s"
+  }
+}
+source:
+{
+  module_type: RootInput
+}
+physics:
+{
+  stream1:  [ out1 ]
+}
+outputs:
+{
+  out1:
+  {
+    module_type: RootOutput
+    fileName: "%%ifb_%%tc_merged.root"
+    dataTier: "%(data_tier)s"
+%(stream_name)s    compressionLevel: 3
+  }
+}
+'''
+
 
 def help():
 
@@ -365,27 +426,9 @@ class MergeEngine:
 
         self.dircache = {}
 
-        # Run epochs.
-
-        self.epochs = {'A':  (3420, 3984),     # Run 1a open trigger 2 FEM.
-                       'B':  (3985, 4951),     # Run 1b open trigger 3 FEM.
-                       'C1': (4952, 6998),     # Run 1c normal software trigger.
-                       'C2': (6999, 8316),     # Run 1 shutdown.
-                       'D1': (8317, 8405),     # Run 2 open trigger.
-                       'D2': (8406, 11048),    # Run 2a before CRT.
-                       'E1': (11049, 11951),   # Run 2b after CRT.
-                       'E2': (11952, 13696),   # Run 2 shutdown.
-                       'F':  (13697, 14116),   # Run 3a before CRT clock fix.
-                       'G1': (14117, 17566),   # Run 3b after CRT clock fix.
-                       'G2': (17567, 18960),   # Run 3 shutdown.
-                       'H':  (18961, 19752),   # Run 4a
-                       'I':  (19753, 21285),   # Run 4b
-                       'J':  (21286, 22269),   # Run 4c
-                       'K':  (22270, 23259),   # Run 4d
-                       'L':  (23260, 23542),   # Run 4 shutdown 1
-                       'M':  (23543, 24319),   # Run 4 shutdown 2
-                       'N':  (24320, 25769),   # Run 5
-                       'O':  (25770, 1000000)} # Run 6
+        # Cache of rendered merge fcl files, keyed by metadata values.
+
+        self.fcl_cache = {}
 
         # Good runs.
 
@@ -545,6 +588,106 @@ CREATE TABLE IF NOT EXISTS run_groups (
 );'''
         c.execute(q)
 
+        # Create indexes.
+        # These support the lookups done by this script, as well as the
+        # aggregate queries done by merge_report.py.
+
+        q = 'CREATE INDEX IF NOT EXISTS unmerged_files_name ON unmerged_files (name);'
+        c.execute(q)
+        q = 'CREATE INDEX IF NOT EXISTS unmerged_files_group ON unmerged_files (group_id);'
+        c.execute(q)
+        q = '''CREATE INDEX IF NOT EXISTS unmerged_files_project
+               ON unmerged_files (sam_project_id, sam_process_id);'''
+        c.execute(q)
+        q = 'CREATE INDEX IF NOT EXISTS unmerged_files_process ON unmerged_files (sam_process_id);'
+        c.execute(q)
+        q = 'CREATE INDEX IF NOT EXISTS sam_projects_status ON sam_projects (status);'
+        c.execute(q)
+        q = 'CREATE INDEX IF NOT EXISTS sam_processes_status ON sam_processes (status);'
+        c.execute(q)
+
+        # Create and maintain merge group summary table.
+
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='group_summary';")
+        new_summary = c.fetchone() == None
+
+        q = '''
+CREATE TABLE IF NOT EXISTS group_summary (
+  group_id integer PRIMARY KEY,
+  nfiles integer NOT NULL,
+  size integer NOT NULL,
+  oldest integer,
+  last_project_time integer,
+  last_latency integer,
+  FOREIGN KEY (group_id) REFERENCES merge_groups (id)
+);'''
+        c.execute(q)
+        q = 'CREATE INDEX IF NOT EXISTS group_summary_oldest ON group_summary (oldest);'
+        c.execute(q)
+        q = '''CREATE INDEX IF NOT EXISTS unmerged_files_group_date
+               ON unmerged_files (group_id, sam_project_id, sam_process_id, create_date);'''
+        c.execute(q)
+
+        # Triggers to add and remove unaffiliated unmerged files to/from summary.
+        # An update is treated as a removal of the old row plus an addition of the new row.
+        # When a file is removed, the oldest creation time is recalculated only if this
+        # was the oldest file.
+
+        add_file = '''
+  INSERT OR IGNORE INTO group_summary (group_id, nfiles, size) VALUES (NEW.group_id, 0, 0);
+  UPDATE group_summary SET nfiles = nfiles + 1, size = size + NEW.size,
+    oldest = MIN(COALESCE(oldest, CAST(strftime('%s', NEW.create_date) AS integer)),
+                 CAST(strftime('%s', NEW.create_date) AS integer))
+    WHERE group_id = NEW.group_id;'''
+        remove_file = '''
+  UPDATE group_summary SET nfiles = nfiles - 1, size = size - OLD.size,
+    oldest = CASE WHEN oldest < CAST(strftime('%s', OLD.create_date) AS integer) THEN oldest
+             ELSE (SELECT CAST(strftime('%s', MIN(create_date)) AS integer) FROM unmerged_files
+                   WHERE group_id = OLD.group_id AND sam_project_id = 0 AND sam_process_id = 0)
+             END
+    WHERE group_id = OLD.group_id;'''
+        new_unaffiliated = 'NEW.sam_project_id = 0 AND NEW.sam_process_id = 0'
+        old_unaffiliated = 'OLD.sam_project_id = 0 AND OLD.sam_process_id = 0'
+        columns = 'group_id, sam_project_id, sam_process_id, size, create_date'
+
+        q = '''CREATE TRIGGER IF NOT EXISTS group_summary_insert
+               AFTER INSERT ON unmerged_files WHEN %s
+               BEGIN %s
+               END;''' % (new_unaffiliated, add_file)
+        c.execute(q)
+        q = '''CREATE TRIGGER IF NOT EXISTS group_summary_delete
+               AFTER DELETE ON unmerged_files WHEN %s
+               BEGIN %s
+               END;''' % (old_unaffiliated, remove_file)
+        c.execute(q)
+        q = '''CREATE TRIGGER IF NOT EXISTS group_summary_update_remove
+               AFTER UPDATE OF %s ON unmerged_files WHEN %s
+               BEGIN %s
+               END;''' % (columns, old_unaffiliated, remove_file)
+        c.execute(q)
+        q = '''CREATE TRIGGER IF NOT EXISTS group_summary_update_add
+               AFTER UPDATE OF %s ON unmerged_files WHEN %s
+               BEGIN %s
+               END;''' % (columns, new_unaffiliated, add_file)
+        c.execute(q)
+        q = '''CREATE TRIGGER IF NOT EXISTS group_summary_delete_group
+               AFTER DELETE ON merge_groups
+               BEGIN
+                 DELETE FROM group_summary WHERE group_id = OLD.id;
+               END;'''
+        c.execute(q)
+
+        # If summary table is new, populate it from existing unmerged files.
+
+        if new_summary:
+            print('Populating merge group summary table.')
+            q = '''INSERT INTO group_summary (group_id, nfiles, size, oldest)
+                   SELECT group_id, COUNT(*), TOTAL(size),
+                          CAST(strftime('%s', MIN(create_date)) AS integer)
+                   FROM unmerged_files WHERE sam_project_id=0 AND sam_process_id=0
+                   GROUP BY group_id;'''
+            c.execute(q)
+
         # Done
 
         conn.commit()
@@ -1116,23 +1259,10 @@ CREATE TABLE IF NOT EXISTS run_groups (
         return result
 
 
-    # Get epoch of specified run.
+    # Get epoch (letter period) of specified run.
 
     def get_epoch(self, run):
-
-        result = ''
-
-        # Loop over epochs
-
-        for key in self.epochs:
-            limits = self.epochs[key]
-            if run >= limits[0] and run <= limits[1]:
-                result = key
-                break
-
-        # Done.
-
-        return result
+        return run_periods.get_letter(run)
 
 
     # Find the run group corresponding to a single run.
@@ -1167,8 +1297,9 @@ CREATE TABLE IF NOT EXISTS run_groups (
             # Find runs with matching epoch and quality.
 
             runs = set()
-            for r in range(run_low, run_high+1):
-                if self.get_epoch(r) == epoch and self.get_quality(r) == quality:
+            group_runs = range(run_low, run_high+1)
+            for r, e in zip(group_runs, run_periods.get_letters(group_runs)):
+                if e == epoch and self.get_quality(r) == quality:
                     runs.add(r)
 
             # Filter out any existing runs.
@@ -1364,81 +1495,41 @@ CREATE TABLE IF NOT EXISTS run_groups (
 
         # Get the current time for age calculation.
 
-        now = datetime.datetime.utcnow()
-        print('Current time = %s' % now)
-
+        now = time.time()
+        print('Current time = %s' % datetime.datetime.utcfromtimestamp(now))
 
-        # Query unassigned files with view to identifying merge groups that can
-        # be upgraded to sam projects.
+        # Query merge group summary to identify merge groups that can be upgraded
+        # to sam projects.  A merge group is ready if its oldest unaffiliated file
+        # is older than the maximum age, or if its total size is at least the
+        # minimum size.  Oldest groups are done first.
 
-        q = '''SELECT id, name, group_id, size, create_date FROM unmerged_files
-               WHERE sam_project_id=0 AND sam_process_id=0 ORDER BY create_date;'''
-        c.execute(q)
+        q = '''SELECT group_id, nfiles, size, oldest FROM group_summary
+               WHERE nfiles>0 AND (oldest<? OR size>=?)
+               ORDER BY oldest LIMIT ?;'''
+        c.execute(q, (now - self.max_age, self.min_size, max_new_projects))
         rows = c.fetchall()
-        print('Checking %d unassigned unmerged files' % len(rows))
-
-        # Loop over files.
 
         new_project_groups = set()
-        group_size = {}
+        group_oldest = {}
 
         for row in rows:
 
-            id = row[0]
-            name = row[1]
-            group_id = row[2]
-            size = row[3]
-            create_date = row[4]
-
-            # Skip this file if this group id is already tagged.
-
-            if group_id in new_project_groups:
-                continue
-
-            # Check whether we have exceeded the maximum number of new sam projects.
-
-            if len(new_project_groups) >= max_new_projects:
-                print('\nNo more new projects are allowed.')
-                break
-            else:
-                #print('\nRemaining new projects = %d' % (max_new_projects - len(new_project_groups)))
-                pass
-
-            # Calculate file age.
-
-            t = datetime.datetime.strptime(create_date, '%Y-%m-%dT%H:%M:%S+00:00')
-            dt = now - t
-            age = dt.total_seconds()
-
-            #print('\nChecking file %s' % name)
-            #print('Group id = %s' % group_id)
-            #print('Age = %d seconds (%8.2f days)' % (age, float(age)/86400))
-            #print('Size = %d' % size)
+            group_id = row[0]
+            nfiles = row[1]
+            size = row[2]
+            oldest = row[3]
+            age = now - oldest
             if age > self.max_age:
-                print('\nCreate project for file %s because file is older than maximum age.' % name)
-                print('Group id = %s' % group_id)
-                print('Age = %d seconds (%8.2f days)' % (age, float(age)/86400))
-                print('Size = %d' % size)
-                new_project_groups.add(group_id)
-                continue
-
-            # Check total size of this group_id
-
-            if group_id in group_size:
-                group_size[group_id] += size
+                print('\nCreate project for group %d because oldest file is older than maximum age.' % group_id)
             else:
-                group_size[group_id] = size
-            #print('Group size = %d' % group_size[group_id])
-            if group_size[group_id] >= self.min_size:
-                print('\nCreate project for file %s because group size is greater than minimum size.' % name)
-                print('Group id = %s' % group_id)
-                print('Age = %d seconds (%8.2f days)' % (age, float(age)/86400))
-                print('Size = %d' % size)
-                print('Group size = %d' % group_size[group_id])
-                new_project_groups.add(group_id)
-                continue
+                print('\nCreate project for group %d because group size is greater than minimum size.' % group_id)
+            print('Number of files = %d' % nfiles)
+            print('Age = %d seconds (%8.2f days)' % (age, float(age)/86400))
+            print('Group size = %d' % size)
+            new_project_groups.add(group_id)
+            group_oldest[group_id] = oldest
 
-        # Done with loop over files.
+        # Done with loop over groups.
 
         print('%d new projects will be created.' % len(new_project_groups))
 
@@ -1570,6 +1661,11 @@ CREATE TABLE IF NOT EXISTS run_groups (
 
                 q = 'UPDATE unmerged_files SET sam_project_id=? WHERE group_id=? AND sam_project_id=0 AND sam_process_id=0;'
                 c.execute(q, (sam_project_id, group_id))
+
+                # Record time-to-merge latency of this group.
+
+                q = 'UPDATE group_summary SET last_project_time=?, last_latency=? WHERE group_id=?;'
+                c.execute(q, (int(now), int(now - group_oldest[group_id]), group_id))
                 self.conn.commit()
                 self.total_sam_projects_added += 1
 
@@ -2167,6 +2263,64 @@ CREATE TABLE IF NOT EXISTS run_groups (
         return
 
 
+    # Render the merge fcl file for the specified metadata values.
+    # Return value is the fcl file contents (string).
+    # Renders are cached, since merged files from the same production share metadata.
+
+    def render_fcl(self, app_family, app_version, file_type, group, run_type,
+                   ubproject, ubstage, ubversion, data_tier, data_stream):
+
+        key = (app_family, app_version, file_type, group, run_type,
+               ubproject, ubstage, ubversion, data_tier, data_stream)
+        if not key in self.fcl_cache:
+            stream_name = ''
+            if data_stream != '':
+                stream_name = '    streamName:  "%s"\n' % data_stream
+            self.fcl_cache[key] = merge_fcl_template % {'app_family': app_family,
+                                                        'app_version': app_version,
+                                                        'file_type': file_type,
+                                                        'group': group,
+                                                        'run_type': run_type,
+                                                        'fcl_name': os.path.basename(self.fclpath),
+                                                        'ubproject': ubproject,
+                                                        'ubstage': ubstage,
+                                                        'ubversion': ubversion,
+                                                        'data_tier': data_tier,
+                                                        'stream_name': stream_name}
+        return self.fcl_cache[key]
+
+
+    # Make work tarball.
+    # The tarball contains all files in work directory (other than the tarball
+    # itself), plus the fcl file (if any), which is added from memory.
+    # All members get the same fixed modification time, so that identical
+    # contents produce identical tarballs.
+
+    def make_work_tarball(self, tmptar, tmpworkdir, fcl_text):
+
+        mtime = time.mktime(datetime.datetime(2018, 1, 1).timetuple())
+        tar = tarfile.open(tmptar, 'w')
+        for name in sorted(os.listdir(tmpworkdir)):
+            path = os.path.join(tmpworkdir, name)
+            if os.path.abspath(path) != os.path.abspath(tmptar):
+                info = tar.gettarinfo(path, arcname='./%s' % name)
+                info.mtime = mtime
+                with open(path, 'rb') as f:
+                    tar.addfile(info, f)
+        if fcl_text != None:
+            data = convert_bytes(fcl_text)
+            info = tarfile.TarInfo('./%s' % os.path.basename(self.fclpath))
+            info.size = len(data)
+            info.mtime = mtime
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+        tar.close()
+
+        # Done.
+
+        return
+
+
     # Function to start sam project and submit batch jobs.
 
     def submit(self, sam_project_id):
@@ -2256,52 +2410,12 @@ CREATE TABLE IF NOT EXISTS run_groups (
         else:
             data_stream = ''
 
-        # Generate a fcl file customized for this merged file.
+        # Render a fcl file customized for this merged file.
 
+        fcl_text = None
         if file_type != 'root':
-            fcl = open(self.fclpath, 'w')
-            fcl.write('process_name: Merge\n')
-            fcl.write('services:\n')
-            fcl.write('{\n')
-            fcl.write('  scheduler: { defaultExceptions: false }\n')
-            fcl.write('  FileCatalogMetadata:\n')
-            fcl.write('  {\n')
-            fcl.write('    applicationFamily: "%s"\n' % app_family)
-            fcl.write('    applicationVersion: "%s"\n' % app_version)
-            fcl.write('    fileType: "%s"\n' % file_type)
-            fcl.write('    group: "%s"\n' % group)
-            fcl.write('    runType: "%s"\n' % run_type)
-            fcl.write('  }\n')
-            fcl.write('  FileCatalogMetadataMicroBooNE:\n')
-            fcl.write('  {\n')
-            fcl.write('    FCLName: "%s"\n' % os.path.basename(self.fclpath))
-            fcl.write('    FCLVersion: "%s"\n' % app_version)
-            fcl.write('    ProjectName: "%s"\n' % ubproject)
-            fcl.write('    ProjectStage: "%s"\n' % ubstage)
-            fcl.write('    ProjectVersion: "%s"\n' % ubversion)
-            fcl.write('  }\n')
-            fcl.write('}\n')
-            fcl.write('source:\n')
-            fcl.write('{\n')
-            fcl.write('  module_type: RootInput\n')
-            fcl.write('}\n')
-            fcl.write('physics:\n')
-            fcl.write('{\n')
-            fcl.write('  stream1:  [ out1 ]\n')
-            fcl.write('}\n')
-            fcl.write('outputs:\n')
-            fcl.write('{\n')
-            fcl.write('  out1:\n')
-            fcl.write('  {\n')
-            fcl.write('    module_type: RootOutput\n')
-            fcl.write('    fileName: "%ifb_%tc_merged.root"\n')
-            fcl.write('    dataTier: "%s"\n' % data_tier)
-            if data_stream != '':
-                fcl.write('    streamName:  "%s"\n' % data_stream)
-            fcl.write('    compressionLevel: 3\n')
-            fcl.write('  }\n')
-            fcl.write('}\n')
-            fcl.close()
+            fcl_text = self.render_fcl(app_family, app_version, file_type, group, run_type,
+                                       ubproject, ubstage, ubversion, data_tier, data_stream)
 
 
         # Generate project name and stash the name in the database.
@@ -2332,15 +2446,6 @@ CREATE TABLE IF NOT EXISTS run_groups (
 
         tmpworkdir = tempfile.mkdtemp()
 
-        # Copy fcl file to work directory.
-
-        if file_type != 'root':
-            workfcl = os.path.join(tmpworkdir, os.path.basename(self.fclpath))
-            if os.path.abspath(self.fclpath) != os.path.abspath(workfcl):
-                print('Copying fcl from %s to %s' % (self.fclpath, workfcl))
-                larbatch_posix.copy(self.fclpath, workfcl)
-                os.remove(self.fclpath)
-
         # Copy and rename batch script to work directory.
 
         workname = 'merge-%s-%s-%s.sh' % (ubstage, ubproject, self.probj.release_tag)
@@ -2437,24 +2542,19 @@ CREATE TABLE IF NOT EXISTS run_groups (
             else:
                 print('Helper python module %s not found.' % helper_module)
 
-        # Make a tarball out of all of the files in tmpworkdir in stage.workdir
+        # Make a tarball out of all of the files in tmpworkdir.
         # Use a tarball name that is unique per invocation of this script.
 
         global worktarname
         if worktarname == None:
             worktarname = uuid.uuid4()
         tmptar = '%s/work%s.tar' % (tmpworkdir, worktarname)
+        # The fcl file is written directly into the tarball from memory.
+
         print('Work tarball = %s' % tmptar)
-        jobinfo = subprocess.Popen(['tar','-cf', tmptar, '-C', tmpworkdir,
-                                    '--mtime=2018-01-01',
-                                    '--exclude=work.tar', '.'],
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        jobout, joberr = jobinfo.communicate()
-        jobout = convert_str(jobout)
-        joberr = convert_str(joberr)
-        rc = jobinfo.poll()
-        if rc != 0:
+        try:
+            self.make_work_tarball(tmptar, tmpworkdir, fcl_text)
+        except (IOError, OSError, tarfile.TarError):
             raise RuntimeError('Failed to create work tarball in %s' % tmpworkdir)
 
         # Make sure outdir and logdir exist.
@@ -2966,81 +3066,56 @@ def check_jobsub_lite():
     return using_jobsub_lite
 
 
-# Get parent process id of the specified process id.
-# This function works by reading information from the /proc filesystem.
-# Return 0 in case of any kind of difficulty.
-
-def get_ppid(pid):
+# Lock file object of this process.
+# The lock is held for the lifetime of this process.  The kernel releases the
+# lock automatically when the process exits, however it exits.
 
-    result = 0
+lock_file = None
 
-    statfname = '/proc/%d/status' % pid
-    statf = open(statfname)
-    for line in statf.readlines():
-        if line.startswith('PPid:'):
-            words = line.split()
-            if len(words) >= 2 and words[1].isdigit():
-                result = int(words[1])
-
-    # Done.
 
-    return result
-
-
-# Check whether a similar process is already running.
+# Check whether a similar process is already running on the same database.
 # Return true if yes.
-
-def check_running(argv):
-
-    result = 0
-
-    # Find all ancestor processes, which we will ignore.
-
-    ignore_pids = set()
-    pid = os.getpid()
-    while pid > 1:
-        ignore_pids.add(pid)
-        pid = get_ppid(pid)
-
-    # Look over pids in /proc.
-
-    for pid in os.listdir('/proc'):
-        if pid.isdigit() and int(pid) not in ignore_pids:
-            procfile = os.path.join('/proc', pid)
-            try:
-                pstat = os.stat(procfile)
-
-                # Only look at processes that match this process uid.
-
-                if pstat.st_uid == os.getuid():
-
-                    # Get command line.
-
-                    cmdfile = os.path.join('/proc', pid, 'cmdline')
-                    cmd = open(cmdfile).read()
-                    words = cmd.split('\0')
-                    if len(words) > 0 and words[0].endswith('merge2.py'):
-                        result = 1
-                    if len(words) > 1 and \
-                       words[0].endswith('python') and words[1].endswith('merge2.py'):
-                        result = 1
-            except:
-                pass
-
-    # Done.
-
-    return result
+#
+# This function takes an exclusive advisory lock (flock) on lock file
+# <database>.lock, and holds it until this process exits.  Processes using
+# different databases do not interfere with each other.  The lock file records
+# the host name and process id of the lock holder (for information only).
+# The lock file is never removed.  Since the kernel releases the lock when the
+# holder exits, however it exits, a lock left behind by a dead process can not
+# block later processes.
+
+def check_running(database):
+
+    global lock_file
+
+    lock_path = '%s.lock' % os.path.abspath(database)
+    f = open(lock_path, 'a+')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+
+        # Lock is held by another process.
+
+        f.seek(0)
+        owner = f.read()
+        f.close()
+        print('Database %s is locked by %s' % (database, owner.strip()))
+        return 1
+
+    # Got lock.  Record owner.
+
+    f.seek(0)
+    f.truncate()
+    f.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+    f.flush()
+    lock_file = f
+    return 0
 
 
 # Main procedure.
 
 def main(argv):
 
-    # Sleep a random number of seconds.
-
-    sleep_sec = int(30*random.random())
-    time.sleep(sleep_sec)
-
     # Parse arguments.
 
     xmlfile = ''
@@ -3136,7 +3211,7 @@ def main(argv):
 
     # Check whether another process is already running.
 
-    if check_running(argv):
+    if check_running(database):
         print('Quitting because similar process is already running.')
         sys.exit(0)
 
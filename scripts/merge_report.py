@@ -0,0 +1,429 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: merge_report.py
+#
+# Purpose: Read-only health and statistics report for a merge2.py database.
+#
+# Created: 19-Oct-2026
+#
+# Usage:
+#
+# merge_report.py <options>
+#
+# Options:
+#
+# -h|--help           - Print help message.
+# --database <path>   - Path of sqlite database file (default "merge.db").
+# --json              - Print report as a json object (default is tables).
+# --max_groups <n>    - Maximum number of merge groups in backlog report (default 20).
+# --stuck_age <seconds> - Minimum age of a started sam project to be reported
+#                       as stuck (default 24 hours).
+#                       Optionally use suffix 'h' for hours, 'd' for days.
+#
+######################################################################
+#
+# Usage Notes.
+#
+# 1.  The database is opened in read-only mode (sqlite uri mode=ro).  This
+#     script never writes to the database, and never takes a write lock.
+#
+# 2.  The merge2.py database uses the default (rollback) journal mode, in
+#     which a reader holds a shared lock that blocks writers from committing.
+#     Therefore, each aggregate query runs in its own short read transaction
+#     (autocommit), rather than the whole report in one transaction, so that
+#     merge2.py is only blocked for the duration of a single query.  As a
+#     consequence, the report is not a consistent snapshot if merge2.py
+#     commits in the middle of the report.
+#
+# 3.  The following aggregates are reported.
+#
+#     a) Row counts of each table.
+#
+#     b) Backlog by merge group (unaffiliated unmerged files, i.e. files not
+#        yet assigned to a sam project), ordered by total size.
+#
+#     c) Bytes pending per data tier (all unmerged files in database).
+#
+#     d) Unaffiliated unmerged file age histogram (from create_date).
+#
+#     e) Sam project status counts and age histograms (from submit_time).
+#
+#     f) Sam process status counts.
+#
+#     g) Stuck sam projects (started, but older than --stuck_age).
+#
+#     h) Time-to-merge latency per merge group (from table group_summary).
+#
+# 4.  The queries are supported by indexes created by merge2.py.  If the
+#     database was last opened by an older version of merge2.py, missing
+#     indexes are reported as a warning.  Indexes are not created by this
+#     script.
+#
+######################################################################
+
+from __future__ import print_function
+import sys, os, json, sqlite3
+
+
+# Indexes expected to be created by merge2.py.
+
+expected_indexes = ('unmerged_files_name',
+                    'unmerged_files_group',
+                    'unmerged_files_project',
+                    'unmerged_files_process',
+                    'sam_projects_status',
+                    'sam_processes_status',
+                    'unmerged_files_group_date',
+                    'group_summary_oldest')
+
+# Sam project and process status names (see merge2.py).
+
+project_status_names = {0: 'Not started',
+                        1: 'Started',
+                        2: 'Ended',
+                        3: 'Finished'}
+
+process_status_names = {0: 'Not declared',
+                        1: 'Declared',
+                        2: 'Located',
+                        3: 'Finished',
+                        4: 'Error'}
+
+# Age histogram bins (seconds, label).
+
+age_bins = ((3600, '<1h'),
+            (6*3600, '1h-6h'),
+            (24*3600, '6h-1d'),
+            (3*24*3600, '1d-3d'),
+            (7*24*3600, '3d-7d'),
+            (None, '>7d'))
+
+
+def help():
+
+    filename = sys.argv[0]
+    file = open(filename, 'r')
+
+    doprint=0
+
+    for line in file.readlines():
+        if line[2:17] == 'merge_report.py':
+            doprint = 1
+        elif line[0:6] == '######' and doprint:
+            doprint = 0
+        if doprint:
+            if len(line) > 2:
+                print(line[2:].rstrip())
+            else:
+                print()
+
+
+# Open database in read-only mode.
+
+def open_database(database):
+
+    if not os.path.exists(database):
+        raise IOError('Database %s does not exist.' % database)
+    uri = 'file:%s?mode=ro' % os.path.abspath(database)
+    conn = sqlite3.connect(uri, 60., uri=True)
+    return conn
+
+
+# Return sql expression that classifies an age in seconds into an age bin.
+
+def age_bin_sql(age):
+
+    result = 'CASE'
+    for seconds, label in age_bins:
+        if seconds == None:
+            result += " ELSE '%s' END" % label
+        else:
+            result += " WHEN %s < %d THEN '%s'" % (age, seconds, label)
+    return result
+
+
+# Convert list of (label, count) rows into an ordered histogram.
+
+def histogram(rows):
+
+    counts = dict(rows)
+    return [(label, counts.get(label, 0)) for seconds, label in age_bins]
+
+
+# Calculate report.
+# Return value is a python dictionary.
+
+def make_report(conn, max_groups, stuck_age):
+
+    report = {}
+    c = conn.cursor()
+
+    # Each query is done in its own (short) read transaction.
+
+    # Check schema.
+
+    c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = set([row[0] for row in c.fetchall()])
+    for table in ('merge_groups', 'sam_projects', 'sam_processes', 'unmerged_files'):
+        if not table in tables:
+            raise RuntimeError('Database does not contain table %s.' % table)
+    c.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    indexes = set([row[0] for row in c.fetchall()])
+    report['missing_indexes'] = [index for index in expected_indexes if not index in indexes]
+
+    # Row counts.
+
+    counts = {}
+    for table in ('merge_groups', 'sam_projects', 'sam_processes', 'unmerged_files', 'run_groups'):
+        if table in tables:
+            c.execute('SELECT COUNT(*) FROM %s' % table)
+            counts[table] = c.fetchone()[0]
+    report['counts'] = counts
+
+    # Backlog by merge group.
+    # Use merge group summary table, if available.
+
+    if 'group_summary' in tables:
+        backlog_table = '''(SELECT group_id, nfiles, size,
+                                   STRFTIME('%Y-%m-%dT%H:%M:%S+00:00', oldest, 'unixepoch') AS oldest
+                            FROM group_summary WHERE nfiles>0)'''
+    else:
+        backlog_table = '''(SELECT group_id, COUNT(*) AS nfiles, SUM(size) AS size,
+                                   MIN(create_date) AS oldest
+                            FROM unmerged_files WHERE sam_project_id=0 AND sam_process_id=0
+                            GROUP BY group_id)'''
+    q = '''SELECT g.id, g.data_tier, g.data_stream, g.project, g.stage, g.run,
+                  b.nfiles, b.size, b.oldest
+           FROM %s AS b
+           JOIN merge_groups AS g ON g.id=b.group_id
+           ORDER BY b.size DESC LIMIT ?''' % backlog_table
+    c.execute(q, (max_groups,))
+    backlog = []
+    for row in c.fetchall():
+        backlog.append({'group_id': row[0],
+                        'data_tier': row[1],
+                        'data_stream': row[2],
+                        'project': row[3],
+                        'stage': row[4],
+                        'run': row[5],
+                        'nfiles': row[6],
+                        'bytes': row[7],
+                        'oldest_create_date': row[8]})
+    report['backlog'] = backlog
+
+    q = '''SELECT COUNT(*), COUNT(DISTINCT group_id), TOTAL(size) FROM unmerged_files
+           WHERE sam_project_id=0 AND sam_process_id=0'''
+    c.execute(q)
+    row = c.fetchone()
+    report['backlog_total'] = {'nfiles': row[0], 'ngroups': row[1], 'bytes': int(row[2])}
+
+    # Time-to-merge latency (time from creation of oldest unmerged file to
+    # creation of sam project) per merge group.
+
+    if 'group_summary' in tables:
+        q = '''SELECT COUNT(*), AVG(last_latency), MAX(last_latency) FROM group_summary
+               WHERE last_latency IS NOT NULL'''
+        c.execute(q)
+        row = c.fetchone()
+        latency = {'ngroups': row[0], 'average': row[1], 'maximum': row[2]}
+        q = '''SELECT s.group_id, g.data_tier, g.project, g.run,
+                      DATETIME(s.last_project_time, 'unixepoch'), s.last_latency
+               FROM group_summary AS s JOIN merge_groups AS g ON g.id=s.group_id
+               WHERE s.last_latency IS NOT NULL
+               ORDER BY s.last_latency DESC LIMIT ?'''
+        c.execute(q, (max_groups,))
+        latency['groups'] = [{'group_id': row[0],
+                              'data_tier': row[1],
+                              'project': row[2],
+                              'run': row[3],
+                              'last_project_time': row[4],
+                              'latency': row[5]} for row in c.fetchall()]
+        report['latency'] = latency
+
+    # Bytes pending per data tier.
+
+    q = '''SELECT g.data_tier, SUM(t.nfiles), SUM(t.size)
+           FROM (SELECT group_id, COUNT(*) AS nfiles, TOTAL(size) AS size
+                 FROM unmerged_files GROUP BY group_id) AS t
+           JOIN merge_groups AS g ON g.id=t.group_id
+           GROUP BY g.data_tier ORDER BY SUM(t.size) DESC'''
+    c.execute(q)
+    report['data_tiers'] = [{'data_tier': row[0], 'nfiles': row[1], 'bytes': int(row[2])}
+                            for row in c.fetchall()]
+
+    # Unaffiliated unmerged file age histogram.
+
+    age = "(CAST(strftime('%s','now') AS integer) - CAST(strftime('%s',create_date) AS integer))"
+    q = '''SELECT %s AS bin, COUNT(*) FROM unmerged_files
+           WHERE sam_project_id=0 AND sam_process_id=0 GROUP BY bin''' % age_bin_sql(age)
+    c.execute(q)
+    report['unmerged_age'] = histogram(c.fetchall())
+
+    # Sam project status counts and age histograms.
+    # Submit time is local time.
+
+    age = "(CAST(strftime('%s','now','localtime') AS integer) - CAST(strftime('%s',submit_time) AS integer))"
+    q = 'SELECT status, COUNT(*) FROM sam_projects GROUP BY status ORDER BY status'
+    c.execute(q)
+    projects = []
+    for row in c.fetchall():
+        status = row[0]
+        prj = {'status': status,
+               'name': project_status_names.get(status, 'Unknown'),
+               'count': row[1]}
+        if status > 0:
+            q = '''SELECT %s AS bin, COUNT(*) FROM sam_projects
+                   WHERE status=? AND submit_time!='' GROUP BY bin''' % age_bin_sql(age)
+            c.execute(q, (status,))
+            prj['age'] = histogram(c.fetchall())
+        projects.append(prj)
+    report['sam_projects'] = projects
+
+    # Sam process status counts.
+
+    q = 'SELECT status, COUNT(*) FROM sam_processes GROUP BY status ORDER BY status'
+    c.execute(q)
+    report['sam_processes'] = [{'status': row[0],
+                                'name': process_status_names.get(row[0], 'Unknown'),
+                                'count': row[1]} for row in c.fetchall()]
+
+    # Stuck sam projects.
+
+    q = '''SELECT id, name, group_id, cluster_id, submit_time, %s FROM sam_projects
+           WHERE status=1 AND submit_time!='' AND %s>? ORDER BY submit_time''' % (age, age)
+    c.execute(q, (stuck_age,))
+    report['stuck_projects'] = [{'id': row[0],
+                                 'name': row[1],
+                                 'group_id': row[2],
+                                 'cluster_id': row[3],
+                                 'submit_time': row[4],
+                                 'age': row[5]} for row in c.fetchall()]
+
+    # Done.
+
+    return report
+
+
+# Print report as tables.
+
+def print_report(report):
+
+    if len(report['missing_indexes']) > 0:
+        print('Warning: missing indexes: %s' % ', '.join(report['missing_indexes']))
+        print('Warning: open this database with a current version of merge2.py to create them.')
+        print()
+
+    print('Table row counts:')
+    for table in sorted(report['counts']):
+        print('  %-16s %12d' % (table, report['counts'][table]))
+
+    total = report['backlog_total']
+    print('\nBacklog: %d unaffiliated files, %d groups, %.3f GB' % (
+        total['nfiles'], total['ngroups'], total['bytes'] / 1.e9))
+    if len(report['backlog']) > 0:
+        print('  %8s  %-16s %-12s %-30s %-12s %8s %8s %10s  %s' % (
+            'Group', 'Data tier', 'Stream', 'Project', 'Stage', 'Run',
+            'Files', 'GB', 'Oldest'))
+        for g in report['backlog']:
+            print('  %8d  %-16s %-12s %-30s %-12s %8d %8d %10.3f  %s' % (
+                g['group_id'], g['data_tier'], g['data_stream'], g['project'],
+                g['stage'], g['run'], g['nfiles'], g['bytes'] / 1.e9,
+                g['oldest_create_date']))
+
+    if 'latency' in report:
+        latency = report['latency']
+        print('\nTime-to-merge latency: %d groups' % latency['ngroups'])
+        if latency['ngroups'] > 0:
+            print('  Average %.1f hours, maximum %.1f hours' % (
+                latency['average'] / 3600., latency['maximum'] / 3600.))
+            print('  %8s  %-16s %-30s %8s  %-19s %10s' % (
+                'Group', 'Data tier', 'Project', 'Run', 'Last project', 'Hours'))
+            for g in latency['groups']:
+                print('  %8d  %-16s %-30s %8d  %-19s %10.1f' % (
+                    g['group_id'], g['data_tier'], g['project'], g['run'],
+                    g['last_project_time'], g['latency'] / 3600.))
+
+    print('\nBytes pending per data tier:')
+    for t in report['data_tiers']:
+        print('  %-24s %10d files %12.3f GB' % (t['data_tier'], t['nfiles'], t['bytes'] / 1.e9))
+
+    print('\nUnaffiliated unmerged file ages:')
+    print('  ' + ' '.join(['%8s' % label for label, n in report['unmerged_age']]))
+    print('  ' + ' '.join(['%8d' % n for label, n in report['unmerged_age']]))
+
+    print('\nSam projects:')
+    for prj in report['sam_projects']:
+        print('  Status %d %-12s %8d' % (prj['status'], '(%s)' % prj['name'], prj['count']))
+        if 'age' in prj:
+            print('    ' + ' '.join(['%8s' % label for label, n in prj['age']]))
+            print('    ' + ' '.join(['%8d' % n for label, n in prj['age']]))
+
+    print('\nSam processes:')
+    for proc in report['sam_processes']:
+        print('  Status %d %-14s %8d' % (proc['status'], '(%s)' % proc['name'], proc['count']))
+
+    print('\nStuck sam projects: %d' % len(report['stuck_projects']))
+    for prj in report['stuck_projects']:
+        print('  %s  submitted %s (%.1f hours), cluster %s' % (
+            prj['name'], prj['submit_time'], prj['age'] / 3600., prj['cluster_id']))
+
+    # Done.
+
+    return
+
+
+# Main procedure.
+
+def main(argv):
+
+    # Parse arguments.
+
+    database = 'merge.db'
+    do_json = False
+    max_groups = 20
+    stuck_age = 24*3600
+
+    args = argv[1:]
+    while len(args) > 0:
+        if args[0] == '-h' or args[0] == '--help' :
+            help()
+            return 0
+        elif args[0] == '--database' and len(args) > 1:
+            database = args[1]
+            del args[0:2]
+        elif args[0] == '--json':
+            do_json = True
+            del args[0]
+        elif args[0] == '--max_groups' and len(args) > 1:
+            max_groups = int(args[1])
+            del args[0:2]
+        elif args[0] == '--stuck_age' and len(args) > 1:
+            if args[1][-1] == 'h' or args[1][-1] == 'H':
+                stuck_age = 3600 * int(args[1][:-1])
+            elif args[1][-1] == 'd' or args[1][-1] == 'D':
+                stuck_age = 24 * 3600 * int(args[1][:-1])
+            else:
+                stuck_age = int(args[1])
+            del args[0:2]
+        else:
+            print('Unknown option %s' % args[0])
+            return 1
+
+    # Calculate and print report.
+
+    conn = open_database(database)
+    report = make_report(conn, max_groups, stuck_age)
+    conn.close()
+    if do_json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print_report(report)
+
+    # Done.
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -49,7 +49,7 @@ echo $run_number
 
 TEMPLATE_FHILE="run_combinedrecotree_run1_dataOFF"
 PICKED_FHICL="run_combinedrecotree_run1_dataOFF"
-if [ "$run_number" -ge "0003420"  ] && [  "0011048" -ge "$run_number"  ];    # in the run1 and run 2a run number interval; before full CRT
+if run_periods.py --range 1a-2a "$run_number";    # in the run1 and run 2a run number interval; before full CRT
 then
         echo "run run1 fhicl"
         cat $FCL
@@ -61,7 +61,7 @@ then
         cat backup_wrapper.fcl | sed "s/run_combinedrecotree_run1_dataOFF/run_combinedrecotree_run1_dataOFF/g" > wrapper.fcl
         cat wrapper.fcl
         PICKED_FHICL="run_combinedrecotree_run1_dataOFF"
-elif [ "$run_number" -ge "0011049"  ] && [  "13696" -ge "$run_number"  ];   # run 2b after full CRT
+elif run_periods.py --range 2b "$run_number";   # run 2b after full CRT
 then
         echo "run run2b fhicl"
         cat $FCL
@@ -73,7 +73,7 @@ then
         cat backup_wrapper.fcl | sed "s/run_combinedrecotree_run1_dataOFF/run_combinedrecotree_run3_normLArPIDWeights_dataOFF/g" > wrapper.fcl
         cat wrapper.fcl
         PICKED_FHICL="run_combinedrecotree_run3_normLArPIDWeights_dataOFF"
-elif [ "$run_number" -ge "13697"  ] && [  "18960" -ge "$run_number"  ];   # run 3
+elif run_periods.py --range 3a-3b "$run_number";   # run 3
 then    
         echo "run run3 fhicl"
         cat $FCL
@@ -85,7 +85,7 @@ then
         cat backup_wrapper.fcl | sed "s/run_combinedrecotree_run1_dataOFF/run_combinedrecotree_run3_dataOFF/g" > wrapper.fcl
         cat wrapper.fcl
         PICKED_FHICL="run_combinedrecotree_run3_dataOFF"
-elif [ "$run_number" -ge "18961"  ] && [  "0025769" -ge "$run_number"  ];   # run 4 and beyond
+elif run_periods.py --range 4a-5 "$run_number";   # run 4 and beyond
 then
         echo "run run4 fhicl"
         cat $FCL
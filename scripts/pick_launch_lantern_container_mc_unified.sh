@@ -28,7 +28,7 @@ else
 fi
 echo $run_number
 
-if [ "$run_number" -ge "13697"  ] && [  "18960" -ge "$run_number"  ];   # run 3
+if run_periods.py --range 3a-3b "$run_number";   # run 3
 then
         echo "Using alternate Lantern weights."
         launch_lantern_container_mc_unified_altLArPIDWeights.sh
@@ -52,11 +52,11 @@ TEMPLATE_FHILE=$(head -n 1 $FCL)
 TEMPLATE_FHILE="${TEMPLATE_FHILE%%.*}"
 TEMPLATE_FHILE="${TEMPLATE_FHILE#*\"}"
 PICKED_FHICL=$TEMPLATE_FHILE
-if [ "$run_number" -ge "3420"  ] && [  "8316" -ge "$run_number"  ];    # in the run1 run number interval
+if run_periods.py --range 1a-1c "$run_number";    # in the run1 run number interval
 then
         echo "Using run1 wiremod fhicl"
 	PICKED_FHICL=$(echo "$TEMPLATE_FHILE" | sed -E "s/run([0-9]+)/run1/g")
-elif [ "$run_number" -ge "8317"  ] && [  "11048" -ge "$run_number"  ];   # beyond run1, so use the run3 fhicl
+elif run_periods.py --range 2a "$run_number";   # beyond run1, so use the run3 fhicl
 then
         echo "Using run3 wiremod fhicl"
         PICKED_FHICL=$(echo "$TEMPLATE_FHILE" | sed -E "s/run([0-9]+)/run3/g")